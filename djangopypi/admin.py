@@ -1,9 +1,11 @@
+from datetime import datetime
+
 from django.contrib import admin
 from django.contrib.auth.models import Group
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 from djangopypi.models import Package, Release, Classifier, \
-                              Distribution, Review
+                              Distribution, Review, APIToken, Job
 
 def full_delete_selected(self,request,queryset):
     for obj in queryset:
@@ -82,7 +84,39 @@ class EnhancedUserAdmin(UserAdmin):
 
     actions = [make_staff,]
 
+def revoke_tokens(modeladmin, request, queryset):
+    count = queryset.update(revoked=True)
+    modeladmin.message_user(request, "Revoked %d API tokens" % count)
+revoke_tokens.short_description = "Revoke selected API tokens"
+
+class APITokenAdmin(admin.ModelAdmin):
+    """ Tokens are created with the create_token command, which is the only
+    place their secret is ever shown """
+    actions = [revoke_tokens,]
+    list_display = ('name', 'user', 'scope', 'package', 'created', 'revoked')
+    list_filter = ('scope', 'revoked')
+    search_fields = ('name', 'user__username')
+
+    def has_add_permission(self, request):
+        return False
+
 admin.site.unregister(User)
+def retry_jobs(modeladmin, request, queryset):
+    count = queryset.exclude(status='running').update(status='queued',
+        attempts=0, run_after=datetime.now())
+    modeladmin.message_user(request, "Queued %d jobs again" % count)
+retry_jobs.short_description = "Retry selected jobs"
+
+class JobAdmin(admin.ModelAdmin):
+    """ Jobs are queued by the application and removed once they ran """
+    actions = [retry_jobs,]
+    list_display = ('task', 'arguments', 'status', 'attempts', 'run_after')
+    list_filter = ('status', 'task')
+    readonly_fields = ('arguments', 'started', 'last_error', 'created')
+
+    def has_add_permission(self, request):
+        return False
+
 admin.site.register(User, EnhancedUserAdmin)
 
 admin.site.register(Package,PackageModelAdmin)
@@ -90,3 +124,5 @@ admin.site.register(Release,FullDeletingModelAdmin)
 admin.site.register(Classifier)
 admin.site.register(Distribution,FullDeletingModelAdmin)
 admin.site.register(Review)
+admin.site.register(APIToken, APITokenAdmin)
+admin.site.register(Job, JobAdmin)
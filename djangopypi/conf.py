@@ -84,6 +84,7 @@ FALLBACK_VIEW = 'djangopypi.views.releases.index'
 ACTION_VIEWS = {
     "file_upload": 'djangopypi.views.distutils.register_or_upload', #``sdist`` command
     "submit": 'djangopypi.views.distutils.register_or_upload', #``register`` command
+    "file_upload_batch": 'djangopypi.views.distutils.batch_upload', #many files of one release
     "list_classifiers": 'djangopypi.views.distutils.list_classifiers', #``list_classifiers`` command
 }
 
@@ -98,16 +99,181 @@ XMLRPC_COMMANDS = {
 }
 
 """ These settings enable proxying of packages that are not in the local index 
-to another index, http://pypi.python.org/ by default. This feature is disabled 
+to another index, https://pypi.org/ by default. This feature is disabled 
 by default and can be enabled by setting DJANGOPYPI_PROXY_MISSING to True in 
 your settings file. """
-PROXY_BASE_URL = 'http://pypi.python.org/simple'
+PROXY_BASE_URL = 'https://pypi.org/simple'
 
 PROXY_MISSING = False
 
+""" Mirror packages that are not in the local index instead of redirecting to
+PROXY_BASE_URL: their simple page is fetched from there and the releases and
+files it links to are added to the index, the files themselves are fetched
+when they are first downloaded and served locally from then on. The page is
+fetched again once PROXY_CACHE_TTL seconds have passed, until then and
+whenever the upstream index cannot be reached the local copy is served.
+Files are fetched by the download_dist view, not by nginx serving files on
+its own with the download_auth view. Mirrored distributions are uploaded by
+the user PROXY_USERNAME, which is created as needed. """
+PROXY_CACHE = False
+
+PROXY_CACHE_TTL = 30 * 60
+
+PROXY_TIMEOUT = 30
+
+PROXY_USERNAME = 'proxy'
+
+""" Mirrored files are only fetched over http or https, from the host of
+PROXY_BASE_URL or one of these hosts, and only up to PROXY_MAX_FILE_SIZE
+bytes. Links and redirects elsewhere are ignored. """
+PROXY_ALLOWED_HOSTS = ('files.pythonhosted.org',)
+
+PROXY_MAX_FILE_SIZE = 1024 * 1024 * 1024
+
 """ Allow any user to maintain a package. """
 GLOBAL_OWNERSHIP = False
 
+""" How long, in seconds, the rendered simple index pages are kept in the
+cache. Pages are invalidated whenever packages, releases, distributions or
+download permissions change, in every process since the generations of the
+pages are kept in the database, so this only bounds memory use. """
+SIMPLE_CACHE_TIMEOUT = 60 * 60 * 24
+
+""" Content encodings the simple pages are stored in besides plain text, in
+order of preference. 'br' is skipped unless the brotli module is installed. """
+SIMPLE_ENCODINGS = ('br', 'gzip')
+
+""" Directory the simple index is exported to by the export_simple command.
+When set, the exported pages are also kept up to date as packages, releases,
+distributions and download permissions change. """
+SIMPLE_EXPORT_ROOT = None
+
+""" How long, in seconds, verified basic auth credentials are cached, sparing
+the password hasher on every request from pip. Cached credentials are checked
+against the user in the database on every request, they are refused as soon
+as the user's name or password changes or the user is deactivated. Set to 0
+to check the password on every request. """
+CREDENTIAL_CACHE_TIMEOUT = 5 * 60
+
+""" Size, in bytes, of the chunks uploads from distutils and twine are read
+and written to disk in. """
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+""" Size, in bytes, of the chunks distribution files are read in when they
+are served by the index itself, with the simple sendfile backend. """
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+""" Internal nginx location the upload directory is served from. When set,
+downloads are answered with an X-Accel-Redirect to the file below it once
+the permissions are checked, and nginx sends the file. Alternatively nginx
+can serve the files on its own, asking the download_auth view first::
+
+    location /media/dists/ {
+        auth_request /pypi/auth/download/;
+        alias /var/www/dists/;
+    }
+    location = /pypi/auth/download/ {
+        internal;
+        proxy_pass http://django;
+        proxy_pass_request_body off;
+        proxy_set_header Content-Length "";
+        proxy_set_header X-Original-URI $request_uri;
+    }
+"""
+DOWNLOAD_ACCEL_REDIRECT = None
+
+""" Downloads are counted in each process and written to the database in
+batches, once this many seconds have passed since the last batch or this
+many downloads have been counted, see djangopypi.counters. """
+DOWNLOAD_COUNT_FLUSH_INTERVAL = 60
+DOWNLOAD_COUNT_FLUSH_SIZE = 100
+
+""" Days of download statistics shown by default, and the number of packages
+listed as the most downloaded ones. """
+DOWNLOAD_STATS_DAYS = 30
+DOWNLOAD_STATS_TOP = 20
+
+""" The request header the download_auth view reads the path of the file
+from, as found in request.META. """
+DOWNLOAD_AUTH_URI_HEADER = 'HTTP_X_ORIGINAL_URI'
+
+""" Store distribution files content-addressed: each distinct file is kept
+once, as a blob named after its SHA-256 digest below BLOB_DIRECTORY in the
+upload directory, and every distribution file is a hard link to its blob.
+Run the content_address_distributions command once after enabling it to
+move existing files over. """
+CONTENT_ADDRESSED_STORAGE = False
+
+BLOB_DIRECTORY = '.blobs'
+
+""" How distribution files are laid out below the upload directory: 'letter'
+for one directory per first letter of the file name, 'hash' for two levels of
+directories from the SHA-256 of the file name, 'name' for one directory per
+package, or a callable taking the distribution and the file name. Existing
+files are moved to a new layout by the relocate_distributions command. """
+DISTRIBUTION_LAYOUT = 'letter'
+
+""" Directory the chunks of resumable uploads are kept in until the upload is
+finalized, by default a directory in FILE_UPLOAD_TEMP_DIR or the system's
+temporary directory. It should be on the same filesystem as the upload
+directory, so finalized files are moved rather than copied into place. """
+CHUNKED_UPLOAD_DIRECTORY = None
+
+""" Seconds after which a resumable upload that received no data expires and
+is removed by the cleanup_uploads command. """
+CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60
+
+""" The largest file, in bytes, a resumable upload may be opened for, and the
+number of resumable uploads a user may have open at once. Both bound the disk
+space uploads in progress take up in CHUNKED_UPLOAD_DIRECTORY. """
+CHUNKED_UPLOAD_MAX_SIZE = 1024 * 1024 * 1024
+
+CHUNKED_UPLOAD_MAX_SESSIONS = 10
+
+""" Run the work following an upload, such as exporting simple pages, hashing
+files added outside of uploads, extracting the metadata of uploaded files and
+search indexing, in the background: the work is queued in the database and
+done by the run_jobs command. Otherwise, as by default, it is done right
+away, inside the upload request and its transaction. Every upload then reads
+its archive for the metadata file while the client waits, which for an sdist
+means decompressing the tarball up to its PKG-INFO, so indexes receiving
+large files should enable the queue and run run_jobs workers. """
+JOB_QUEUE = False
+
+""" The tasks jobs can run, by name """
+JOB_TASKS = {
+    'export_packages': 'djangopypi.tasks.export_packages',
+    'export_classes': 'djangopypi.tasks.export_classes',
+    'hash_distribution': 'djangopypi.tasks.hash_distribution',
+    'extract_metadata': 'djangopypi.tasks.extract_metadata',
+    'update_search_index': 'djangopypi.tasks.update_search_index',
+}
+
+""" How often a failing job is tried before it is given up, and the delay, in
+seconds, before its first retry. The delay doubles with every retry. """
+JOB_MAX_ATTEMPTS = 5
+
+JOB_RETRY_DELAY = 30
+
+""" Seconds after which a running job is assumed to have lost its worker and
+is run again """
+JOB_TIMEOUT = 10 * 60
+
+""" API tokens are presented through basic auth with this user name and the
+token as the password. Tokens are scoped to either downloading or also
+uploading, optionally limited to a single package. """
+TOKEN_USERNAME = '__token__'
+
+""" Prefix of the secrets of newly created API tokens. """
+TOKEN_PREFIX = 'pypi-'
+
+""" The scopes a token can be given, as choices of the token's scope field.
+'read' tokens may only download, 'upload' tokens may upload as well. """
+TOKEN_SCOPES = (
+    ('read', 'Read only'),
+    ('upload', 'Upload'),
+)
+
 for k in dir(settings):
     if k.startswith('DJANGOPYPI_'):
         locals()[k.split('DJANGOPYPI_', 1)[1]] = getattr(settings, k)
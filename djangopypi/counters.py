@@ -0,0 +1,137 @@
+""" Download counts of distributions.
+
+Writing every download to the database would add an UPDATE to each of them.
+Instead each process counts downloads in a buffer of its own, and adds the
+aggregated counts to the distributions in a batch once
+DOWNLOAD_COUNT_FLUSH_INTERVAL seconds have passed or
+DOWNLOAD_COUNT_FLUSH_SIZE downloads have been counted, as well as when the
+process exits. The counts of a process that is killed are lost, download
+counts are approximate. """
+import atexit
+import logging
+import threading
+import time
+
+from django.db import DatabaseError, transaction
+from django.db.models import F
+
+from djangopypi import conf
+from djangopypi.http import parse_range, parse_content_range
+from djangopypi.models import Distribution
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending = {}
+_state = {'count': 0, 'flushed': time.time()}
+
+def counts_as_download(request, size=None, response=None):
+    """ Whether a request fetches a whole file of ``size`` bytes: a GET
+    answered with the whole file, or a range from its start to its end. HEAD
+    requests, revalidations answered with 304, refused ranges, probes such as
+    bytes=0-0 and resumed downloads are not downloads. Without the
+    ``response``, when the web server answers the request, conditional
+    requests do not count either, and only open ranges from the start count
+    when the size is not known. """
+    if request.method != 'GET':
+        return False
+    if response is not None:
+        if response.status_code == 200:
+            return True
+        if response.status_code != 206 or not response.has_header(
+                'Content-Range'):
+            return False
+        first, last, total = parse_content_range(
+            response['Content-Range']) or (None, None, None)
+        return first == 0 and last == total - 1
+    if ('HTTP_IF_NONE_MATCH' in request.META or
+        'HTTP_IF_MODIFIED_SINCE' in request.META):
+        return False
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return True
+    if size is None:
+        return header.replace(' ', '').lower() == 'bytes=0-'
+    # Malformed ranges are ignored and the whole file is sent
+    return parse_range(header, size) in (None, [(0, size - 1)])
+
+def count_download(request, pk, size=None, response=None):
+    """ Count a download of the distribution with the key ``pk`` and
+    ``size`` bytes, answered with ``response`` unless the web server answers
+    it, see ``counts_as_download`` """
+    if not counts_as_download(request, size, response):
+        return
+    _lock.acquire()
+    try:
+        _pending[pk] = _pending.get(pk, 0) + 1
+        _state['count'] += 1
+        due = (_state['count'] >= conf.DOWNLOAD_COUNT_FLUSH_SIZE or
+               time.time() - _state['flushed'] >=
+               conf.DOWNLOAD_COUNT_FLUSH_INTERVAL)
+    finally:
+        _lock.release()
+    if due:
+        flush_downloads()
+
+def pending_downloads():
+    """ The downloads counted by this process that are not written yet, by
+    distribution key """
+    _lock.acquire()
+    try:
+        return dict(_pending)
+    finally:
+        _lock.release()
+
+def flush_downloads():
+    """ Add the downloads counted so far to the distributions, with one
+    UPDATE per distinct count. Returns the number of distributions updated.
+    Counts that cannot be written are kept for the next flush. """
+    _lock.acquire()
+    try:
+        pending = dict(_pending)
+        _pending.clear()
+        _state['count'] = 0
+        _state['flushed'] = time.time()
+    finally:
+        _lock.release()
+
+    by_count = {}
+    for pk, count in pending.items():
+        by_count.setdefault(count, []).append(pk)
+    # The batch is written by a download request, whose transaction must
+    # survive a failed batch: on PostgreSQL a failed statement aborts it
+    managed = transaction.is_managed()
+    if managed:
+        sid = transaction.savepoint()
+    written = set()
+    try:
+        for count, pks in by_count.items():
+            Distribution.objects.filter(pk__in=pks).update(
+                downloads=F('downloads') + count)
+            written.update(pks)
+    except DatabaseError, e:
+        logger.error('Download counts could not be written: %s' % e)
+        if managed:
+            transaction.savepoint_rollback(sid)
+            written = set()
+        else:
+            transaction.rollback_unless_managed()
+        _lock.acquire()
+        try:
+            for pk, count in pending.items():
+                if pk not in written:
+                    _pending[pk] = _pending.get(pk, 0) + count
+        finally:
+            _lock.release()
+    else:
+        if managed:
+            transaction.savepoint_commit(sid)
+    return len(written)
+
+def _flush_at_exit():
+    try:
+        flush_downloads()
+    except Exception:
+        pass
+
+atexit.register(_flush_at_exit)
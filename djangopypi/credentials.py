@@ -0,0 +1,54 @@
+""" Short-lived cache of verified basic auth credentials.
+
+pip and friends send their credentials with every request, and checking them
+means running the password hasher each time. Once a set of credentials has
+been verified the user is cached under an HMAC of the Authorization header,
+so neither the header nor the password ever end up in the cache. The cache
+holds no user, only its key and an HMAC of its name and password hash: every
+hit loads the user again with a single indexed query and is only accepted
+while the user is active and the HMAC still matches. A changed password or
+name, or a deactivated user, is refused at once by every process, whether or
+not the cache is shared between them, and groups and flags are always read
+fresh. """
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from djangopypi import conf
+
+CREDENTIAL_KEY = 'djangopypi:credentials:%s'
+
+def _credential_key(authorization):
+    digest = salted_hmac('djangopypi.credentials', authorization).hexdigest()
+    return CREDENTIAL_KEY % digest
+
+def _user_check(user):
+    return salted_hmac('djangopypi.credentials.user',
+                       u'%s\0%s' % (user.username, user.password)).hexdigest()
+
+def cached_user(authorization):
+    """ Return the user previously verified for an Authorization header, or
+    None when the credentials have to be checked again """
+    if not conf.CREDENTIAL_CACHE_TIMEOUT:
+        return None
+    entry = cache.get(_credential_key(authorization))
+    if entry is None:
+        return None
+    user_id, backend, check = entry
+    try:
+        user = User.objects.get(pk=user_id)
+    except User.DoesNotExist:
+        return None
+    if not user.is_active or not constant_time_compare(_user_check(user),
+                                                       check):
+        return None
+    user.backend = backend
+    return user
+
+def remember(authorization, user):
+    """ Cache ``user`` as verified for an Authorization header """
+    if not conf.CREDENTIAL_CACHE_TIMEOUT:
+        return
+    cache.set(_credential_key(authorization),
+              (user.pk, user.backend, _user_check(user)),
+              conf.CREDENTIAL_CACHE_TIMEOUT)
@@ -36,6 +36,14 @@ def basic_auth(view_func):
         if not user:
             return HttpResponseUnauthorized('pypi')
 
+        if (getattr(user, 'api_token', None) is not None or
+            getattr(user, 'cached_credentials', False)):
+            # API tokens authenticate a single request, they never open a
+            # session. Cached credentials were logged in when they were
+            # verified, distutils does not keep the session anyway.
+            request.user = user
+            return view_func(request, *args, **kwargs)
+
         login(request, user)
         if not request.user.is_authenticated():
             return HttpResponseForbidden("Not logged in, or invalid username/"
@@ -0,0 +1,139 @@
+""" Static export of the simple index.
+
+Every permission class gets its own directory below the export root holding
+an ``index.html`` for /simple/ and a ``<package>/index.html`` for each package
+that class may download, so a front-end web server can serve the simple pages
+straight from disk. Pages are produced by the same code as the dynamic views
+and every file is written to a temporary file and renamed into place, so
+readers never see partially written pages. Compressed copies are written
+next to every page for the web server to serve as they are. """
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import Group
+
+from djangopypi import conf
+from djangopypi.models import Package
+from djangopypi.simple import INDEX_TEMPLATE, PACKAGE_TEMPLATE, \
+                              permission_packages, index_page, package_page, \
+                              available_encodings, compress
+
+def class_directory(key):
+    """ Directory name of a permission key, e.g. 'groups:1,4' -> 'groups-1-4' """
+    return key.replace(':', '-').replace(',', '-').rstrip('-')
+
+def directory_class(name):
+    """ Inverse of ``class_directory`` """
+    if name in ('superuser', 'anonymous'):
+        return name
+    if name == 'groups' or name.startswith('groups-'):
+        return 'groups:%s' % ','.join(name.split('-')[1:])
+    return None
+
+def default_classes():
+    """ The anonymous, superuser and group-less classes plus one class for the
+    members of each single group """
+    keys = ['anonymous', 'superuser', 'groups:']
+    keys.extend('groups:%d' % pk for pk in
+                Group.objects.order_by('pk').values_list('pk', flat=True))
+    return keys
+
+def exported_classes(root):
+    """ The permission keys that already have a directory below ``root`` """
+    if not os.path.isdir(root):
+        return []
+    return filter(None, map(directory_class, sorted(os.listdir(root))))
+
+def _safe_name(name):
+    """ Package names are used as directory names, refuse anything that would
+    escape the class directory """
+    return name and not name.startswith('.') and os.sep not in name
+
+def write_atomic(path, content):
+    """ Write ``content`` to ``path`` through a temporary file in the same
+    directory followed by a rename """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        fh = os.fdopen(fd, 'wb')
+        try:
+            fh.write(content)
+        finally:
+            fh.close()
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def write_page(path, page):
+    """ Write a page together with its pre-compressed variants, named the
+    way nginx' gzip_static and brotli_static modules look them up """
+    write_atomic(path, page)
+    for encoding, suffix in (('gzip', '.gz'), ('br', '.br')):
+        if encoding in available_encodings():
+            write_atomic(path + suffix, compress(page, encoding))
+        elif os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+
+class SimpleExporter(object):
+
+    def __init__(self, root=None, index_template=INDEX_TEMPLATE,
+                 package_template=PACKAGE_TEMPLATE):
+        self.root = root or conf.SIMPLE_EXPORT_ROOT
+        self.index_template = index_template
+        self.package_template = package_template
+        self._pages = {}
+
+    def _package_page(self, package):
+        if package.name not in self._pages:
+            self._pages[package.name] = u''.join(
+                package_page(package, self.package_template)[0])
+        return self._pages[package.name]
+
+    def export_class(self, key):
+        """ Write the complete tree for a permission key, removing pages of
+        packages that are no longer visible to it """
+        directory = os.path.join(self.root, class_directory(key))
+        names = set()
+        for package in permission_packages(key).iterator():
+            if not _safe_name(package.name):
+                continue
+            names.add(package.name)
+            write_page(os.path.join(directory, package.name, 'index.html'),
+                       self._package_page(package))
+        self.export_index(key)
+
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path) and name not in names:
+                shutil.rmtree(path, ignore_errors=True)
+        return len(names)
+
+    def export_index(self, key):
+        write_page(os.path.join(self.root, class_directory(key), 'index.html'),
+                   u''.join(index_page(key, self.index_template)[0]))
+
+    def export_package(self, name, keys=None):
+        """ Refresh the pages of a single package in every exported class """
+        if not _safe_name(name):
+            return
+        try:
+            package = Package.objects.get(name=name)
+        except Package.DoesNotExist:
+            package = None
+
+        for key in keys or exported_classes(self.root):
+            path = os.path.join(self.root, class_directory(key), name)
+            if (package is not None and
+                permission_packages(key).filter(pk=package.pk).exists()):
+                write_page(os.path.join(path, 'index.html'),
+                           self._package_page(package))
+            elif os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
@@ -1,13 +1,27 @@
-from django.http import HttpResponse, QueryDict
+import hashlib
+import os
+import uuid
+from cStringIO import StringIO
+
+from django.http import HttpResponse, HttpResponseNotModified, QueryDict
 from django.core.files.uploadedfile import TemporaryUploadedFile
 from django.utils.datastructures import MultiValueDict
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, \
+                              quote_etag
 from django.contrib.auth import authenticate
 
+from djangopypi import conf, credentials
+from djangopypi.models import APIToken
+
 
 class HttpResponseNotImplemented(HttpResponse):
     status_code = 501
 
 
+class HttpResponseRequestEntityTooLarge(HttpResponse):
+    status_code = 413
+
+
 class HttpResponseUnauthorized(HttpResponse):
     status_code = 401
 
@@ -16,54 +30,422 @@ class HttpResponseUnauthorized(HttpResponse):
         self['WWW-Authenticate'] = 'Basic realm="%s"' % realm
 
 
+def negotiate(request, offered):
+    """ Pick the media type from ``offered`` the client prefers according to
+    its Accept header. Ties, a missing header and nothing being acceptable
+    fall back to the earliest offered type. """
+    accept = request.META.get('HTTP_ACCEPT')
+    if not accept:
+        return offered[0]
+
+    ranges = []
+    for part in accept.split(','):
+        params = part.split(';')
+        media_range = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((media_range, quality))
+
+    def quality(media_type):
+        main_type = media_type.split('/')[0]
+        best = (-1, 0.0)
+        for media_range, q in ranges:
+            if media_range == media_type:
+                specificity = 2
+            elif media_range == '%s/*' % main_type:
+                specificity = 1
+            elif media_range == '*/*':
+                specificity = 0
+            else:
+                continue
+            best = max(best, (specificity, q))
+        return best[1]
+
+    chosen, chosen_quality = offered[0], 0.0
+    for media_type in offered:
+        q = quality(media_type)
+        if q > chosen_quality:
+            chosen, chosen_quality = media_type, q
+    return chosen
+
+def accepted_encodings(request, available):
+    """ The encodings from ``available`` the client accepts according to its
+    Accept-Encoding header, keeping the order of ``available`` """
+    accepted, rejected, wildcard = set(), set(), False
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = part.split(';')
+        coding = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding == '*':
+            wildcard = quality > 0
+        elif quality > 0:
+            accepted.add(coding)
+        else:
+            rejected.add(coding)
+    return [coding for coding in available if coding in accepted or
+            (wildcard and coding not in rejected)]
+
+def not_modified(request, etag, last_modified, alternates=()):
+    """ Return a 304 response when the client already holds the current
+    representation, otherwise None. ``alternates`` are the etags of other
+    encodings of the same representation. If-None-Match takes precedence
+    over If-Modified-Since as mandated by RFC 2616. """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        if '*' in etags:
+            etags.append(etag)
+        for candidate in (etag,) + tuple(alternates):
+            if candidate in etags:
+                return set_validators(HttpResponseNotModified(), candidate,
+                                      last_modified)
+        return None
+
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    if (if_modified_since and last_modified is not None and
+        last_modified <= if_modified_since):
+        return set_validators(HttpResponseNotModified(), etag, last_modified)
+    return None
+
+def set_validators(response, etag, last_modified):
+    """ Add ETag and Last-Modified headers to a response """
+    response['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+""" Requests for more ranges than this are answered with the whole file """
+MAX_RANGES = 16
+
+def parse_range(header, size):
+    """ Parse the Range header of a request for ``size`` bytes into a sorted
+    list of (first, last) byte positions, overlapping and adjacent ranges
+    coalesced. Returns None when the header is missing, malformed or asks for
+    too many ranges, all of which mean the whole representation is sent, and
+    an empty list when none of the ranges can be satisfied. """
+    unit, _, spec = (header or '').partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    specs = spec.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for item in specs:
+        first, separator, last = item.strip().partition('-')
+        if not separator:
+            return None
+        try:
+            if first:
+                first = int(first)
+                if last:
+                    last = int(last)
+                    if last < first:
+                        return None
+                    last = min(last, size - 1)
+                else:
+                    last = size - 1
+            else:
+                # The last bytes of the representation
+                length = int(last)
+                if length <= 0:
+                    continue
+                first, last = max(size - length, 0), size - 1
+        except ValueError:
+            return None
+        if first < size:
+            ranges.append((first, last))
+
+    ranges.sort()
+    coalesced = []
+    for first, last in ranges:
+        if coalesced and first <= coalesced[-1][1] + 1:
+            coalesced[-1] = (coalesced[-1][0], max(last, coalesced[-1][1]))
+        else:
+            coalesced.append((first, last))
+    return coalesced
+
+def range_applies(request, etag, last_modified):
+    """ Whether the Range header of a request is to be honoured: with an
+    If-Range header only while the representation still has the strong etag
+    or the modification date it names """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == quote_etag(etag)
+    return (last_modified is not None and
+            parse_http_date_safe(if_range) == last_modified)
+
+def _file_chunks(path, ranges, chunk_size):
+    """ Read the byte ranges of a file in chunks """
+    fh = open(path, 'rb')
+    try:
+        for first, last in ranges:
+            fh.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = fh.read(min(chunk_size, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+    finally:
+        fh.close()
+
+def _multipart_chunks(path, parts, closing, chunk_size):
+    for header, first, last in parts:
+        yield header
+        for chunk in _file_chunks(path, [(first, last)], chunk_size):
+            yield chunk
+    yield closing
+
+def file_response(request, path, etag=None, mimetype=None, filename=None):
+    """ Serve the file at ``path`` the way a web server would: answering
+    conditional requests, and byte range requests with 206 Partial Content,
+    as multipart/byteranges when several ranges are asked for. ``etag``
+    defaults to one made from the size and modification time of the file,
+    a ``filename`` makes the response an attachment. """
+    stat = os.stat(path)
+    size, last_modified = stat.st_size, int(stat.st_mtime)
+    etag = etag or '%x-%x' % (last_modified, size)
+    mimetype = mimetype or 'application/octet-stream'
+    chunk_size = conf.DOWNLOAD_CHUNK_SIZE
+
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
+    ranges = None
+    if range_applies(request, etag, last_modified):
+        ranges = parse_range(request.META.get('HTTP_RANGE'), size)
+
+    if ranges is None:
+        response = HttpResponse(_file_chunks(path, [(0, size - 1)],
+                                             chunk_size), mimetype=mimetype)
+        response['Content-Length'] = str(size)
+    elif not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+    elif len(ranges) == 1:
+        first, last = ranges[0]
+        response = HttpResponse(_file_chunks(path, ranges, chunk_size),
+                                mimetype=mimetype, status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+        response['Content-Length'] = str(last - first + 1)
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [('\r\n--%s\r\nContent-Type: %s\r\n'
+                  'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                  boundary, mimetype, first, last, size), first, last)
+                 for first, last in ranges]
+        closing = '\r\n--%s--\r\n' % boundary
+        response = HttpResponse(_multipart_chunks(path, parts, closing,
+                                                  chunk_size),
+            mimetype='multipart/byteranges; boundary=%s' % boundary,
+            status=206)
+        response['Content-Length'] = str(len(closing) + sum(
+            len(header) + last - first + 1 for header, first, last in parts))
+
+    response['Accept-Ranges'] = 'bytes'
+    if filename:
+        response['Content-Disposition'] = 'attachment; filename="%s"' % (
+            filename.encode('ascii', 'replace').replace('"', ''))
+    return set_validators(response, etag, last_modified)
+
+
+
+class DigestingUploadedFile(TemporaryUploadedFile):
+    """ A temporary upload file computing its MD5 and SHA-256 digests and its
+    size as it is written, sparing a second pass over the file """
+
+    def __init__(self, *args, **kwargs):
+        super(DigestingUploadedFile, self).__init__(*args, **kwargs)
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self._md5.update(data)
+        self._sha256.update(data)
+        self.size += len(data)
+        self.file.write(data)
+
+    @property
+    def md5_digest(self):
+        return self._md5.hexdigest()
+
+    @property
+    def sha256_digest(self):
+        return self._sha256.hexdigest()
+
+
+def _multipart_boundary(request):
+    """ The boundary parameter of a multipart Content-Type header, or None """
+    for param in request.META.get('CONTENT_TYPE', '').split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'boundary':
+            return value.strip().strip('"')
+    return None
+
+def read_chunks(request, chunk_size):
+    """ Read the body of a request in chunks, never asking for more than
+    Content-Length promised """
+    try:
+        remaining = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        remaining = 0
+    while remaining > 0:
+        chunk = request.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+def parse_content_range(header):
+    """ Parse a ``bytes first-last/total`` Content-Range header into a tuple
+    of integers, or return None when it is malformed """
+    unit, _, spec = (header or '').strip().partition(' ')
+    if unit.lower() != 'bytes':
+        return None
+    span, _, total = spec.partition('/')
+    first, _, last = span.partition('-')
+    try:
+        first, last, total = int(first), int(last), int(total)
+    except ValueError:
+        return None
+    if not 0 <= first <= last < total:
+        return None
+    return first, last, total
+
 def parse_distutils_request(request):
     """ This is being used because the built in request parser that Django uses,
     django.http.multipartparser.MultiPartParser is interperting the POST data
     incorrectly and/or the post data coming from distutils is invalid.
     
     One portion of this is the end marker: \r\n\r\n (what Django expects) 
-    versus \n\n (what distutils is sending). 
-    """
-    
-    try:
-        sep = request.raw_post_data.splitlines()[1]
-    except:
-        raise ValueError('Invalid post data')
-    
+    versus \n\n (what distutils is sending). Both are accepted, the line
+    endings of the first boundary decide which one a request uses.
     
+    The body is read from the request as a stream in chunks of
+    DJANGOPYPI_UPLOAD_CHUNK_SIZE bytes and file parts are spooled straight to
+    temporary files on disk, so memory use does not grow with the size of
+    the upload. Their digests are computed on the way, see
+    ``DigestingUploadedFile``.
+    """
+    chunk_size = conf.UPLOAD_CHUNK_SIZE
+    chunks = read_chunks(request, chunk_size)
+
+    def fill(buf):
+        try:
+            return buf + chunks.next()
+        except StopIteration:
+            raise ValueError('Invalid post data')
+
+    boundary = _multipart_boundary(request)
+    buf = ''
+    while True:
+        stripped = buf.lstrip()
+        if boundary is None and '\n' in stripped:
+            # distutils did not always send the boundary in the header, the
+            # first line of the body is the delimiter then
+            boundary = stripped.split('\n', 1)[0].rstrip('\r')[2:]
+        if boundary is not None:
+            start = buf.find('--' + boundary)
+            if start >= 0 and '\n' in buf[start:]:
+                break
+        if len(buf) > chunk_size * 2:
+            raise ValueError('Invalid post data')
+        buf = fill(buf)
+
+    line, buf = buf[start:].split('\n', 1)
+    crlf = line.endswith('\r')
+    header_end = crlf and '\r\n\r\n' or '\n\n'
+    delimiter = '\n--' + boundary
+    # Enough to hold a delimiter split over two chunks plus the line end in
+    # front of it, which is not part of the content
+    keep = len(delimiter) + 2
+
     request.POST = QueryDict('',mutable=True)
     try:
         request._files = MultiValueDict()
     except Exception, e:
         pass
-    
-    for part in filter(lambda e: e.strip(), request.raw_post_data.split(sep)):
-        try:
-            header, content = part.lstrip().split('\n',1)
-        except Exception, e:
-            continue
-        
-        if content.startswith('\n'):
-            content = content[1:]
-        
-        if content.endswith('\n'):
-            content = content[:-1]
-        
-        headers = parse_header(header)
-        
+
+    finished = line.rstrip('\r').endswith('--' + boundary + '--')
+    while not finished:
+        while header_end not in buf:
+            if len(buf) > chunk_size * 2:
+                raise ValueError('Invalid post data')
+            buf = fill(buf)
+        header, buf = buf.split(header_end, 1)
+
+        headers = {}
+        for header_line in header.splitlines():
+            headers.update(parse_header(header_line))
+            name, _, value = header_line.partition(':')
+            if name.strip().lower() == 'content-type':
+                headers['content-type'] = value.strip()
+
+        if "filename" in headers:
+            target = DigestingUploadedFile(name=headers["filename"],
+                content_type=headers.get('content-type',
+                                         'application/octet-stream'),
+                size=0, charset='utf-8')
+        else:
+            target = StringIO()
+
+        while True:
+            end = buf.find(delimiter)
+            if end >= 0:
+                data, buf = buf[:end], buf[end + len(delimiter):]
+                if crlf and data.endswith('\r'):
+                    data = data[:-1]
+                elif not crlf and data.endswith('\r\n'):
+                    # distutils adds a newline after content ending in \r
+                    data = data[:-1]
+                target.write(data)
+                break
+            if len(buf) > keep:
+                target.write(buf[:-keep])
+                buf = buf[-keep:]
+            buf = fill(buf)
+
+        while len(buf) < 2 or ('\n' not in buf and not buf.startswith('--')):
+            try:
+                buf = fill(buf)
+            except ValueError:
+                break
+        if buf.startswith('--'):
+            finished = True
+        elif '\n' in buf:
+            buf = buf.split('\n', 1)[1]
+        else:
+            raise ValueError('Invalid post data')
+
         if "name" not in headers:
             continue
-        
+
         if "filename" in headers:
-            dist = TemporaryUploadedFile(name=headers["filename"],
-                                         size=len(content),
-                                         content_type="application/gzip",
-                                         charset='utf-8')
-            dist.write(content)
-            dist.seek(0)
-            request.FILES.appendlist(headers['name'], dist)
+            target.seek(0)
+            request.FILES.appendlist(headers['name'], target)
         else:
-            request.POST.appendlist(headers["name"],content)
+            request.POST.appendlist(headers["name"], target.getvalue())
     return
 
 def parse_header(header):
@@ -80,14 +462,38 @@ def parse_header(header):
     return headers
     
 
+def token_user(secret):
+    """ Return the owner of an API token, carrying the token as its
+    ``api_token`` attribute, or None for an unknown or revoked token """
+    try:
+        token = APIToken.objects.get_by_secret(secret)
+    except APIToken.DoesNotExist:
+        return None
+    user = token.user
+    user.api_token = token
+    return user
+
 def login_basic_auth(request):
+    """ Authenticate the user from a basic Authorization header holding
+    either a user name and password or an API token. Verified passwords are
+    cached for a short while, so repeated requests do not run the password
+    hasher again, tokens only take a single indexed lookup. Users taken from
+    the cache are marked by a true ``cached_credentials`` attribute. """
     authentication = request.META.get("HTTP_AUTHORIZATION")
     if not authentication:
         return
+    user = credentials.cached_user(authentication)
+    if user is not None:
+        user.cached_credentials = True
+        return user
     (authmeth, auth) = authentication.split(' ', 1)
     if authmeth.lower() != "basic":
         return
     auth = auth.strip().decode("base64")
     username, password = auth.split(":", 1)
+    if username == conf.TOKEN_USERNAME:
+        return token_user(password)
     user = authenticate(username=username, password=password)
+    if user is not None:
+        credentials.remember(authentication, user)
     return user
@@ -0,0 +1,95 @@
+""" A small job queue kept in the database.
+
+Work that does not have to be finished before the response is sent is queued
+with ``enqueue``, naming a task from JOB_TASKS and giving it keyword
+arguments that can be serialized as JSON. The run_jobs command claims due
+jobs one at a time and runs them, retrying failing jobs with a growing
+delay. A job is written in the transaction of the request queuing it, so the
+work of a request that is rolled back is never done, and a job still waiting
+to run absorbs an identical one queued after it.
+
+With JOB_QUEUE off, tasks are run right away instead. """
+import logging
+import traceback
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import simplejson as json
+
+from djangopypi import conf
+from djangopypi.models import Job
+
+logger = logging.getLogger(__name__)
+
+def get_task(name):
+    task = conf.JOB_TASKS[name]
+    if isinstance(task, basestring):
+        module, func_name = task.rsplit('.', 1)
+        task = getattr(__import__(module, {}, {}, [func_name]), func_name)
+        conf.JOB_TASKS[name] = task
+    return task
+
+def enqueue(task, **kwargs):
+    """ Queue a task, or run it right away when JOB_QUEUE is off. Returns the
+    job queued, or None. """
+    if not conf.JOB_QUEUE:
+        get_task(task)(**kwargs)
+        return None
+    arguments = json.dumps(kwargs, sort_keys=True)
+    if Job.objects.filter(task=task, arguments=arguments,
+                          status='queued').exists():
+        return None
+    return Job.objects.create(task=task, arguments=arguments)
+
+def claim_job():
+    """ Claim the next job that is due, or return None when there is none.
+    Of several workers claiming the same job only one succeeds. """
+    now = datetime.now()
+    # The worker of a job running for this long has died
+    Job.objects.filter(status='running', started__lt=now - timedelta(
+        seconds=conf.JOB_TIMEOUT)).update(status='queued')
+    due = Job.objects.filter(status='queued', run_after__lte=now)
+    for pk in due.values_list('pk', flat=True)[:10]:
+        if Job.objects.filter(pk=pk, status='queued').update(
+                status='running', started=now, attempts=F('attempts') + 1):
+            return Job.objects.get(pk=pk)
+    return None
+
+@transaction.commit_on_success
+def _run_task(job):
+    get_task(job.task)(**job.kwargs)
+
+def run_job(job):
+    """ Run a claimed job, returning whether it succeeded. A job that
+    succeeds is removed, a failing one is tried again later until it used
+    up its attempts and is marked as failed. """
+    try:
+        _run_task(job)
+    except Exception:
+        error = traceback.format_exc()
+        logger.error('Job %s failed (attempt %d): %s' % (job, job.attempts,
+                                                         error))
+        if job.attempts >= conf.JOB_MAX_ATTEMPTS:
+            Job.objects.filter(pk=job.pk).update(status='failed',
+                                                 last_error=error)
+        else:
+            delay = conf.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(status='queued',
+                last_error=error,
+                run_after=datetime.now() + timedelta(seconds=delay))
+        return False
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+def run_pending(limit=None):
+    """ Run due jobs until there are none left, or ``limit`` jobs ran.
+    Returns the number of jobs run. """
+    count = 0
+    while limit is None or count < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
@@ -0,0 +1,42 @@
+"""
+Management command adding the downloads counted since its last run to the
+daily download statistics of packages and releases. Meant to be run
+periodically, e.g. hourly from cron; downloads are attributed to the day the
+command runs.
+"""
+from datetime import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangopypi.counters import flush_downloads
+from djangopypi.stats import aggregate_downloads
+
+class Command(BaseCommand):
+    help = """Add the downloads counted since the last run to the daily
+statistics."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--day',
+            dest='day',
+            default=None,
+            help='Attribute the downloads to this day, as YYYY-MM-DD, '
+                 'instead of today',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        day = options.get('day')
+        if day:
+            try:
+                day = datetime.strptime(day, '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Invalid day: %s' % day)
+
+        # Downloads counted by this process are not in the database yet
+        flush_downloads()
+        count = aggregate_downloads(day)
+
+        if verbosity:
+            print 'Aggregated the downloads of %d distributions' % count
@@ -0,0 +1,61 @@
+"""
+Management command removing resumable uploads that were abandoned: sessions
+that received no data for DJANGOPYPI_CHUNKED_UPLOAD_EXPIRY seconds, together
+with their partial files, and partial files no session refers to any more.
+Meant to be run periodically, e.g. from cron.
+"""
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from djangopypi import conf
+from djangopypi.models import UploadSession, upload_session_directory
+
+class Command(BaseCommand):
+    help = """Remove expired resumable uploads and their partial files."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Only list what would be removed',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        dry_run = options.get('dry_run')
+        verbosity = int(options.get('verbosity', 1))
+
+        expired = 0
+        for session in UploadSession.objects.expired().iterator():
+            if verbosity > 1:
+                print 'Expired: %s by %s, %d of %d bytes' % (
+                    session.filename, session.user, session.received,
+                    session.size)
+            if not dry_run:
+                session.delete()
+            expired += 1
+
+        orphaned = 0
+        directory = upload_session_directory()
+        if os.path.isdir(directory):
+            keys = set(UploadSession.objects.values_list('key', flat=True))
+            cutoff = time.time() - conf.CHUNKED_UPLOAD_EXPIRY
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                # Sessions are created before their files, young files may
+                # belong to one being created right now
+                if name in keys or os.path.getmtime(path) > cutoff:
+                    continue
+                if verbosity > 1:
+                    print 'Orphaned: %s' % path
+                if not dry_run:
+                    os.remove(path)
+                orphaned += 1
+
+        if verbosity:
+            print '%s %d expired upload sessions and %d orphaned partial files' % (
+                dry_run and 'Would remove' or 'Removed', expired, orphaned)
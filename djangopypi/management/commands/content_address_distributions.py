@@ -0,0 +1,56 @@
+"""
+Management command for moving the existing distribution files into the
+content-addressed layout, see DJANGOPYPI_CONTENT_ADDRESSED_STORAGE. Every file
+keeps its name, and so its download URL, but becomes a hard link to the blob
+holding its content, so identical files end up stored once. The command can
+be interrupted and run again, files already moved are skipped.
+"""
+import os
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from djangopypi.models import Distribution
+from djangopypi.storage import ContentAddressedStorage
+
+class Command(BaseCommand):
+    help = """Move existing distribution files into the content-addressed
+storage, keeping their download URLs."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run',
+            dest='dry_run',
+            default=False,
+            action='store_true',
+            help='Only report what would be done',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        storage = ContentAddressedStorage(
+            location=settings.DJANGOPYPI_RELEASE_UPLOAD_TO,
+            base_url=settings.DJANGOPYPI_RELEASE_URL)
+        counts = {'linked': 0, 'deduplicated': 0, None: 0, 'missing': 0}
+        saved = 0
+
+        names = Distribution.objects.order_by('pk').values_list('content',
+                                                                flat=True)
+        for name in names.iterator():
+            if not name or not storage.exists(name):
+                print "Missing: %s" % name
+                counts['missing'] += 1
+                continue
+            if options['dry_run']:
+                print "Would move: %s" % name
+                continue
+            size = os.path.getsize(storage.path(name))
+            result = storage.adopt(name)
+            counts[result] += 1
+            if result == 'deduplicated':
+                saved += size
+                print "Deduplicated: %s" % name
+
+        print "%d files moved, %d deduplicated (%d bytes freed), " \
+              "%d already moved, %d missing" % (counts['linked'],
+                counts['deduplicated'], saved, counts[None], counts['missing'])
@@ -0,0 +1,57 @@
+"""
+Management command for creating an API token. pip, twine and other tools
+present it through basic auth, with __token__ as the user name and the token
+as the password. Tokens are revoked from the admin.
+"""
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from djangopypi import conf
+from djangopypi.models import Package, APIToken
+
+class Command(BaseCommand):
+    args = '<username>'
+    help = """Create an API token for a user and print it. The token is only
+shown once, just its digest is stored."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--name',
+            dest='name',
+            default='',
+            help='Description of the token',
+        ),
+        make_option('--scope',
+            dest='scope',
+            default='read',
+            choices=[scope for scope, label in conf.TOKEN_SCOPES],
+            help='What the token may be used for: %s' % ', '.join(
+                scope for scope, label in conf.TOKEN_SCOPES),
+        ),
+        make_option('--package',
+            dest='package',
+            default=None,
+            help='Limit the token to a single package',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Expected a single user name')
+        try:
+            user = User.objects.get(username=args[0])
+        except User.DoesNotExist:
+            raise CommandError('No such user: %s' % args[0])
+
+        package = None
+        if options['package']:
+            try:
+                package = Package.objects.get_by_name(options['package'])
+            except Package.DoesNotExist:
+                raise CommandError('No such package: %s' % options['package'])
+
+        token, secret = APIToken.objects.create_token(user, options['name'],
+                                                      options['scope'],
+                                                      package)
+        print secret
@@ -0,0 +1,63 @@
+"""
+Management command for exporting the simple index to static files, one
+directory per permission class, so they can be served directly by the front
+end web server. Set DJANGOPYPI_SIMPLE_EXPORT_ROOT to have the exported files
+kept up to date as packages change after the initial export.
+"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangopypi import conf
+from djangopypi.export import SimpleExporter, default_classes, \
+                              exported_classes, class_directory, \
+                              directory_class
+from djangopypi.simple import INDEX_TEMPLATE, PACKAGE_TEMPLATE
+
+class Command(BaseCommand):
+    args = '[permission key ...]'
+    help = """Export the simple index to static files. Each argument is a
+permission key: 'anonymous', 'superuser' or 'groups:' followed by a comma
+separated list of group ids, e.g. 'groups:1,4' for the members of exactly
+those two groups. Without arguments the anonymous and superuser classes, the
+group-less class, one class per group and any class exported earlier are
+written."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--root',
+            dest='root',
+            default=None,
+            help='Directory to export to, defaults to '
+                 'DJANGOPYPI_SIMPLE_EXPORT_ROOT',
+        ),
+        make_option('--index-template',
+            dest='index_template',
+            default=INDEX_TEMPLATE,
+            help='Template used for the index pages',
+        ),
+        make_option('--package-template',
+            dest='package_template',
+            default=PACKAGE_TEMPLATE,
+            help='Template used for the package pages',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        root = options['root'] or conf.SIMPLE_EXPORT_ROOT
+        if not root:
+            raise CommandError('No export directory, use --root or set '
+                               'DJANGOPYPI_SIMPLE_EXPORT_ROOT')
+
+        keys = list(args)
+        for key in keys:
+            if directory_class(class_directory(key)) != key:
+                raise CommandError('Invalid permission key: %s' % key)
+        if not keys:
+            keys = default_classes()
+            keys.extend(k for k in exported_classes(root) if k not in keys)
+
+        exporter = SimpleExporter(root, options['index_template'],
+                                  options['package_template'])
+        for key in keys:
+            count = exporter.export_class(key)
+            print "Exported %d packages to %s" % (count, class_directory(key))
@@ -0,0 +1,80 @@
+"""
+Management command reading the metadata files of distributions uploaded
+before the index read them itself, or all of them again with --all. The
+archives are read by a pool of worker processes, the metadata is stored by
+the command.
+"""
+import os
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from djangopypi import simple
+from djangopypi.metadata import read_metadata, store_metadata
+from djangopypi.models import Distribution
+
+def _read(args):
+    pk, path, filename = args
+    return pk, read_metadata(path, filename)
+
+class Command(BaseCommand):
+    help = """Read the metadata files of distributions without one."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Read the metadata of every distribution again',
+        ),
+        make_option('--processes',
+            dest='processes',
+            type='int',
+            default=None,
+            help='Number of worker processes reading archives, by default '
+                 'one per CPU',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        distributions = Distribution.objects.all()
+        if not options['all']:
+            distributions = distributions.filter(metadata_digest='')
+
+        storage = Distribution._meta.get_field('content').storage
+        work = [(pk, storage.path(content), os.path.basename(content))
+                for pk, content in distributions.values_list('pk', 'content')]
+        # The workers must not share the connection of the command
+        connection.close()
+
+        read = missing = 0
+        packages = set()
+        pool = Pool(options['processes'])
+        try:
+            for pk, text in pool.imap_unordered(_read, work):
+                if text is None:
+                    missing += 1
+                    if verbosity > 1:
+                        print 'No metadata: %s' % pk
+                    continue
+                dist = Distribution.objects.select_related('release').get(
+                    pk=pk)
+                store_metadata(dist, text)
+                transaction.commit_unless_managed()
+                packages.add(dist.release.package_id)
+                read += 1
+                if verbosity > 1:
+                    print 'Read: %s' % dist.filename
+        finally:
+            pool.close()
+            pool.join()
+
+        for name in packages:
+            simple.invalidate_package(name)
+
+        if verbosity:
+            print 'Read the metadata of %d distributions, %d have none' % (
+                read, missing)
@@ -257,7 +257,7 @@ class Command(BaseCommand):
                 # Create the directory if necessary
                 upload_folder = os.path.dirname(upload_path)
                 if not os.path.exists(upload_folder):
-                    os.mkdir(upload_folder)
+                    os.makedirs(upload_folder)
                 shutil.copyfile(self._curfile, upload_path)
             else:
                 self.log.warn('File already exists: %s' % upload_path)
@@ -62,7 +62,7 @@ added"""
 
         try:
             # can't use get_or_create as that demands there be an owner
-            package = Package.objects.get(name=meta.name)
+            package = Package.objects.get_by_name(meta.name)
             isnewpackage = False
         except Package.DoesNotExist:
             package = Package(name=meta.name)
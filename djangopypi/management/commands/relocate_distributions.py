@@ -0,0 +1,121 @@
+"""
+Management command for moving existing distribution files to the layout set
+by DJANGOPYPI_DISTRIBUTION_LAYOUT. Files are processed in batches, each file
+is first linked (or copied) to its new name, then its row is pointed at it
+and only then is the old name removed, so every file stays downloadable
+throughout. The command can be interrupted and run again at any time, or be
+resumed from the last primary key it reported with --start.
+"""
+import errno
+import filecmp
+import os
+import shutil
+import uuid
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from djangopypi import conf, simple
+from djangopypi.export import SimpleExporter
+from djangopypi.models import Distribution, distribution_upload_to
+
+class Command(BaseCommand):
+    help = """Move distribution files to the configured layout."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+            dest='batch_size',
+            default=500,
+            type='int',
+            help='Number of distributions handled per batch',
+        ),
+        make_option('--start',
+            dest='start',
+            default=0,
+            type='int',
+            help='Only handle distributions with a larger primary key',
+        ),
+        make_option('--keep-old',
+            dest='keep_old',
+            default=False,
+            action='store_true',
+            help='Leave the files at their old names as well, for front end '
+                 'servers serving them directly',
+        ),
+        make_option('--dry-run',
+            dest='dry_run',
+            default=False,
+            action='store_true',
+            help='Only report what would be moved',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        storage = Distribution._meta.get_field('content').storage
+        moved = missing = 0
+        last = options['start']
+
+        while True:
+            batch = list(Distribution.objects.filter(pk__gt=last).order_by(
+                'pk').select_related('release__package')[:options['batch_size']])
+            if not batch:
+                break
+            packages = set()
+            for dist in batch:
+                last = dist.pk
+                old = dist.content.name
+                new = distribution_upload_to(dist, os.path.basename(old))
+                if old == new:
+                    continue
+                if not storage.exists(old):
+                    print "Missing: %s" % old
+                    missing += 1
+                    continue
+                if options['dry_run']:
+                    print "Would move %s to %s" % (old, new)
+                    continue
+
+                new = self.link(storage, old, new)
+                if Distribution.objects.filter(pk=dist.pk,
+                                               content=old).update(content=new):
+                    if not options['keep_old']:
+                        storage.delete(old)
+                    packages.add(dist.release.package_id)
+                    moved += 1
+
+            # Rows were updated in bulk, bypassing the signals that keep the
+            # simple pages current
+            for name in packages:
+                simple.invalidate_package(name)
+                if conf.SIMPLE_EXPORT_ROOT:
+                    SimpleExporter().export_package(name)
+            print "Handled distributions up to %d" % last
+
+        print "%d files moved, %d missing" % (moved, missing)
+
+    def link(self, storage, old, new):
+        """ Give the file ``old`` the additional name ``new``, returning the
+        name actually used. A file already linked by an interrupted run is
+        reused. """
+        old_path = storage.path(old)
+        directory = os.path.dirname(storage.path(new))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        while True:
+            new_path = storage.path(new)
+            try:
+                os.link(old_path, new_path)
+            except OSError, e:
+                if e.errno == errno.EEXIST:
+                    if filecmp.cmp(old_path, new_path, shallow=False):
+                        return new
+                    new = storage.get_available_name(new)
+                    continue
+                if e.errno not in (errno.EXDEV, errno.EPERM):
+                    raise
+                # No hard links here, copy to a temporary name first so the
+                # new name never holds a partial file
+                tmp_path = '%s.%s.tmp' % (new_path, uuid.uuid4().hex)
+                shutil.copy2(old_path, tmp_path)
+                os.rename(tmp_path, new_path)
+            return new
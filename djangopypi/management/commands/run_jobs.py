@@ -0,0 +1,79 @@
+"""
+Management command running the jobs queued while DJANGOPYPI_JOB_QUEUE is on.
+Any number of workers may run side by side, each job is claimed by exactly
+one of them, --processes starts several in one go.
+"""
+import time
+from multiprocessing import Process
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from djangopypi.jobs import claim_job, run_job
+
+class Command(BaseCommand):
+    help = """Run queued jobs, waiting for new ones unless --once is given."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--once',
+            action='store_true',
+            dest='once',
+            default=False,
+            help='Exit as soon as no job is due',
+        ),
+        make_option('--interval',
+            dest='interval',
+            type='float',
+            default=5,
+            help='Seconds to wait before looking for new jobs when none is '
+                 'due',
+        ),
+        make_option('--limit',
+            dest='limit',
+            type='int',
+            default=None,
+            help='Exit after running this many jobs',
+        ),
+        make_option('--processes',
+            dest='processes',
+            type='int',
+            default=1,
+            help='Number of worker processes, each running jobs on its own',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            return self.work(**options)
+        # The workers must not share the connection of the command
+        connection.close()
+        workers = [Process(target=self.work, kwargs=options)
+                   for i in range(options['processes'])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def work(self, **options):
+        """ Run jobs in this process """
+        verbosity = int(options.get('verbosity', 1))
+        limit = options['limit']
+        count = failed = 0
+
+        while limit is None or count < limit:
+            job = claim_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+            succeeded = run_job(job)
+            count += 1
+            if not succeeded:
+                failed += 1
+            if verbosity > 1:
+                print '%s %s' % (succeeded and 'Done' or 'Failed', job)
+
+        if verbosity:
+            print 'Ran %d jobs, %d failed' % (count, failed)
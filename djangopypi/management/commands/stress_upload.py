@@ -0,0 +1,147 @@
+"""
+Management command firing concurrent uploads at a running index, e.g. the
+development server, to check that uploads are safe under concurrency. Every
+file is uploaded several times at once: exactly one copy of each must be
+accepted, the others refused, and no upload may fail with a server error.
+Run against the database of the server, the stored distributions are checked
+as well and removed again afterwards.
+"""
+import os
+import base64
+import socket
+import threading
+import time
+import urllib2
+import uuid
+from hashlib import md5
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangopypi.models import Package, Release
+
+def encode_upload(fields, filename, content):
+    """ Encode an upload the way twine does """
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields:
+        lines.extend(['--' + boundary,
+                      'Content-Disposition: form-data; name="%s"' % name,
+                      '', value])
+    lines.extend(['--' + boundary,
+                  'Content-Disposition: form-data; name="content"; '
+                  'filename="%s"' % filename,
+                  'Content-Type: application/octet-stream', '', content,
+                  '--' + boundary + '--', ''])
+    return 'multipart/form-data; boundary=%s' % boundary, '\r\n'.join(lines)
+
+class Command(BaseCommand):
+    args = '<url>'
+    help = """Upload files concurrently to the index at <url>, e.g.
+http://localhost:8000/, and check the outcome."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--username', dest='username', default=None,
+            help='User to upload as'),
+        make_option('--password', dest='password', default=None,
+            help='Password or API token of the user'),
+        make_option('--package', dest='package', default='stress-test',
+            help='Package to upload to'),
+        make_option('--files', dest='files', default=20, type='int',
+            help='Number of distinct files'),
+        make_option('--copies', dest='copies', default=3, type='int',
+            help='Number of concurrent uploads of every file'),
+        make_option('--keep', dest='keep', default=False,
+            action='store_true',
+            help='Keep the uploaded release'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or not options['username']:
+            raise CommandError('Expected the url of the index and --username')
+        url = args[0]
+        version = 'stress%d' % time.time()
+        auth = 'Basic %s' % base64.b64encode('%s:%s' % (options['username'],
+                                                        options['password']))
+        uploads = []
+        for i in range(options['files']):
+            filename = '%s-%s-py2-none-plat%d.whl' % (options['package'],
+                                                      version, i)
+            content = os.urandom(64 * 1024)
+            fields = [(':action', 'file_upload'), ('protocol_version', '1'),
+                      ('name', options['package']), ('version', version),
+                      ('metadata_version', '1.0'), ('filetype', 'bdist_wheel'),
+                      ('pyversion', 'py2'),
+                      ('md5_digest', md5(content).hexdigest())]
+            uploads.extend([(filename, encode_upload(fields, filename,
+                                                     content))] *
+                           options['copies'])
+
+        start = threading.Event()
+        results = []
+
+        def upload(filename, (content_type, body)):
+            request = urllib2.Request(url, body, {
+                'Content-Type': content_type, 'Authorization': auth})
+            start.wait()
+            try:
+                status = urllib2.urlopen(request).getcode()
+            except urllib2.HTTPError, e:
+                status = e.code
+            except urllib2.URLError, e:
+                status = str(e.reason)
+            except socket.error, e:
+                status = str(e)
+            results.append((filename, status))
+
+        threads = [threading.Thread(target=upload, args=item)
+                   for item in uploads]
+        for thread in threads:
+            thread.start()
+        started = time.time()
+        start.set()
+        for thread in threads:
+            thread.join()
+        print "%d uploads in %.2f seconds" % (len(uploads),
+                                              time.time() - started)
+
+        errors = []
+        for filename in sorted(set(name for name, data in uploads)):
+            statuses = sorted(status for name, status in results
+                              if name == filename)
+            if statuses != [200] + [400] * (options['copies'] - 1):
+                errors.append('%s: %s' % (filename, statuses))
+        errors.extend(self.check_database(options['package'], version,
+                                          options['files']))
+
+        if not options['keep']:
+            # Release.delete removes the files of its distributions, a bulk
+            # delete of the query set would leave them on disk
+            for release in Release.objects.filter(package=options['package'],
+                                                  version=version):
+                release.delete()
+        if errors:
+            raise CommandError('\n'.join(errors))
+        print "All uploads behaved"
+
+    def check_database(self, package, version, files):
+        """ Check the stored distributions when the database is shared with
+        the server """
+        try:
+            release = Release.objects.get(package=package, version=version)
+        except Release.DoesNotExist:
+            if Package.objects.exists():
+                return ['The release %s was not created' % version]
+            print "Not sharing the database with the server, skipping checks"
+            return []
+        errors = []
+        dists = list(release.distributions.all())
+        if len(dists) != files:
+            errors.append('%d distributions stored instead of %d' % (
+                len(dists), files))
+        for dist in dists:
+            if not dist.filename.startswith('%s-%s-' % (package, version)):
+                errors.append('Stored under a renamed file: %s' % dist.filename)
+            elif not dist.content.storage.exists(dist.content.name):
+                errors.append('Missing file: %s' % dist.content.name)
+        return errors
@@ -72,7 +72,10 @@ class Command(BaseCommand):
         okay = 0
 
         for dist in Distribution.objects.all():
-            if not dist.content.storage.exists(dist.content.path):
+            if not dist.fetched:
+                # Mirrored files are fetched when first downloaded
+                okay += 1
+            elif not dist.content.storage.exists(dist.content.path):
                 self.log(dist, 'Distribution not found')
                 if self.options.remove:
                     self.remove_dist(dist)
@@ -0,0 +1,147 @@
+""" Metadata of distribution files, read on the server.
+
+The PKG-INFO of an sdist or egg and the METADATA of a wheel are read straight
+from the archive: zip files through their central directory, reading just
+the one member, and tarballs as a stream up to the member, without unpacking
+anything. The metadata is kept on the distribution as it is, to be served
+next to the file (PEP 658), and merged into the package info of its release,
+taking precedence over the fields clients post when uploading. """
+import os
+import tarfile
+import zipfile
+from hashlib import sha256
+
+from pkginfo import Distribution as Metadata
+
+from djangopypi import conf
+from djangopypi.models import Distribution
+from djangopypi.utils import normalize_name
+
+""" Larger metadata files are not read """
+MAX_METADATA_SIZE = 1024 * 1024
+
+ZIP_EXTENSIONS = ('.whl', '.egg', '.zip')
+TAR_EXTENSIONS = ('.tar.gz', '.tgz', '.tar.bz2', '.tbz', '.tar')
+
+# Package info fields whose pkginfo attribute has another name
+ATTRIBUTES = {
+    'platform': 'platforms',
+    'supported_platform': 'supported_platforms',
+    'classifier': 'classifiers',
+    'project_url': 'project_urls',
+}
+
+def _zip_member(names, filename):
+    """ The metadata member among the names of a zip archive """
+    if filename.endswith('.whl'):
+        # {name}-{version}.dist-info/METADATA, the wheel's own first
+        prefix = '-'.join(os.path.basename(filename).split('-')[:2])
+        candidates = [name for name in names if name.count('/') == 1 and
+                      name.endswith('.dist-info/METADATA')]
+        candidates.sort(key=lambda name: not name.startswith(prefix))
+    elif filename.endswith('.egg'):
+        candidates = [name for name in names if name == 'EGG-INFO/PKG-INFO']
+    else:
+        candidates = [name for name in names if name.count('/') == 1 and
+                      name.endswith('/PKG-INFO')]
+    return candidates and candidates[0] or None
+
+def _read_zip(path, filename):
+    archive = zipfile.ZipFile(path)
+    try:
+        member = _zip_member(archive.namelist(), filename)
+        if member is None or archive.getinfo(member).file_size > \
+                MAX_METADATA_SIZE:
+            return None
+        return archive.read(member)
+    finally:
+        archive.close()
+
+def _read_tar(path):
+    archive = tarfile.open(path, mode='r|*')
+    try:
+        for member in archive:
+            name = member.name
+            if name.startswith('./'):
+                name = name[2:]
+            if (member.isfile() and name.count('/') == 1 and
+                name.endswith('/PKG-INFO')):
+                if member.size > MAX_METADATA_SIZE:
+                    return None
+                return archive.extractfile(member).read()
+    finally:
+        archive.close()
+    return None
+
+def read_metadata(path, filename=None):
+    """ The metadata file of the distribution at ``path``, as unicode, or
+    None when it has none or is not a distribution this knows about.
+    ``filename`` is the name of the distribution, by default that of
+    ``path``. """
+    filename = (filename or os.path.basename(path)).lower()
+    try:
+        if filename.endswith(ZIP_EXTENSIONS):
+            data = _read_zip(path, filename)
+        elif filename.endswith(TAR_EXTENSIONS):
+            data = _read_tar(path)
+        else:
+            return None
+    except (IOError, EOFError, zipfile.BadZipfile, tarfile.TarError):
+        return None
+    if data is None:
+        return None
+    return data.decode('utf-8', 'replace')
+
+def metadata_digest(text):
+    """ The SHA-256 of a metadata file as it is served """
+    return sha256(text.encode('utf-8')).hexdigest()
+
+def parse_metadata(text):
+    """ Parse a metadata file with pkginfo """
+    metadata = Metadata()
+    metadata.parse(text.encode('utf-8'))
+    return metadata
+
+def metadata_version(metadata):
+    """ The metadata version of the package info built from ``metadata``.
+    Versions the index has no fields for are stored as the newest it has. """
+    if metadata.metadata_version in conf.METADATA_FIELDS:
+        return metadata.metadata_version
+    return max(conf.METADATA_FIELDS.keys())
+
+def package_info(metadata, version=None):
+    """ The package info fields of a parsed metadata file, as a dictionary
+    of lists, for the fields of the metadata version ``version`` """
+    info = {}
+    for field in conf.METADATA_FIELDS[version or metadata_version(metadata)]:
+        value = getattr(metadata, ATTRIBUTES.get(field, field), None)
+        if not value:
+            continue
+        if isinstance(value, basestring):
+            value = [value]
+        value = [v for v in value if v != 'UNKNOWN']
+        if value:
+            info[field] = list(value)
+    return info
+
+def store_metadata(distribution, text):
+    """ Keep the metadata file on a distribution and merge its fields into
+    the package info of the release, when it describes that release """
+    distribution.metadata = text
+    distribution.metadata_digest = metadata_digest(text)
+    Distribution.objects.filter(pk=distribution.pk).update(
+        metadata=distribution.metadata,
+        metadata_digest=distribution.metadata_digest)
+
+    metadata = parse_metadata(text)
+    release = distribution.release
+    if (normalize_name(metadata.name or '') !=
+            normalize_name(release.package_id) or
+        metadata.version != release.version):
+        return False
+    version = max(release.metadata_version, metadata_version(metadata))
+    for field, values in package_info(metadata, version).items():
+        release.package_info.setlist(field, values)
+    release.metadata_version = version
+    release.save()
+    return True
@@ -4,16 +4,13 @@ from south.db import db
 from south.v2 import DataMigration
 from django.db import models
 
-from django.contrib.auth.models import Group
-from djangopypi.models import Package
-
 class Migration(DataMigration):
 
     def forwards(self, orm):
         "Write your forwards methods here."
-        num_groups = Group.objects.count()
+        num_groups = orm['auth.Group'].objects.count()
 
-        for package in Package.objects.all():
+        for package in orm['djangopypi.Package'].objects.all():
             if package.download_permissions.count() == num_groups:
                 package.allow_authenticated = True
                 package.save()
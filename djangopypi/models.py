@@ -1,7 +1,11 @@
 import os
 import logging
+import tempfile
+from datetime import datetime, timedelta
+from hashlib import sha256
 
 from django.db import models
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.storage import FileSystemStorage
 from django.utils.translation import ugettext_lazy as _
 from django.utils import simplejson as json
@@ -12,6 +16,9 @@ from django.dispatch import receiver
 from django.conf import settings
 
 from djangopypi import conf
+from djangopypi.storage import ContentAddressedStorage
+from djangopypi.utils import normalize_name, generate_token, token_digest, \
+                             digest_fragment
 
 class PackageInfoField(models.Field):
     description = u'Python Package Information Field'
@@ -57,9 +64,18 @@ class Classifier(models.Model):
     def __unicode__(self):
         return self.name
 
+class PackageManager(models.Manager):
+    def get_by_name(self, name):
+        """ Look a package up by any spelling that normalizes to its name """
+        return self.get(normalized_name=normalize_name(name))
+
 class Package(models.Model):
     name = models.CharField(max_length=255, unique=True, primary_key=True,
                             editable=False)
+    # Spellings that normalize alike name the same package, so an upload
+    # under another spelling cannot shadow a package it does not own
+    normalized_name = models.CharField(max_length=255, unique=True,
+                                       editable=False)
     auto_hide = models.BooleanField(default=True, blank=False)
     allow_comments = models.BooleanField(default=True, blank=False)
     owners = models.ManyToManyField(Group, blank=True,
@@ -78,6 +94,11 @@ class Package(models.Model):
     )
     maintainers = models.ManyToManyField(Group, blank=True,
                                          related_name="packages_maintained")
+    proxied = models.DateTimeField(null=True, blank=True, editable=False,
+        help_text="When the package was last fetched from the upstream "
+                  "index, for packages mirrored from it")
+
+    objects = PackageManager()
 
     class Meta:
         verbose_name = _(u"package")
@@ -99,6 +120,10 @@ class Package(models.Model):
         except Release.DoesNotExist:
             return None
 
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super(Package, self).save(*args, **kwargs)
+
     def get_release(self, version):
         """Return the release object for version, or None"""
         try:
@@ -141,6 +166,12 @@ class Release(models.Model):
     def description(self):
         return self.package_info.get('description', u'')
 
+    @property
+    def downloads(self):
+        """ The downloads of all the files of the release """
+        return self.distributions.aggregate(
+            downloads=models.Sum('downloads'))['downloads'] or 0
+
     @property
     def classifiers(self):
         return self.package_info.getlist('classifier')
@@ -156,17 +187,67 @@ class Release(models.Model):
         super(Release,self).delete(*args,**kwargs)
 
 
+def letter_layout(instance, filename):
+    """ ``f/foo-1.0.tar.gz`` """
+    return os.path.join(filename[:1].lower(), filename)
+
+def hash_layout(instance, filename):
+    """ ``ab/cd/foo-1.0.tar.gz``, sharded by the SHA-256 of the file name so
+    the location never depends on anything but the name """
+    digest = sha256(filename.encode('utf-8')).hexdigest()
+    return os.path.join(digest[:2], digest[2:4], filename)
+
+def name_layout(instance, filename):
+    """ ``foo/foo-1.0.tar.gz``, by the normalized name of the package, falling
+    back to the letter layout for files without a release """
+    try:
+        name = instance.release.package.normalized_name
+    except (AttributeError, ObjectDoesNotExist):
+        return letter_layout(instance, filename)
+    return os.path.join(name, filename)
+
+DISTRIBUTION_LAYOUTS = {
+    'letter': letter_layout,
+    'hash': hash_layout,
+    'name': name_layout,
+}
+
+def distribution_upload_to(instance, filename):
+    """ The name a distribution file is stored under, according to
+    DJANGOPYPI_DISTRIBUTION_LAYOUT """
+    layout = conf.DISTRIBUTION_LAYOUT
+    if not callable(layout):
+        layout = DISTRIBUTION_LAYOUTS[layout]
+    return layout(instance, filename)
+
 class Distribution(models.Model):
     release = models.ForeignKey(Release, related_name="distributions",
                                 editable=False)
+    # Layouts add directories to long wheel names, the default of 100
+    # characters is not enough
     content = models.FileField(
-        upload_to=lambda i, f: os.path.join(f[:1].lower(), f),
-        storage=FileSystemStorage(
+        upload_to=distribution_upload_to, max_length=255,
+        storage=(conf.CONTENT_ADDRESSED_STORAGE and ContentAddressedStorage
+                 or FileSystemStorage)(
             location=settings.DJANGOPYPI_RELEASE_UPLOAD_TO,
             base_url=settings.DJANGOPYPI_RELEASE_URL,
         ),
     )
     md5_digest = models.CharField(max_length=32, blank=True, editable=False)
+    sha256_digest = models.CharField(max_length=64, blank=True, editable=False)
+    size = models.BigIntegerField(null=True, editable=False)
+    metadata = models.TextField(blank=True, editable=False,
+        help_text="The PKG-INFO or METADATA file of the distribution")
+    metadata_digest = models.CharField(max_length=64, blank=True,
+                                       editable=False)
+    upstream_url = models.CharField(max_length=1024, blank=True,
+        editable=False,
+        help_text="Where a distribution mirrored from the upstream index "
+                  "is fetched from")
+    downloads = models.PositiveIntegerField(default=0, editable=False)
+    downloads_aggregated = models.PositiveIntegerField(default=0,
+        editable=False,
+        help_text="The downloads already added to the daily statistics")
     filetype = models.CharField(max_length=32, blank=False,
                                 choices=conf.DIST_FILE_TYPES)
     pyversion = models.CharField(max_length=16, blank=True,
@@ -192,12 +273,34 @@ class Distribution(models.Model):
         return self.content.name
 
     def get_absolute_url(self):
-        return "%s#md5=%s" % (self.content.url, self.md5_digest)
+        return self.content.url + digest_fragment(self.md5_digest,
+                                                  self.sha256_digest)
+
+    @property
+    def fetched(self):
+        """ Whether the file is stored locally. The files of mirrored
+        distributions are fetched when they are first downloaded. """
+        return not self.upstream_url or self.size is not None
+
+    @property
+    def file_size(self):
+        """ The size of the file, or None while a mirrored file is not
+        fetched yet """
+        if self.size is None and self.fetched:
+            return self.content.size
+        return self.size
+
+    @property
+    def metadata_url(self):
+        """ Where the metadata file is served, next to the file (PEP 658) """
+        return self.content.url + '.metadata'
 
     class Meta:
         verbose_name = _(u"distribution")
         verbose_name_plural = _(u"distributions")
-        unique_together = ("release", "filetype", "pyversion")
+        # Wheels for several platforms share their file type and Python
+        # version, it is the file name that has to be unique
+        unique_together = (("content",),)
 
     def __unicode__(self):
         return self.filename
@@ -209,6 +312,40 @@ class Distribution(models.Model):
             pass
         super(Distribution,self).delete(*args,**kwargs)
 
+class PackageDownloadDay(models.Model):
+    """ The downloads of the files of a package on one day, maintained by the
+    aggregate_downloads command """
+    package = models.ForeignKey(Package, related_name="download_days",
+                                editable=False)
+    day = models.DateField(db_index=True, editable=False)
+    downloads = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        verbose_name = _(u"package downloads per day")
+        verbose_name_plural = _(u"package downloads per day")
+        unique_together = ("package", "day")
+        ordering = ("day",)
+
+    def __unicode__(self):
+        return u"%s %s" % (self.package_id, self.day)
+
+class ReleaseDownloadDay(models.Model):
+    """ The downloads of the files of a release on one day, maintained by the
+    aggregate_downloads command """
+    release = models.ForeignKey(Release, related_name="download_days",
+                                editable=False)
+    day = models.DateField(editable=False)
+    downloads = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        verbose_name = _(u"release downloads per day")
+        verbose_name_plural = _(u"release downloads per day")
+        unique_together = ("release", "day")
+        ordering = ("day",)
+
+    def __unicode__(self):
+        return u"%s %s" % (self.release, self.day)
+
 class Review(models.Model):
     release = models.ForeignKey(Release, related_name="reviews")
     rating = models.PositiveSmallIntegerField(blank=True)
@@ -218,6 +355,147 @@ class Review(models.Model):
         verbose_name = _(u'release review')
         verbose_name_plural = _(u'release reviews')
 
+class APITokenManager(models.Manager):
+    def create_token(self, user, name='', scope='read', package=None):
+        """ Create a token, returning it together with its secret. Only a
+        digest of the secret is stored, it cannot be recovered later. """
+        secret = generate_token(conf.TOKEN_PREFIX)
+        token = self.create(user=user, name=name, scope=scope,
+                            package=package, digest=token_digest(secret))
+        return token, secret
+
+    def get_by_secret(self, secret):
+        """ Look up the active token for a secret through its digest """
+        return self.select_related('user').get(digest=token_digest(secret),
+                                               revoked=False,
+                                               user__is_active=True)
+
+class APIToken(models.Model):
+    user = models.ForeignKey(User, related_name="api_tokens")
+    name = models.CharField(max_length=255, blank=True)
+    digest = models.CharField(max_length=64, unique=True, editable=False)
+    scope = models.CharField(max_length=16, choices=conf.TOKEN_SCOPES,
+                             default='read')
+    package = models.ForeignKey(Package, related_name="api_tokens",
+                                null=True, blank=True,
+                                help_text="Limit the token to this package")
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    revoked = models.BooleanField(default=False)
+
+    objects = APITokenManager()
+
+    class Meta:
+        verbose_name = _(u"API token")
+        verbose_name_plural = _(u"API tokens")
+        ordering = ('-created',)
+
+    def __unicode__(self):
+        return self.name or u'%s token %s' % (self.user, self.pk)
+
+    def allows(self, package=None, upload=False):
+        """ Whether the token may be used for ``package``, a package or a
+        package name, and for uploading when ``upload`` is set """
+        if upload and self.scope != 'upload':
+            return False
+        if self.package_id is None or package is None:
+            return True
+        name = getattr(package, 'name', package)
+        return normalize_name(name) == normalize_name(self.package_id)
+
+class UploadSessionManager(models.Manager):
+    def expired(self):
+        """ Sessions that have not received data for longer than
+        CHUNKED_UPLOAD_EXPIRY """
+        return self.filter(updated__lt=datetime.now() - timedelta(
+            seconds=conf.CHUNKED_UPLOAD_EXPIRY))
+
+class UploadSession(models.Model):
+    """ A distribution file being uploaded in chunks. The chunks received so
+    far are kept in a partial file on local disk until the upload is
+    finalized into a distribution. """
+    key = models.CharField(max_length=64, unique=True, editable=False)
+    user = models.ForeignKey(User, related_name="upload_sessions")
+    package = models.CharField(max_length=255)
+    version = models.CharField(max_length=128)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0, editable=False)
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    updated = models.DateTimeField(auto_now=True, editable=False)
+
+    objects = UploadSessionManager()
+
+    class Meta:
+        verbose_name = _(u"upload session")
+        verbose_name_plural = _(u"upload sessions")
+        ordering = ('-created',)
+
+    def __unicode__(self):
+        return u'%s (%d of %d bytes)' % (self.filename, self.received,
+                                         self.size)
+
+    @property
+    def path(self):
+        """ The partial file holding the chunks received so far """
+        return os.path.join(upload_session_directory(), self.key)
+
+    @property
+    def complete(self):
+        return self.received >= self.size
+
+def upload_session_directory():
+    return (conf.CHUNKED_UPLOAD_DIRECTORY or
+            os.path.join(settings.FILE_UPLOAD_TEMP_DIR or
+                         tempfile.gettempdir(), 'djangopypi-uploads'))
+
+JOB_STATUSES = (
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('failed', 'Failed'),
+)
+
+class Job(models.Model):
+    """ A task queued for the run_jobs worker, see djangopypi.jobs. Jobs are
+    removed once they succeed, a job that keeps failing stays behind marked
+    as failed. """
+    task = models.CharField(max_length=64, db_index=True)
+    arguments = models.TextField(blank=True, editable=False)
+    status = models.CharField(max_length=16, choices=JOB_STATUSES,
+                              default='queued', db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=datetime.now, db_index=True)
+    started = models.DateTimeField(null=True, blank=True, editable=False)
+    last_error = models.TextField(blank=True, editable=False)
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+
+    class Meta:
+        verbose_name = _(u"job")
+        verbose_name_plural = _(u"jobs")
+        ordering = ('run_after', 'id')
+
+    def __unicode__(self):
+        return u'%s(%s)' % (self.task, self.arguments)
+
+    @property
+    def kwargs(self):
+        return dict((str(k), v) for k, v in
+                    json.loads(self.arguments or '{}').items())
+
+class PageGeneration(models.Model):
+    """ The generation of a set of cached simple pages, see djangopypi.simple.
+    Kept in the database so that every process sees a new generation, and
+    only once the change it follows is committed. """
+    key = models.CharField(max_length=128, unique=True, editable=False)
+    version = models.CharField(max_length=32, editable=False)
+    modified = models.DateTimeField(default=datetime.now, editable=False)
+
+    class Meta:
+        verbose_name = _(u"page generation")
+        verbose_name_plural = _(u"page generations")
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.key, self.version)
+
 @receiver(user_logged_in)
 def log_authentication(sender, request, user, *args, **kwargs):
     logger = logging.getLogger('djangopypi.auth_logger')
@@ -228,3 +506,8 @@ try:
     add_introspection_rules([], ["^djangopypi\.models\.PackageInfoField"])
 except ImportError:
     pass
+
+# Ensure signals get registered when serving requests as well as from
+# management commands, the simple index cache depends on them. Imported as a
+# module, signals may be the module importing this one.
+import djangopypi.signals
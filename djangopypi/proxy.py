@@ -0,0 +1,301 @@
+""" Pull-through caching of packages from an upstream index, see PROXY_CACHE.
+
+The simple page of a package missing from the index is fetched from
+PROXY_BASE_URL, and a release and a distribution are added for every file it
+links to. Those distributions remember the upstream URL of their file and
+have no file yet: it is fetched, checked against the digest the upstream
+page gave and stored the first time it is downloaded. Only http and https
+URLs on the upstream host or PROXY_ALLOWED_HOSTS are followed, so a spoofed
+upstream page cannot point the index at local files or internal hosts. """
+import logging
+import os
+import re
+import urllib2
+import urlparse
+from datetime import datetime, timedelta
+from HTMLParser import HTMLParser, HTMLParseError
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from djangopypi import conf, jobs, simple
+from djangopypi.http import DigestingUploadedFile
+from djangopypi.models import Package, Release, Distribution, \
+                              distribution_upload_to
+from djangopypi.storage import save_atomic
+from djangopypi.utils import normalize_name
+
+logger = logging.getLogger(__name__)
+
+class UpstreamError(IOError):
+    """ The upstream index could not be reached or returned garbage """
+
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.tgz', '.tar.bz2', '.tbz', '.tar', '.zip')
+
+class _LinkParser(HTMLParser):
+    """ Collects the anchors of a simple page """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            attrs = dict(attrs)
+            if attrs.get('href'):
+                self.links.append(attrs)
+
+def parse_links(html, base_url):
+    """ The files a simple page links to, as a list of dictionaries holding
+    their ``filename``, absolute ``url``, the ``md5`` and ``sha256`` digests
+    given in the URL fragments and their ``requires_python`` """
+    parser = _LinkParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except HTMLParseError, e:
+        raise UpstreamError('Cannot parse the upstream page: %s' % e)
+
+    links = []
+    for attrs in parser.links:
+        url, _, fragment = urlparse.urljoin(base_url,
+                                            attrs['href']).partition('#')
+        digest_name, _, digest = fragment.partition('=')
+        filename = urllib2.unquote(url.rsplit('/', 1)[-1])
+        if not filename:
+            continue
+        links.append({
+            'filename': filename,
+            'url': url,
+            'md5': digest_name == 'md5' and digest or '',
+            'sha256': digest_name == 'sha256' and digest or '',
+            'requires_python': attrs.get('data-requires-python') or '',
+        })
+    return links
+
+def parse_filename(filename, name):
+    """ The version, file type and Python version of a distribution file of
+    the package ``name``, or None for files this cannot make sense of """
+    name = normalize_name(name)
+    if filename.endswith('.whl'):
+        parts = filename[:-4].split('-')
+        if len(parts) not in (5, 6) or normalize_name(parts[0]) != name:
+            return None
+        return parts[1], 'bdist_wheel', parts[-3]
+    if filename.endswith('.egg'):
+        match = re.match(r'^(.+?)-([^-]+)-py(\d+\.\d+)(-.+)?\.egg$', filename)
+        if not match or normalize_name(match.group(1)) != name:
+            return None
+        return match.group(2), 'bdist_egg', match.group(3)
+    for extension in ARCHIVE_EXTENSIONS:
+        if filename.endswith(extension):
+            base = filename[:-len(extension)]
+            # The name may contain dashes itself, the version cannot
+            project, _, version = base.rpartition('-')
+            if not version or normalize_name(project) != name:
+                return None
+            return version, 'sdist', ''
+    return None
+
+def allowed_url(url):
+    """ Whether files may be fetched from ``url``: an http or https URL on
+    the host of PROXY_BASE_URL or one of PROXY_ALLOWED_HOSTS """
+    parsed = urlparse.urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return False
+    base = urlparse.urlparse(conf.PROXY_BASE_URL)
+    return (parsed.netloc.lower() == base.netloc.lower() or
+            parsed.hostname in [host.lower()
+                                for host in conf.PROXY_ALLOWED_HOSTS])
+
+class _RedirectHandler(urllib2.HTTPRedirectHandler):
+    """ Refuses redirects to URLs files may not be fetched from """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not allowed_url(newurl):
+            raise urllib2.HTTPError(req.get_full_url(), code,
+                                    'Redirect to %s refused' % newurl,
+                                    headers, fp)
+        return urllib2.HTTPRedirectHandler.redirect_request(
+            self, req, fp, code, msg, headers, newurl)
+
+_opener = urllib2.build_opener(_RedirectHandler)
+
+def _open(url):
+    if not allowed_url(url):
+        raise UpstreamError('%s is not on an allowed host' % url)
+    request = urllib2.Request(url, headers={
+        'User-Agent': 'djangopypi',
+        'Accept': 'text/html',
+    })
+    return _opener.open(request, timeout=conf.PROXY_TIMEOUT)
+
+def proxy_user():
+    """ The user mirrored distributions are uploaded by """
+    user, created = User.objects.get_or_create(username=conf.PROXY_USERNAME)
+    if created:
+        user.set_unusable_password()
+        user.save()
+    return user
+
+def fetch_page(name):
+    """ The links of the upstream simple page of a package, or None when
+    the upstream index does not have it """
+    url = '%s/%s/' % (conf.PROXY_BASE_URL.rstrip('/'), normalize_name(name))
+    try:
+        response = _open(url)
+        try:
+            html = response.read().decode('utf-8', 'replace')
+            url = response.geturl()
+        finally:
+            response.close()
+    except urllib2.HTTPError, e:
+        if e.code == 404:
+            return None
+        raise UpstreamError('%s: %s' % (url, e))
+    except IOError, e:
+        raise UpstreamError('%s: %s' % (url, e))
+    return parse_links(html, url)
+
+def _create_once(instance, **lookup):
+    """ Save a new row, or return the row matching ``lookup`` when another
+    request mirroring the same package saved it first. The row is saved
+    under a savepoint, so losing the race leaves the transaction intact. """
+    sid = transaction.savepoint()
+    try:
+        instance.save(force_insert=True)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        return instance.__class__.objects.get(**lookup)
+    transaction.savepoint_commit(sid)
+    return instance
+
+@transaction.commit_on_success
+def mirror_package(name, package=None):
+    """ Add the releases and files of a package on the upstream index that
+    are not in the local index yet. Creates the package when ``package`` is
+    None. Returns the package, or None when the upstream index does not have
+    it. Raises UpstreamError when it cannot be reached. """
+    links = fetch_page(name)
+    if links is None:
+        return None
+
+    if package is None:
+        package, created = Package.objects.get_or_create(
+            name=normalize_name(name),
+            defaults={'auto_hide': False, 'proxied': datetime.now()})
+    existing = set(os.path.basename(content) for content in
+                   Distribution.objects.filter(release__package=package)
+                   .values_list('content', flat=True))
+    releases = dict((release.version, release)
+                    for release in package.releases.all())
+    user = None
+
+    # The first requests for a missing package all mirror it at once, the
+    # unique constraints decide which of them adds each release and file
+    for link in links:
+        if link['filename'] in existing:
+            continue
+        parsed = parse_filename(link['filename'], package.name)
+        if parsed is None:
+            continue
+        if not allowed_url(link['url']):
+            logger.warning('Not mirroring %s: not on an allowed host' %
+                           link['url'])
+            continue
+        version, filetype, pyversion = parsed
+        release = releases.get(version)
+        if release is None:
+            package_info = {}
+            if link['requires_python']:
+                package_info['requires_python'] = [link['requires_python']]
+            release = _create_once(Release(package=package, version=version,
+                                           metadata_version='1.2',
+                                           package_info=package_info),
+                                   package=package, version=version)
+            releases[version] = release
+        dist = Distribution(release=release, filetype=filetype,
+                            pyversion=pyversion, md5_digest=link['md5'],
+                            sha256_digest=link['sha256'],
+                            upstream_url=link['url'],
+                            uploader=user or proxy_user())
+        user = dist.uploader
+        dist.content.name = distribution_upload_to(dist, link['filename'])
+        _create_once(dist, content=dist.content.name)
+        existing.add(link['filename'])
+    return package
+
+def refresh_due(package):
+    """ Whether a mirrored package is to be fetched from upstream again """
+    return (package.proxied is not None and package.proxied <
+            datetime.now() - timedelta(seconds=conf.PROXY_CACHE_TTL))
+
+def refresh_package(package):
+    """ Fetch a mirrored package from upstream again. Of several requests
+    finding it due at once only one fetches it, when the upstream index
+    cannot be reached the package is left as it is until the next refresh
+    is due. """
+    now = datetime.now()
+    if not Package.objects.filter(pk=package.pk,
+            proxied=package.proxied).update(proxied=now):
+        return package
+    package.proxied = now
+    try:
+        mirror_package(package.name, package)
+    except UpstreamError, e:
+        logger.warning('Could not refresh %s from upstream: %s' % (
+            package.name, e))
+    return package
+
+def fetch_distribution(dist):
+    """ Fetch the file of a mirrored distribution from upstream and store
+    it, checking it against the digests of the upstream page. Raises
+    UpstreamError when it cannot be fetched, is larger than
+    PROXY_MAX_FILE_SIZE or does not match. """
+    uploaded = DigestingUploadedFile(name=dist.filename,
+                                     content_type='application/octet-stream',
+                                     size=0, charset=None)
+    try:
+        try:
+            response = _open(dist.upstream_url)
+            try:
+                length = response.info().getheader('Content-Length')
+                if length and length.isdigit() and \
+                   int(length) > conf.PROXY_MAX_FILE_SIZE:
+                    raise UpstreamError('%s is too large' %
+                                        dist.upstream_url)
+                while True:
+                    chunk = response.read(conf.UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if uploaded.size + len(chunk) > conf.PROXY_MAX_FILE_SIZE:
+                        raise UpstreamError('%s is too large' %
+                                            dist.upstream_url)
+                    uploaded.write(chunk)
+            finally:
+                response.close()
+        except UpstreamError:
+            raise
+        except IOError, e:
+            raise UpstreamError('%s: %s' % (dist.upstream_url, e))
+        uploaded.file.flush()
+
+        if ((dist.sha256_digest and
+             uploaded.sha256_digest != dist.sha256_digest) or
+            (dist.md5_digest and uploaded.md5_digest != dist.md5_digest)):
+            raise UpstreamError('%s does not match its digest' %
+                                dist.upstream_url)
+
+        save_atomic(dist.content.storage, dist.content.name, uploaded)
+    finally:
+        uploaded.close()
+
+    dist.md5_digest = uploaded.md5_digest
+    dist.sha256_digest = uploaded.sha256_digest
+    dist.size = uploaded.size
+    Distribution.objects.filter(pk=dist.pk).update(
+        md5_digest=dist.md5_digest, sha256_digest=dist.sha256_digest,
+        size=dist.size)
+    simple.invalidate_package(dist.release.package_id)
+    jobs.enqueue('extract_metadata', pk=dist.pk)
+    return dist
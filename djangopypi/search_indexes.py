@@ -4,11 +4,29 @@ from django.contrib.auth.models import User, Group
 from djangopypi.models import Package
 
 if 'haystack' in settings.INSTALLED_APPS:
+    from django.db.models import signals
     from haystack import site
     from haystack.indexes import RealTimeSearchIndex
     from haystack.fields import CharField, MultiValueField
 
-    class PackageSearchIndex(RealTimeSearchIndex):
+    from djangopypi import conf, jobs
+
+    class QueuedSearchIndex(RealTimeSearchIndex):
+        """ Updates the index from the job queue instead of inside the
+        request saving a package. Removals are still done right away, the
+        package cannot be looked up afterwards. """
+
+        def _setup_save(self, model):
+            signals.post_save.connect(self.enqueue_update, sender=model)
+
+        def _teardown_save(self, model):
+            signals.post_save.disconnect(self.enqueue_update, sender=model)
+
+        def enqueue_update(self, instance, **kwargs):
+            jobs.enqueue('update_search_index', name=instance.name)
+
+    class PackageSearchIndex(conf.JOB_QUEUE and QueuedSearchIndex or
+                             RealTimeSearchIndex):
         name = CharField(model_attr='name')
         text = CharField(document=True, use_template=True, null=True, stored=False,
                          template_name='djangopypi/haystack/package_text.txt')
@@ -117,11 +117,11 @@ if not hasattr(settings,'DJANGOPYPI_XMLRPC_COMMANDS'):
     }
 
 """ These settings enable proxying of packages that are not in the local index 
-to another index, http://pypi.python.org/ by default. This feature is disabled 
+to another index, https://pypi.org/ by default. This feature is disabled 
 by default and can be enabled by setting DJANGOPYPI_PROXY_MISSING to True in 
 your settings file. """
 if not hasattr(settings, 'DJANGOPYPI_PROXY_BASE_URL'):
-    settings.DJANGOPYPI_PROXY_BASE_URL = 'http://pypi.python.org/simple'
+    settings.DJANGOPYPI_PROXY_BASE_URL = 'https://pypi.org/simple'
 
 if not hasattr(settings, 'DJANGOPYPI_PROXY_MISSING'):
     settings.DJANGOPYPI_PROXY_MISSING = False
@@ -1,17 +1,22 @@
+import os
+import shutil
+
 from django.db.models import signals
-from django.utils.hashcompat import md5_constructor
+from django.contrib.auth.models import Group
 
-from djangopypi.models import Package, Release, Distribution
+from djangopypi import conf, jobs, simple
+from djangopypi.models import Package, Release, Distribution, UploadSession
+from djangopypi.utils import file_digests
 
 def autohide_new_release_handler(sender, instance, created, *args, **kwargs):
     """ Autohide other releases on the creation of a new release when the 
-    package 'auto-hide' is True"""
+    package 'auto-hide' is True. Done in a single update, the signals of the
+    hidden releases would only refresh the pages of the same package. """
     if not created or not instance.package.auto_hide:
         return
     
-    for release in instance.package.releases.exclude(pk=instance.pk).filter(hidden=False):
-        release.hidden = True
-        release.save()
+    instance.package.releases.exclude(pk=instance.pk).filter(
+        hidden=False).update(hidden=True)
     
     if instance.hidden:
         instance.hidden = False
@@ -34,25 +39,151 @@ def autohide_save_release_handler(sender, instance, *args, **kwargs):
         instance.hidden = True
 
 def autohide_save_package_handler(sender, instance, *args, **kwargs):
+    """ Hide all but the latest release when a package is saved with
+    'auto-hide' on """
     if not instance.auto_hide:
         return
     
-    for release in instance.releases.filter(hidden=False):
-        release.save()
+    try:
+        latest = instance.releases.latest('created')
+    except Release.DoesNotExist:
+        return
+    instance.releases.exclude(pk=latest.pk).filter(hidden=False).update(
+        hidden=True)
 
 def distribution_hash(sender, instance, *args, **kwargs):
-    if not instance.md5_digest and instance.content:
-        digest = md5_constructor()
-        try:
-            fh = instance.content.storage.open(instance.content.name)
-            map(digest.update,fh.readlines())
-            fh.close()
-            instance.md5_digest = digest.hexdigest()
-            instance.save()
-        except Exception, e:
-            print str(e)
+    """ Fill in the digests and size of a distribution before it is saved.
+    Uploads parsed by parse_distutils_request were hashed while they were
+    spooled to disk, anything else is read once, in chunks, or later by a
+    job when JOB_QUEUE is on. """
+    if instance.sha256_digest or not instance.content or not instance.fetched:
+        return
+    try:
+        upload = instance.content.file
+        if hasattr(upload, 'sha256_digest'):
+            md5_digest, sha256_digest, size = (upload.md5_digest,
+                upload.sha256_digest, upload.size)
+        elif conf.JOB_QUEUE:
+            return
+        else:
+            md5_digest, sha256_digest, size = file_digests(instance.content)
+            if instance.content._committed:
+                instance.content.close()
+    except Exception, e:
+        print str(e)
+        return
+    instance.md5_digest = instance.md5_digest or md5_digest
+    instance.sha256_digest = sha256_digest
+    instance.size = size
+
+def distribution_hash_job_handler(sender, instance, *args, **kwargs):
+    if (conf.JOB_QUEUE and instance.content and instance.fetched and
+        not instance.sha256_digest):
+        jobs.enqueue('hash_distribution', pk=instance.pk)
+
+def simple_index_package_handler(sender, instance, *args, **kwargs):
+    """ Packages appearing, disappearing or changing visibility alter the
+    simple index for every permission set """
+    simple.invalidate_index()
+    simple.invalidate_package(instance.name)
+
+def simple_index_release_handler(sender, instance, *args, **kwargs):
+    simple.invalidate_package(instance.package_id)
+
+def simple_index_distribution_handler(sender, instance, *args, **kwargs):
+    try:
+        simple.invalidate_package(instance.release.package_id)
+    except Release.DoesNotExist:
+        pass
+
+def simple_index_permissions_handler(sender, instance, action, *args, **kwargs):
+    if action.startswith('post_'):
+        simple.invalidate_index()
+
+def simple_index_group_handler(sender, instance, *args, **kwargs):
+    """ Deleting a group silently drops it from download permissions """
+    simple.invalidate_index()
+
+def simple_export_package_handler(sender, instance, *args, **kwargs):
+    if conf.SIMPLE_EXPORT_ROOT:
+        jobs.enqueue('export_packages', names=[instance.name], indexes=True)
+
+def simple_export_release_handler(sender, instance, *args, **kwargs):
+    if conf.SIMPLE_EXPORT_ROOT:
+        jobs.enqueue('export_packages', names=[instance.package_id])
+
+def simple_export_distribution_handler(sender, instance, *args, **kwargs):
+    if not conf.SIMPLE_EXPORT_ROOT:
+        return
+    try:
+        jobs.enqueue('export_packages', names=[instance.release.package_id])
+    except Release.DoesNotExist:
+        pass
+
+def simple_export_permissions_handler(sender, instance, action, pk_set,
+                                      *args, **kwargs):
+    if not conf.SIMPLE_EXPORT_ROOT or not action.startswith('post_'):
+        return
+    if isinstance(instance, Package):
+        names = [instance.name]
+    elif pk_set is not None:
+        names = sorted(pk_set)
+    else:
+        # A group had all of its download permissions cleared
+        jobs.enqueue('export_classes')
+        return
+    jobs.enqueue('export_packages', names=names, indexes=True)
+
+def simple_export_group_created_handler(sender, instance, created, *args,
+                                       **kwargs):
+    if conf.SIMPLE_EXPORT_ROOT and created:
+        jobs.enqueue('export_classes', keys=['groups:%d' % instance.pk])
+
+def simple_export_group_deleted_handler(sender, instance, *args, **kwargs):
+    """ The group silently disappears from download permissions, so every
+    exported class is refreshed """
+    if not conf.SIMPLE_EXPORT_ROOT:
+        return
+    shutil.rmtree(os.path.join(conf.SIMPLE_EXPORT_ROOT,
+                               'groups-%d' % instance.pk), ignore_errors=True)
+    jobs.enqueue('export_classes')
+
+def upload_session_deleted_handler(sender, instance, *args, **kwargs):
+    """ Remove the partial file of an upload session. A finalized upload has
+    already moved it into place. """
+    try:
+        os.remove(instance.path)
+    except OSError:
+        pass
 
 signals.post_save.connect(autohide_new_release_handler, sender=Release)
 signals.pre_save.connect(autohide_save_release_handler, sender=Release)
 signals.pre_save.connect(autohide_save_package_handler, sender=Package)
-signals.post_save.connect(distribution_hash, sender=Distribution)
+signals.pre_save.connect(distribution_hash, sender=Distribution)
+signals.post_save.connect(distribution_hash_job_handler, sender=Distribution)
+
+signals.post_save.connect(simple_index_package_handler, sender=Package)
+signals.post_delete.connect(simple_index_package_handler, sender=Package)
+signals.post_save.connect(simple_index_release_handler, sender=Release)
+signals.post_delete.connect(simple_index_release_handler, sender=Release)
+signals.post_save.connect(simple_index_distribution_handler, sender=Distribution)
+signals.post_delete.connect(simple_index_distribution_handler, sender=Distribution)
+signals.m2m_changed.connect(simple_index_permissions_handler,
+                            sender=Package.download_permissions.through)
+signals.post_delete.connect(simple_index_group_handler, sender=Group)
+
+signals.post_save.connect(simple_export_package_handler, sender=Package)
+signals.post_delete.connect(simple_export_package_handler, sender=Package)
+signals.post_save.connect(simple_export_release_handler, sender=Release)
+signals.post_delete.connect(simple_export_release_handler, sender=Release)
+signals.post_save.connect(simple_export_distribution_handler,
+                          sender=Distribution)
+signals.post_delete.connect(simple_export_distribution_handler,
+                            sender=Distribution)
+signals.m2m_changed.connect(simple_export_permissions_handler,
+                            sender=Package.download_permissions.through)
+signals.post_save.connect(simple_export_group_created_handler, sender=Group)
+signals.post_delete.connect(simple_export_group_deleted_handler, sender=Group)
+
+signals.post_delete.connect(upload_session_deleted_handler,
+                            sender=UploadSession)
@@ -0,0 +1,329 @@
+""" Materialized copies of the simple index pages.
+
+The /simple/ index only depends on which packages a user may download, so it
+is rendered once per distinct permission set (superusers, anonymous visitors
+and each combination of groups) and kept in the cache until a package, one of
+its download permissions or a group changes. The per-package pages are
+rendered once per package and dropped whenever one of its releases or
+distributions changes. Pages are stored together with gzip (and brotli when
+available) compressed copies, so compression happens once per change.
+
+Pages are stored under the generation of the index or package they belong
+to, and a change replaces that generation. Generations are kept in the
+database rather than in the cache: with a per-process cache such as the
+default local memory one every process keeps its own copy of the pages, but
+all of them move on to the new generation, and not before the change is
+committed. """
+import gzip
+import os
+import time
+import uuid
+from cStringIO import StringIO
+from datetime import datetime
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from django.core.cache import cache
+from django.db.models import Max
+from django.db.models.query import Q
+from django.template.loader import render_to_string
+from django.utils import simplejson as json
+from django.utils.hashcompat import md5_constructor
+from django.utils.html import escape
+
+from djangopypi import conf
+from djangopypi.models import Package, Release, Distribution, \
+                              PageGeneration
+from djangopypi.utils import digest_fragment
+
+INDEX_STATE_KEY = 'djangopypi:simple:index-state'
+PACKAGE_STATE_KEY = 'djangopypi:simple:package-state:%s'
+
+INDEX_TEMPLATE = 'djangopypi/package_list_simple.html'
+PACKAGE_TEMPLATE = 'djangopypi/package_detail_simple.html'
+
+JSON_CONTENT_TYPE = 'application/vnd.pypi.simple.v1+json'
+HTML_CONTENT_TYPE = 'application/vnd.pypi.simple.v1+html'
+JSON_META = {'api-version': '1.0'}
+
+def permission_key(user):
+    """ Return a string identifying the set of packages ``user`` can see. An
+    API token limited to a package narrows the set down to that package. """
+    if user.is_superuser:
+        key = 'superuser'
+    elif not user.is_authenticated():
+        key = 'anonymous'
+    else:
+        group_ids = sorted(user.groups.values_list('id', flat=True))
+        key = 'groups:%s' % ','.join(map(str, group_ids))
+    token = getattr(user, 'api_token', None)
+    if token is not None and token.package_id is not None:
+        key = u'%s|package:%s' % (key, token.package_id)
+    return key
+
+def permission_packages(key):
+    """ Return a queryset of the packages visible to a permission key as
+    produced by ``permission_key`` """
+    key, _, package = key.partition('|package:')
+    if key == 'superuser':
+        packages = Package.objects.all()
+    elif key == 'anonymous':
+        packages = Package.objects.filter(download_permissions=None,
+                                          allow_authenticated=False)
+    else:
+        group_ids = filter(None, key.split(':', 1)[1].split(','))
+        packages = Package.objects.filter(
+            Q(download_permissions=None) |
+            Q(allow_authenticated=True) |
+            Q(download_permissions__in=group_ids)
+        ).distinct()
+    if package:
+        packages = packages.filter(pk=package)
+    return packages
+
+def _state(key):
+    """ Fetch the (version, modified) pair of a page generation. A missing
+    generation is created with a fresh version, so it never matches pages
+    stored before. """
+    generation, created = PageGeneration.objects.get_or_create(
+        key=key, defaults={'version': uuid.uuid4().hex})
+    return (generation.version,
+            int(time.mktime(generation.modified.timetuple())))
+
+def _bump(key):
+    PageGeneration.objects.filter(key=key).update(
+        version=uuid.uuid4().hex, modified=datetime.now())
+
+def _package_key(name):
+    return PACKAGE_STATE_KEY % md5_constructor(name.encode('utf-8')).hexdigest()
+
+def index_state():
+    return _state(INDEX_STATE_KEY)
+
+def package_state(name):
+    return _state(_package_key(name))
+
+def invalidate_index():
+    _bump(INDEX_STATE_KEY)
+
+def invalidate_package(name):
+    _bump(_package_key(name))
+
+def _etag(*parts):
+    return md5_constructor(u'\0'.join(parts).encode('utf-8')).hexdigest()
+
+def index_validators(key):
+    """ Return the (etag, last_modified) pair of the simple index for a
+    permission key, from its generation alone """
+    version, modified = index_state()
+    return _etag(version, key), modified
+
+def package_validators(package, key):
+    """ Return the (etag, last_modified) pair of the pages of a package as
+    seen by a permission key. Last-Modified is the latest change of the
+    package's generation, so edits and deletions move it as well, or the
+    newest release or distribution upload when that is later. """
+    version, modified = package_state(package.name)
+    dates = Release.objects.filter(package=package).aggregate(
+        release=Max('created'), distribution=Max('distributions__created'))
+    for date in filter(None, dates.values()):
+        modified = max(modified, int(time.mktime(date.timetuple())))
+    return _etag(version, key, unicode(modified)), modified
+
+def _page_key(kind, version, *parts):
+    digest = md5_constructor(u'\0'.join(parts).encode('utf-8')).hexdigest()
+    return 'djangopypi:simple:%s:%s:%s' % (kind, version, digest)
+
+def available_encodings():
+    """ The configured content encodings pages are stored in, in order of
+    preference, leaving out brotli when it is not installed """
+    return [encoding for encoding in conf.SIMPLE_ENCODINGS
+            if encoding == 'gzip' or (encoding == 'br' and brotli)]
+
+def compress(page, encoding):
+    """ Compress a page for the given Content-Encoding """
+    if isinstance(page, unicode):
+        page = page.encode('utf-8')
+    if encoding == 'gzip':
+        buf = StringIO()
+        fh = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0)
+        fh.write(page)
+        fh.close()
+        return buf.getvalue()
+    if encoding == 'br':
+        return brotli.compress(page)
+    raise ValueError('Unsupported content encoding: %s' % encoding)
+
+def _cache_stream(cache_key, chunks):
+    """ Yield the chunks of a page, caching it and its compressed variants
+    once it has been completed """
+    page = []
+    for chunk in chunks:
+        page.append(chunk)
+        yield chunk
+    page = u''.join(page)
+    variants = {cache_key: page}
+    for encoding in available_encodings():
+        variants['%s:%s' % (cache_key, encoding)] = compress(page, encoding)
+    cache.set_many(variants, conf.SIMPLE_CACHE_TIMEOUT)
+
+def _cached(cache_key, build, encodings):
+    """ Return a (content, content encoding) pair for a page: a stored
+    variant in one of ``encodings``, the stored page itself, or an iterator
+    building it, streaming it and storing it with its compressed variants """
+    keys = dict(('%s:%s' % (cache_key, encoding), encoding)
+                for encoding in encodings)
+    found = cache.get_many([cache_key] + keys.keys())
+    for encoding in encodings:
+        content = found.get('%s:%s' % (cache_key, encoding))
+        if content is not None:
+            return content, encoding
+    if cache_key in found:
+        return found[cache_key], None
+    return _cache_stream(cache_key, build()), None
+
+def index_page(key, template_name=INDEX_TEMPLATE, encodings=()):
+    """ Return the simple index for a permission key as a (content, content
+    encoding) pair, see ``_cached`` """
+    cache_key = _page_key('index', index_state()[0], template_name, key)
+    return _cached(cache_key, lambda: [render_to_string(template_name,
+        {'package_list': permission_packages(key)})], encodings)
+
+def _release_links(version, package_info):
+    """ The home-page and download-url links of a release. The package info
+    is only decoded when it mentions one of them, and into a plain dict. """
+    links = []
+    if 'home_page' not in package_info and 'download_url' not in package_info:
+        return links
+    info = json.loads(package_info)
+    for field, label in (('home_page', 'home-page'),
+                         ('download_url', 'download-url')):
+        value = info.get(field)
+        if isinstance(value, list):
+            value = value and value[-1]
+        if value:
+            links.append(u'<a href="%s">%s %s</a><br />\n' % (
+                escape(value), escape(version), label))
+    return links
+
+def render_package_page(package):
+    """ Generate the simple page of a package from a single joined query,
+    yielding the same links as PACKAGE_TEMPLATE without instantiating any
+    release or distribution """
+    storage = Distribution._meta.get_field('content').storage
+    name = escape(package.name)
+    yield (u'<html>\n<head>\n<title>Links for %s</title>\n</head>\n'
+           u'<body>\n<h1>Links for %s</h1>\n' % (name, name))
+
+    rows = Release.objects.filter(package=package).order_by(
+        '-created', 'distributions__id').values_list(
+        'id', 'version', 'package_info', 'distributions__content',
+        'distributions__md5_digest', 'distributions__sha256_digest',
+        'distributions__metadata_digest')
+
+    current = None
+    for (release_id, version, package_info, content, md5_digest,
+         sha256_digest, metadata_digest) in rows.iterator():
+        if release_id != current:
+            if current is not None:
+                for link in _release_links(*previous):
+                    yield link
+            current, previous = release_id, (version, package_info or u'')
+        if content:
+            # The metadata file is served next to the distribution (PEP 658)
+            metadata = u''
+            if metadata_digest:
+                metadata = (u' data-dist-info-metadata="sha256=%s"'
+                            u' data-core-metadata="sha256=%s"' % (
+                            metadata_digest, metadata_digest))
+            yield u'<a href="%s%s"%s>%s</a><br />\n' % (
+                escape(storage.url(content)),
+                digest_fragment(md5_digest, sha256_digest), metadata,
+                escape(os.path.basename(content)))
+    if current is not None:
+        for link in _release_links(*previous):
+            yield link
+
+    yield u'</body>\n</html>'
+
+def package_page(package, template_name=PACKAGE_TEMPLATE, encodings=()):
+    """ Return the simple page for a package as a (content, content encoding)
+    pair, see ``_cached`` """
+    cache_key = _page_key('package', package_state(package.name)[0],
+                          template_name, package.name)
+    if template_name == PACKAGE_TEMPLATE:
+        build = lambda: render_package_page(package)
+    else:
+        build = lambda: [render_to_string(template_name, {'package': package})]
+    return _cached(cache_key, build, encodings)
+
+def _json(value):
+    return json.dumps(value, separators=(',', ':'))
+
+def render_index_json(key):
+    """ Generate the PEP 691 JSON index for a permission key straight from a
+    values query """
+    yield u'{"meta":%s,"projects":[' % _json(JSON_META)
+    names = permission_packages(key).values_list('name', flat=True)
+    separator = u''
+    for name in names.iterator():
+        yield separator + _json({'name': name})
+        separator = u','
+    yield u']}'
+
+def _requires_python(package_info):
+    if not package_info or 'requires_python' not in package_info:
+        return None
+    value = json.loads(package_info).get('requires_python')
+    if isinstance(value, list):
+        value = value and value[-1]
+    return value or None
+
+def render_package_json(package):
+    """ Generate the PEP 691 JSON page of a package from a single query """
+    storage = Distribution._meta.get_field('content').storage
+    yield u'{"meta":%s,"name":%s,"files":[' % (_json(JSON_META),
+                                               _json(package.normalized_name))
+    rows = Distribution.objects.filter(release__package=package).order_by(
+        '-release__created', 'id').values_list(
+        'content', 'md5_digest', 'sha256_digest', 'metadata_digest',
+        'release__package_info')
+
+    separator = u''
+    for (content, md5_digest, sha256_digest, metadata_digest,
+         package_info) in rows.iterator():
+        hashes = {}
+        if md5_digest:
+            hashes['md5'] = md5_digest
+        if sha256_digest:
+            hashes['sha256'] = sha256_digest
+        entry = {
+            'filename': os.path.basename(content),
+            'url': storage.url(content),
+            'hashes': hashes,
+        }
+        requires_python = _requires_python(package_info)
+        if requires_python:
+            entry['requires-python'] = requires_python
+        if metadata_digest:
+            entry['core-metadata'] = {'sha256': metadata_digest}
+            entry['dist-info-metadata'] = entry['core-metadata']
+        yield separator + _json(entry)
+        separator = u','
+    yield u']}'
+
+def index_json(key, encodings=()):
+    """ Return the JSON index for a permission key as a (content, content
+    encoding) pair, see ``_cached`` """
+    cache_key = _page_key('index-json', index_state()[0], key)
+    return _cached(cache_key, lambda: render_index_json(key), encodings)
+
+def package_json(package, encodings=()):
+    """ Return the JSON page of a package as a (content, content encoding)
+    pair, see ``_cached`` """
+    cache_key = _page_key('package-json', package_state(package.name)[0],
+                          package.name)
+    return _cached(cache_key, lambda: render_package_json(package), encodings)
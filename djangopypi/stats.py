@@ -0,0 +1,82 @@
+""" Daily download statistics.
+
+The download counters of the distributions only ever grow. The
+aggregate_downloads command, run periodically, adds what they grew by since
+its last run to the downloads of their packages and releases on the day it
+runs, so the statistics of a package over any period are read from a range
+of rows of a single table. """
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from djangopypi.models import Distribution, PackageDownloadDay, \
+                              ReleaseDownloadDay
+
+def _add_downloads(model, field, pk, day, downloads):
+    if not model.objects.filter(day=day, **{field: pk}).update(
+            downloads=F('downloads') + downloads):
+        model.objects.create(day=day, downloads=downloads,
+                             **{field + '_id': pk})
+
+@transaction.commit_on_success
+def aggregate_downloads(day=None):
+    """ Add the downloads counted since the last aggregation to the
+    statistics of ``day``, by default today. Returns the number of
+    distributions that were downloaded. """
+    day = day or date.today()
+    rows = Distribution.objects.filter(
+        downloads__gt=F('downloads_aggregated')).values_list(
+        'pk', 'release', 'release__package', 'downloads',
+        'downloads_aggregated')
+
+    packages, releases = {}, {}
+    count = 0
+    for pk, release, package, downloads, aggregated in rows:
+        # Another aggregation running at the same time already took these
+        if not Distribution.objects.filter(pk=pk,
+                downloads_aggregated=aggregated).update(
+                downloads_aggregated=downloads):
+            continue
+        delta = downloads - aggregated
+        packages[package] = packages.get(package, 0) + delta
+        releases[release] = releases.get(release, 0) + delta
+        count += 1
+
+    for package, downloads in packages.items():
+        _add_downloads(PackageDownloadDay, 'package', package, day, downloads)
+    for release, downloads in releases.items():
+        _add_downloads(ReleaseDownloadDay, 'release', release, day, downloads)
+    return count
+
+def since(days):
+    """ The first day of the last ``days`` days, today included """
+    return date.today() - timedelta(days=days - 1)
+
+def daily_downloads(package, days):
+    """ The downloads of a package on each of the last ``days`` days, as a
+    list of (day, downloads) pairs including the days without any """
+    first = since(days)
+    counts = dict(package.download_days.filter(day__gte=first).values_list(
+        'day', 'downloads'))
+    return [(first + timedelta(days=i),
+             counts.get(first + timedelta(days=i), 0)) for i in range(days)]
+
+def release_downloads(package, days):
+    """ The downloads of each release of a package in the last ``days`` days,
+    as a list of (version, downloads) pairs, the most downloaded first """
+    rows = ReleaseDownloadDay.objects.filter(release__package=package,
+        day__gte=since(days)).values_list('release__version').annotate(
+        total=Sum('downloads')).order_by('-total', 'release__version')
+    return list(rows)
+
+def top_packages(days, packages=None, limit=10):
+    """ The packages downloaded most in the last ``days`` days, as a list of
+    (package name, downloads) pairs. ``packages`` restricts them to a query
+    set of packages. """
+    rows = PackageDownloadDay.objects.filter(day__gte=since(days))
+    if packages is not None:
+        rows = rows.filter(package__in=packages)
+    rows = rows.values_list('package').annotate(
+        total=Sum('downloads')).order_by('-total', 'package')
+    return list(rows[:limit])
@@ -0,0 +1,178 @@
+""" Content-addressed storage for distribution files.
+
+Every distinct file is stored once as a blob named after its SHA-256 digest,
+sharded into two levels of directories by the first characters of the
+digest. Distributions keep their usual names, which are hard links to the
+blob, so download URLs do not change and the web server serves them as any
+other file. The link count of a blob is its reference count: deleting a
+distribution only removes its own link, and the blob goes with the last
+one. """
+import errno
+import os
+import uuid
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+
+from djangopypi import conf
+from djangopypi.utils import file_digests
+
+def save_atomic(storage, name, content):
+    """ Store ``content`` under exactly ``name`` in a filesystem storage. It is
+    saved under a temporary name next to it and renamed into place, so the
+    name never holds a partial file and a file left over from a failed
+    upload is replaced rather than kept besides a renamed copy. """
+    directory, filename = os.path.split(name)
+    tmp_name = storage.save(os.path.join(directory, '.tmp-%s-%s' % (
+        uuid.uuid4().hex, filename)), content)
+    try:
+        os.rename(storage.path(tmp_name), storage.path(name))
+    except:
+        storage.delete(tmp_name)
+        raise
+    return name
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def __init__(self, location=None, base_url=None, blob_directory=None):
+        super(ContentAddressedStorage, self).__init__(location, base_url)
+        self.blob_directory = blob_directory or conf.BLOB_DIRECTORY
+
+    def blob_name(self, digest):
+        """ Name of the blob holding the content with a SHA-256 digest """
+        return os.path.join(self.blob_directory, digest[:2], digest[2:4],
+                            digest)
+
+    def _digest(self, content):
+        digest = getattr(content, 'sha256_digest', None)
+        if not digest:
+            digest = file_digests(content)[1]
+        return digest
+
+    def _store_blob(self, digest, content):
+        """ Make sure the blob for ``digest`` exists, writing ``content`` to a
+        temporary name first so a blob is never seen half written. When two
+        identical files are stored at once the first blob wins. """
+        blob = self.blob_name(digest)
+        if not self.exists(blob):
+            tmp_name = os.path.join(self.blob_directory, 'tmp',
+                                    uuid.uuid4().hex)
+            tmp_name = super(ContentAddressedStorage, self)._save(tmp_name,
+                                                                  content)
+            try:
+                os.link(self.path(tmp_name), self._prepare(blob))
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            finally:
+                os.remove(self.path(tmp_name))
+        return blob
+
+    def _prepare(self, name):
+        """ The path of ``name``, creating its directory if necessary """
+        path = self.path(name)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        return path
+
+    def _link(self, blob, name):
+        """ Hard link ``name`` to a blob, picking another name if it is
+        taken """
+        self._prepare(name)
+        while True:
+            try:
+                os.link(self.path(blob), self.path(name))
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                name = self.get_available_name(name)
+            else:
+                return name
+
+    def _save(self, name, content):
+        digest = self._digest(content)
+        while True:
+            blob = self._store_blob(digest, content)
+            try:
+                return self._link(blob, name)
+            except OSError, e:
+                # The blob was found, but deleted with its last reference
+                # before it could be linked to: store it again
+                if e.errno != errno.ENOENT or self.exists(blob):
+                    raise
+
+    def reference_count(self, name):
+        """ The number of names sharing the content of ``name`` """
+        return os.stat(self.path(name)).st_nlink - 1
+
+    def _blob_of(self, name, stat=None):
+        """ The blob ``name`` is a link to, or None """
+        stat = stat or os.stat(self.path(name))
+        fh = File(open(self.path(name), 'rb'))
+        try:
+            blob = self.blob_name(file_digests(fh)[1])
+        finally:
+            fh.close()
+        try:
+            blob_stat = os.stat(self.path(blob))
+        except OSError:
+            return None
+        if (blob_stat.st_ino, blob_stat.st_dev) != (stat.st_ino, stat.st_dev):
+            return None
+        return blob
+
+    def delete(self, name):
+        """ Remove a name, and the blob behind it when this was its last
+        reference """
+        try:
+            stat = os.stat(self.path(name))
+        except OSError:
+            return
+        blob = None
+        if stat.st_nlink == 2:
+            # Only the blob would remain, which is only worth hashing the
+            # file for in that case
+            blob = self._blob_of(name, stat)
+        super(ContentAddressedStorage, self).delete(name)
+        if blob is None:
+            return
+        # A concurrent delete of another reference may remove the blob first
+        try:
+            if os.stat(self.path(blob)).st_nlink == 1:
+                os.remove(self.path(blob))
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def adopt(self, name):
+        """ Turn an existing file into a reference to its blob, keeping its
+        name. Returns 'linked' when the file became the blob, 'deduplicated'
+        when an identical blob existed and the file was replaced by a link
+        to it, or None when it already referred to its blob. """
+        path = self.path(name)
+        stat = os.stat(path)
+        fh = File(open(path, 'rb'))
+        try:
+            digest = file_digests(fh)[1]
+        finally:
+            fh.close()
+        blob_path = self._prepare(self.blob_name(digest))
+
+        try:
+            os.link(path, blob_path)
+            return 'linked'
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        blob_stat = os.stat(blob_path)
+        if (blob_stat.st_ino, blob_stat.st_dev) == (stat.st_ino, stat.st_dev):
+            return None
+        # Swap the file for a link to the blob in a single rename, so the
+        # name never disappears
+        tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        os.link(blob_path, tmp_path)
+        os.rename(tmp_path, path)
+        return 'deduplicated'
@@ -0,0 +1,74 @@
+""" Tasks run through the job queue, see djangopypi.jobs. Their arguments
+come from JSON, tasks look objects up again by their keys and do nothing
+when they are gone. """
+from djangopypi import conf, simple
+from djangopypi.export import SimpleExporter, exported_classes
+from djangopypi.metadata import read_metadata, store_metadata
+from djangopypi.models import Package, Distribution
+from djangopypi.utils import file_digests
+
+def export_packages(names, indexes=False):
+    """ Refresh the exported pages of packages in every exported class,
+    together with the index pages when ``indexes`` is set """
+    if not conf.SIMPLE_EXPORT_ROOT:
+        return
+    exporter = SimpleExporter()
+    keys = exported_classes(exporter.root)
+    for name in names:
+        exporter.export_package(name, keys)
+    if indexes:
+        for key in keys:
+            exporter.export_index(key)
+
+def export_classes(keys=None):
+    """ Export the complete tree of permission classes, by default of every
+    class exported so far """
+    if not conf.SIMPLE_EXPORT_ROOT:
+        return
+    exporter = SimpleExporter()
+    for key in keys or exported_classes(exporter.root):
+        exporter.export_class(key)
+
+def hash_distribution(pk):
+    """ Fill in the digests and size of a distribution that was added
+    without them """
+    try:
+        dist = Distribution.objects.get(pk=pk)
+    except Distribution.DoesNotExist:
+        return
+    if dist.sha256_digest:
+        return
+    md5_digest, sha256_digest, size = file_digests(dist.content)
+    dist.content.close()
+    Distribution.objects.filter(pk=pk).update(
+        md5_digest=dist.md5_digest or md5_digest,
+        sha256_digest=sha256_digest, size=size)
+    # The simple pages link to files with their digests
+    simple.invalidate_package(dist.release.package_id)
+    export_packages([dist.release.package_id])
+
+def extract_metadata(pk):
+    """ Read the metadata file of a distribution from the archive and merge
+    it into its release """
+    try:
+        dist = Distribution.objects.select_related('release').get(pk=pk)
+    except Distribution.DoesNotExist:
+        return
+    if not dist.fetched:
+        return
+    text = read_metadata(dist.content.path, dist.filename)
+    if text is None:
+        return
+    store_metadata(dist, text)
+    # The simple pages advertise the metadata file
+    simple.invalidate_package(dist.release.package_id)
+    export_packages([dist.release.package_id])
+
+def update_search_index(name):
+    """ Update the search index entry of a package """
+    from haystack import site
+    try:
+        package = Package.objects.get(name=name)
+    except Package.DoesNotExist:
+        return
+    site.get_index(Package).update_object(package)
@@ -8,6 +8,19 @@ from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.http import HttpRequest
 
+from djangopypi.tests.simple_index import *
+from djangopypi.tests.export import *
+from djangopypi.tests.names import *
+from djangopypi.tests.credentials import *
+from djangopypi.tests.tokens import *
+from djangopypi.tests.uploads import *
+from djangopypi.tests.storage import *
+from djangopypi.tests.metadata import *
+from djangopypi.tests.downloads import *
+from djangopypi.tests.stats import *
+from djangopypi.tests.proxy import *
+from djangopypi.tests.jobs import *
+
 def create_post_data(action):
     data = {
             ":action": action,
@@ -0,0 +1,97 @@
+from django.core.cache import cache
+from django.contrib.auth.models import User, Group
+from django.http import HttpRequest
+from django.test import TestCase
+
+from djangopypi import credentials
+from djangopypi.http import login_basic_auth
+from djangopypi.tests.utils import basic_auth_header, create_developer
+
+class TestCredentialCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_developer()
+        self.header = basic_auth_header('dev', 'secret')
+
+    def login(self, header=None):
+        request = HttpRequest()
+        request.META['HTTP_AUTHORIZATION'] = header or self.header
+        return login_basic_auth(request)
+
+    def test_verified_credentials_cached(self):
+        self.assertEqual(credentials.cached_user(self.header), None)
+        self.assertEqual(self.login(), self.user)
+        cached = credentials.cached_user(self.header)
+        self.assertEqual(cached, self.user)
+        self.assertTrue(hasattr(cached, 'backend'))
+        self.assertEqual(self.login(), self.user)
+
+    def test_cache_keyed_by_hmac(self):
+        self.login()
+        key = credentials._credential_key(self.header)
+        self.assertFalse(self.header in key)
+        self.assertFalse('secret' in key)
+        self.assertNotEqual(cache.get(key), None)
+
+    def test_invalid_credentials_not_cached(self):
+        header = basic_auth_header('dev', 'wrong')
+        self.assertEqual(self.login(header), None)
+        self.assertEqual(credentials.cached_user(header), None)
+
+    def test_password_change_invalidates(self):
+        self.login()
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(credentials.cached_user(self.header), None)
+        self.assertEqual(self.login(), None)
+
+    def test_changes_elsewhere_invalidate(self):
+        # Changes made by another process, whose cache is not shared, or
+        # without any signals
+        users = User.objects.filter(pk=self.user.pk)
+        self.login()
+        users.update(password='!')
+        self.assertEqual(credentials.cached_user(self.header), None)
+
+        users.update(password=self.user.password)
+        self.login()
+        users.update(is_active=False)
+        self.assertEqual(credentials.cached_user(self.header), None)
+
+        users.update(is_active=True)
+        self.login()
+        users.update(username='renamed')
+        self.assertEqual(credentials.cached_user(self.header), None)
+
+    def test_deactivation_invalidates(self):
+        self.login()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(credentials.cached_user(self.header), None)
+
+    def test_last_login_keeps_cache(self):
+        self.login()
+        self.user.last_login = self.user.last_login.replace(year=2000)
+        self.user.save()
+        self.assertEqual(credentials.cached_user(self.header), self.user)
+
+    def test_cached_user_is_current(self):
+        group = Group.objects.create(name='developers')
+        self.login()
+        self.user.groups.add(group)
+        User.objects.filter(pk=self.user.pk).update(is_superuser=True)
+        cached = credentials.cached_user(self.header)
+        self.assertEqual(list(cached.groups.all()), [group])
+        self.assertTrue(cached.is_superuser)
+
+    def test_upload_uses_cache(self):
+        self.login()
+        check_password = User.check_password
+        User.check_password = lambda user, password: False
+        try:
+            response = self.client.post('/simple/', {':action': 'submit'},
+                                        HTTP_AUTHORIZATION=self.header)
+        finally:
+            User.check_password = check_password
+        self.assertNotEqual(response.status_code, 401)
@@ -0,0 +1,367 @@
+import xmlrpclib
+
+from django.contrib.auth.models import User, AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import DatabaseError, transaction
+from django.db.models.query import QuerySet
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from djangopypi import conf, counters
+from djangopypi.models import Package, Release, Distribution
+from djangopypi.views import xmlrpc
+from djangopypi.views.releases import download_dist, download_auth
+from djangopypi.tests.utils import basic_auth_header, create_distribution, \
+                                   create_developer, DeveloperTestMixin
+
+class TestDownloadPermissions(DeveloperTestMixin, TestCase):
+
+    def setUp(self):
+        super(TestDownloadPermissions, self).setUp()
+        User.objects.create_user('other', 'other@example.com', 'secret')
+        self.package = Package.objects.create(name='foo')
+        release = Release.objects.create(package=self.package, version='1.0')
+        self.dist = create_distribution(release, 'foo-1.0.tar.gz', self.user)
+
+    def tearDown(self):
+        for dist in Distribution.objects.all():
+            dist.delete()
+
+    def download(self, username=None, dist=None):
+        dist = dist or self.dist
+        headers = {}
+        if username:
+            headers['HTTP_AUTHORIZATION'] = basic_auth_header(username,
+                                                              'secret')
+        request = RequestFactory().get(dist.content.url, **headers)
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        return download_dist(request, dist.content.name)
+
+    def test_public_package(self):
+        self.assertEqual(self.download().status_code, 200)
+
+    def test_restricted_package(self):
+        self.package.download_permissions.add(self.group)
+        self.assertEqual(self.download().status_code, 401)
+        self.assertEqual(self.download('other').status_code, 403)
+        self.assertEqual(self.download('dev').status_code, 200)
+
+    def test_allow_authenticated(self):
+        self.package.download_permissions.add(self.group)
+        self.package.allow_authenticated = True
+        self.package.save()
+        self.assertEqual(self.download().status_code, 401)
+        self.assertEqual(self.download('other').status_code, 200)
+
+    def test_superuser(self):
+        self.package.download_permissions.add(self.group)
+        User.objects.filter(username='other').update(is_superuser=True)
+        self.assertEqual(self.download('other').status_code, 200)
+
+    def test_queries_independent_of_packages(self):
+        self.package.download_permissions.add(self.group)
+        for i in range(30):
+            package = Package.objects.create(name='bar%d' % i)
+            package.download_permissions.add(self.group)
+        # The password is verified once, later downloads use the cache and
+        # only load the user
+        self.download('dev')
+        counters.flush_downloads()
+        self.assertNumQueries(4, self.download, 'dev')
+
+class TestRangeRequests(TestCase):
+
+    def setUp(self):
+        self.user = create_developer()
+        package = Package.objects.create(name='foo')
+        release = Release.objects.create(package=package, version='1.0')
+        self.content = ''.join(chr(i % 256) for i in range(1000))
+        self.dist = create_distribution(release, 'foo-1.0.zip', self.user,
+                                        self.content)
+        self.etag = '"%s"' % self.dist.sha256_digest
+
+    def tearDown(self):
+        self.dist.delete()
+
+    def get(self, **headers):
+        response = self.client.get(self.dist.content.url, **headers)
+        return response, ''.join(response)
+
+    def test_whole_file(self):
+        response, content = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.content)
+        self.assertEqual(response['Content-Length'], '1000')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="foo-1.0.zip"')
+
+    def test_single_range(self):
+        for spec, first, last in (('0-0', 0, 0), ('100-199', 100, 199),
+                                  ('900-', 900, 999), ('-10', 990, 999),
+                                  ('990-5000', 990, 999)):
+            response, content = self.get(HTTP_RANGE='bytes=%s' % spec)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'],
+                             'bytes %d-%d/1000' % (first, last))
+            self.assertEqual(content, self.content[first:last + 1])
+            self.assertEqual(response['Content-Length'], str(len(content)))
+
+    def test_multiple_ranges(self):
+        response, content = self.get(HTTP_RANGE='bytes=0-9, 500-509, -5')
+        self.assertEqual(response.status_code, 206)
+        content_type, boundary = response['Content-Type'].split('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        self.assertEqual(response['Content-Length'], str(len(content)))
+        parts = content.split('\r\n--%s' % boundary)
+        self.assertEqual(parts[0], '')
+        self.assertEqual(parts[-1], '--\r\n')
+        bodies = []
+        for part in parts[1:-1]:
+            headers, body = part.split('\r\n\r\n', 1)
+            bodies.append((headers.split('Content-Range: ')[1], body))
+        self.assertEqual(bodies, [
+            ('bytes 0-9/1000', self.content[:10]),
+            ('bytes 500-509/1000', self.content[500:510]),
+            ('bytes 995-999/1000', self.content[995:]),
+        ])
+
+    def test_overlapping_ranges_coalesced(self):
+        response, content = self.get(HTTP_RANGE='bytes=10-19,0-14')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-19/1000')
+        self.assertEqual(content, self.content[:20])
+
+    def test_unsatisfiable_range(self):
+        response, content = self.get(HTTP_RANGE='bytes=1000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1000')
+
+    def test_malformed_range_ignored(self):
+        for spec in ('bytes=5-1', 'bytes=a-b', 'lines=1-2', 'bytes=1'):
+            response, content = self.get(HTTP_RANGE=spec)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(content, self.content)
+
+    def test_if_range(self):
+        response, content = self.get(HTTP_RANGE='bytes=0-9',
+                                     HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+        response, content = self.get(HTTP_RANGE='bytes=0-9',
+                                     HTTP_IF_RANGE='"changed"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.content)
+        last_modified = self.get()[0]['Last-Modified']
+        response, content = self.get(HTTP_RANGE='bytes=0-9',
+                                     HTTP_IF_RANGE=last_modified)
+        self.assertEqual(response.status_code, 206)
+
+    def test_not_modified(self):
+        response, content = self.get(HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 304)
+
+class TestDownloadAuthorization(DeveloperTestMixin, TestCase):
+
+    def setUp(self):
+        super(TestDownloadAuthorization, self).setUp()
+        User.objects.create_user('other', 'other@example.com', 'secret')
+        self.package = Package.objects.create(name='foo')
+        release = Release.objects.create(package=self.package, version='1.0')
+        self.dist = create_distribution(release, 'foo-1.0.tar.gz', self.user)
+
+    def tearDown(self):
+        conf.DOWNLOAD_ACCEL_REDIRECT = None
+        for dist in Distribution.objects.all():
+            dist.delete()
+
+    def request(self, url, username=None, **headers):
+        if username:
+            headers['HTTP_AUTHORIZATION'] = basic_auth_header(username,
+                                                              'secret')
+        request = RequestFactory().get(url, **headers)
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        return request
+
+    def authorize(self, username=None, uri=None):
+        if uri is None:
+            uri = self.dist.content.url + '?x=1'
+        return download_auth(self.request('/auth/download/', username,
+                                          HTTP_X_ORIGINAL_URI=uri))
+
+    def test_public_package(self):
+        counters.flush_downloads()
+        with self.assertNumQueries(1):
+            response = self.authorize()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Package'], 'foo')
+
+    def test_restricted_package(self):
+        self.package.download_permissions.add(self.group)
+        self.assertEqual(self.authorize().status_code, 401)
+        self.assertEqual(self.authorize('other').status_code, 403)
+        self.assertEqual(self.authorize('dev').status_code, 200)
+        # Once the password is verified only the user and the groups are
+        # looked up
+        counters.flush_downloads()
+        self.assertNumQueries(3, self.authorize, 'dev')
+
+    def test_unknown_file(self):
+        for uri in ('/packages/f/bar-1.0.tar.gz', '/elsewhere/foo-1.0.tar.gz',
+                    ''):
+            self.assertEqual(self.authorize(uri=uri).status_code, 403)
+
+    def test_accel_redirect(self):
+        conf.DOWNLOAD_ACCEL_REDIRECT = '/protected/'
+        self.package.download_permissions.add(self.group)
+        path = self.dist.content.name
+        response = download_dist(self.request(self.dist.content.url), path)
+        self.assertEqual(response.status_code, 401)
+        response = download_dist(self.request(self.dist.content.url, 'dev'),
+                                 path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + path)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="foo-1.0.tar.gz"')
+        self.assertEqual(response.content, '')
+
+class TestDownloadCounts(TestCase):
+
+    def setUp(self):
+        counters.flush_downloads()
+        self.flush_size = conf.DOWNLOAD_COUNT_FLUSH_SIZE
+        self.flush_interval = conf.DOWNLOAD_COUNT_FLUSH_INTERVAL
+        conf.DOWNLOAD_COUNT_FLUSH_SIZE = 3
+        conf.DOWNLOAD_COUNT_FLUSH_INTERVAL = 3600
+        self.user = create_developer()
+        package = Package.objects.create(name='foo')
+        self.release = Release.objects.create(package=package, version='1.0')
+        self.dists = [
+            create_distribution(self.release, 'foo-1.0.tar.gz', self.user),
+            create_distribution(self.release, 'foo-1.0.zip', self.user),
+        ]
+
+    def tearDown(self):
+        counters.flush_downloads()
+        conf.DOWNLOAD_COUNT_FLUSH_SIZE = self.flush_size
+        conf.DOWNLOAD_COUNT_FLUSH_INTERVAL = self.flush_interval
+        for dist in self.dists:
+            dist.delete()
+
+    def download(self, dist, **headers):
+        response = self.client.get(dist.content.url, **headers)
+        ''.join(response)
+        return response
+
+    def downloads(self):
+        return list(Distribution.objects.order_by('pk').values_list(
+            'downloads', flat=True))
+
+    def test_counts_buffered(self):
+        self.download(self.dists[0])
+        self.download(self.dists[0])
+        self.assertEqual(self.downloads(), [0, 0])
+        self.assertEqual(counters.pending_downloads(), {self.dists[0].pk: 2})
+        self.download(self.dists[1])
+        self.assertEqual(self.downloads(), [2, 1])
+        self.assertEqual(counters.pending_downloads(), {})
+
+    def test_resumed_download_not_counted(self):
+        conf.DOWNLOAD_COUNT_FLUSH_SIZE = 100
+        self.download(self.dists[0], HTTP_RANGE='bytes=0-3')
+        self.download(self.dists[0], HTTP_RANGE='bytes=4-')
+        self.assertEqual(counters.pending_downloads(), {})
+        for spec in ('bytes=0-', 'bytes=0-8', 'bytes=0-100', 'bytes=a-b'):
+            self.download(self.dists[0], HTTP_RANGE=spec)
+        self.assertEqual(counters.pending_downloads(), {self.dists[0].pk: 4})
+
+    def test_probes_not_counted(self):
+        self.download(self.dists[0], HTTP_RANGE='bytes=0-0')
+        self.client.head(self.dists[0].content.url)
+        self.assertEqual(counters.pending_downloads(), {})
+
+    def test_refused_and_unmodified_not_counted(self):
+        etag = self.download(self.dists[0])['ETag']
+        counters.flush_downloads()
+        response = self.download(self.dists[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.download(self.dists[0], HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(counters.pending_downloads(), {})
+        # A changed file is downloaded again
+        response = self.download(self.dists[0], HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(counters.pending_downloads(), {self.dists[0].pk: 1})
+
+    def test_authorization_counted(self):
+        def authorize(method, **headers):
+            request = getattr(RequestFactory(), method)(
+                '/auth/download/',
+                HTTP_X_ORIGINAL_URI=self.dists[0].content.url, **headers)
+            request.user = AnonymousUser()
+            self.assertEqual(download_auth(request).status_code, 200)
+        authorize('head')
+        authorize('get', HTTP_RANGE='bytes=0-0')
+        authorize('get', HTTP_RANGE='bytes=4-')
+        # nginx answers revalidations itself, likely with 304
+        authorize('get', HTTP_IF_NONE_MATCH='"%s"' % (
+            self.dists[0].sha256_digest))
+        authorize('get',
+                  HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2000 00:00:00 GMT')
+        self.assertEqual(counters.pending_downloads(), {})
+        authorize('get')
+        authorize('get', HTTP_RANGE='bytes=0-8')
+        self.assertEqual(counters.pending_downloads(), {self.dists[0].pk: 2})
+
+    def test_flush_batches(self):
+        conf.DOWNLOAD_COUNT_FLUSH_SIZE = 100
+        dist = create_distribution(self.release, 'foo-1.0.egg', self.user)
+        self.dists.append(dist)
+        request = RequestFactory().get('/')
+        for pk, count in ((self.dists[0].pk, 2), (self.dists[1].pk, 2),
+                          (dist.pk, 5)):
+            for i in range(count):
+                counters.count_download(request, pk)
+        self.assertNumQueries(2, counters.flush_downloads)
+        self.assertEqual(self.downloads(), [2, 2, 5])
+
+    def test_failed_flush_rolled_back(self):
+        conf.DOWNLOAD_COUNT_FLUSH_SIZE = 100
+        request = RequestFactory().get('/')
+        counters.count_download(request, self.dists[0].pk)
+        rolled_back = []
+        def failing_update(queryset, **kwargs):
+            raise DatabaseError('deadlock detected')
+        def savepoint_rollback(sid, using=None):
+            rolled_back.append(sid)
+        update, rollback = QuerySet.update, transaction.savepoint_rollback
+        QuerySet.update = failing_update
+        transaction.savepoint_rollback = savepoint_rollback
+        try:
+            self.assertEqual(counters.flush_downloads(), 0)
+        finally:
+            QuerySet.update = update
+            transaction.savepoint_rollback = rollback
+        # The transaction of the request is rolled back to before the batch
+        # and the counts are kept for the next one
+        self.assertEqual(len(rolled_back), 1)
+        self.assertEqual(counters.pending_downloads(), {self.dists[0].pk: 1})
+        self.assertEqual(counters.flush_downloads(), 1)
+        self.assertEqual(self.downloads(), [1, 0])
+
+    def test_counts_shown(self):
+        Distribution.objects.filter(pk=self.dists[0].pk).update(downloads=7)
+        Distribution.objects.filter(pk=self.dists[1].pk).update(downloads=1)
+        self.assertEqual(self.release.downloads, 8)
+
+        request = RequestFactory().post('/')
+        response = xmlrpc.release_urls(request, 'foo', '1.0')
+        urls = xmlrpclib.loads(response.content)[0][0]
+        self.assertEqual(sorted((url['filename'], url['downloads'])
+                                for url in urls),
+                         [('foo-1.0.tar.gz', 7), ('foo-1.0.zip', 1)])
+        response = xmlrpc.release_data(request, 'foo', '1.0')
+        self.assertEqual(xmlrpclib.loads(response.content)[0][0]['downloads'],
+                         8)
@@ -0,0 +1,82 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.contrib.auth.models import Group
+from django.test import TestCase
+
+from djangopypi import conf
+from djangopypi.models import Package, Release
+from djangopypi.tests.utils import basic_auth_header, create_distribution, \
+                                   create_developer
+
+class TestSimpleExport(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.group = Group.objects.create(name='developers')
+        self.user = create_developer()
+        self.public = Package.objects.create(name='public')
+        self.private = Package.objects.create(name='private')
+        self.private.download_permissions.add(self.group)
+        self.release = Release.objects.create(package=self.public,
+                                              version='1.0')
+        self.dist = create_distribution(self.release, 'public-1.0.tar.gz',
+                                        self.user)
+
+    def tearDown(self):
+        conf.SIMPLE_EXPORT_ROOT = None
+        self.dist.delete()
+        shutil.rmtree(self.root)
+
+    def read(self, *parts):
+        return open(os.path.join(self.root, *parts)).read()
+
+    def test_export(self):
+        call_command('export_simple', root=self.root)
+        group_dir = 'groups-%d' % self.group.pk
+        self.assertEqual(sorted(os.listdir(self.root)),
+                         sorted(['anonymous', 'superuser', 'groups', group_dir]))
+
+        self.assertTrue('>public<' in self.read('anonymous', 'index.html'))
+        self.assertFalse('>private<' in self.read('anonymous', 'index.html'))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.root, 'anonymous', 'private')))
+        self.assertTrue('>private<' in self.read(group_dir, 'index.html'))
+        self.assertTrue('public-1.0.tar.gz' in
+                        self.read('anonymous', 'public', 'index.html'))
+
+        self.assertEqual(gzip.open(os.path.join(
+            self.root, 'anonymous', 'index.html.gz')).read(),
+            self.read('anonymous', 'index.html'))
+
+        response = self.client.get('/simple/public/',
+            HTTP_AUTHORIZATION=basic_auth_header('dev', 'secret'))
+        self.assertEqual(response.content,
+                         self.read('anonymous', 'public', 'index.html'))
+
+    def test_incremental(self):
+        call_command('export_simple', root=self.root)
+        conf.SIMPLE_EXPORT_ROOT = self.root
+
+        Package.objects.create(name='new')
+        self.assertTrue('>new<' in self.read('anonymous', 'index.html'))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.root, 'superuser', 'new', 'index.html')))
+
+        self.public.download_permissions.add(self.group)
+        self.assertFalse('>public<' in self.read('anonymous', 'index.html'))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.root, 'anonymous', 'public')))
+
+        create_distribution(Release.objects.create(package=self.public,
+                                                   version='1.1'),
+                            'public-1.1.tar.gz', self.user)
+        self.assertTrue('public-1.1.tar.gz' in
+                        self.read('superuser', 'public', 'index.html'))
+        for dist in self.public.releases.get(version='1.1').distributions.all():
+            dist.delete()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from hashlib import sha256
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+from djangopypi import conf, jobs
+from djangopypi.models import Package, Release, Distribution, Job
+from djangopypi.tests.utils import create_distribution, create_developer
+
+calls = []
+
+def record(value):
+    calls.append(value)
+
+def fail(value):
+    raise ValueError(value)
+
+class TestJobQueue(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        self.tasks = conf.JOB_TASKS
+        conf.JOB_TASKS = dict(self.tasks,
+                              record='djangopypi.tests.jobs.record',
+                              fail='djangopypi.tests.jobs.fail')
+        conf.JOB_QUEUE = True
+
+    def tearDown(self):
+        conf.JOB_TASKS = self.tasks
+        conf.JOB_QUEUE = False
+
+    def test_inline(self):
+        conf.JOB_QUEUE = False
+        self.assertEqual(jobs.enqueue('record', value=1), None)
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+    def test_queued(self):
+        job = jobs.enqueue('record', value=1)
+        self.assertEqual(job.kwargs, {'value': 1})
+        self.assertEqual(jobs.enqueue('record', value=1), None)
+        jobs.enqueue('record', value=2)
+        self.assertEqual(calls, [])
+
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual(calls, [1, 2])
+        self.assertFalse(Job.objects.exists())
+
+    def test_retry(self):
+        job = jobs.enqueue('fail', value='broken')
+        self.assertEqual(jobs.run_pending(), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertTrue('broken' in job.last_error)
+        self.assertTrue(job.run_after > datetime.now())
+        # Not due yet
+        self.assertEqual(jobs.run_pending(), 0)
+
+        for attempt in range(conf.JOB_MAX_ATTEMPTS - 1):
+            Job.objects.update(run_after=datetime.now())
+            jobs.run_pending()
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts),
+                         ('failed', conf.JOB_MAX_ATTEMPTS))
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_claim(self):
+        job = jobs.enqueue('record', value=1)
+        self.assertEqual(jobs.claim_job(), job)
+        self.assertEqual(jobs.claim_job(), None)
+        # The worker that claimed it died
+        Job.objects.update(started=datetime.now() - timedelta(
+            seconds=conf.JOB_TIMEOUT + 1))
+        self.assertEqual(jobs.claim_job(), job)
+
+    def test_command(self):
+        jobs.enqueue('record', value=1)
+        call_command('run_jobs', once=True, verbosity=0)
+        self.assertEqual(calls, [1])
+
+    def test_distribution_work_queued(self):
+        cache.clear()
+        root = tempfile.mkdtemp()
+        conf.SIMPLE_EXPORT_ROOT = root
+        os.mkdir(os.path.join(root, 'anonymous'))
+        try:
+            user = create_developer()
+            package = Package.objects.create(name='foo')
+            release = Release.objects.create(package=package, version='1.0')
+            Job.objects.all().delete()
+            # Files added outside of uploads are hashed later as well
+            dist = create_distribution(release, 'foo-1.0.tar.gz', user)
+            self.assertEqual(dist.sha256_digest, '')
+            page = os.path.join(root, 'anonymous', 'foo', 'index.html')
+            self.assertFalse(os.path.exists(page))
+            self.assertEqual(sorted(Job.objects.values_list('task', flat=True)),
+                             ['export_packages', 'hash_distribution'])
+
+            call_command('run_jobs', once=True, verbosity=0)
+            self.assertFalse(Job.objects.exists())
+            dist = Distribution.objects.get(pk=dist.pk)
+            self.assertEqual(dist.sha256_digest, sha256('gibberish').hexdigest())
+            self.assertTrue('#sha256=%s' % sha256('gibberish').hexdigest() in
+                            open(page).read())
+            dist.delete()
+        finally:
+            conf.SIMPLE_EXPORT_ROOT = None
+            shutil.rmtree(root)
@@ -0,0 +1,164 @@
+import tarfile
+import zipfile
+from cStringIO import StringIO
+from hashlib import sha256
+
+from django.core.management import call_command
+from django.http import Http404
+from django.test import TestCase, TransactionTestCase
+from django.test.client import RequestFactory
+from django.utils import simplejson as json
+
+from djangopypi import simple
+from djangopypi.metadata import read_metadata, package_info, parse_metadata
+from djangopypi.models import Package, Release, Distribution
+from djangopypi.views.releases import download_metadata
+from djangopypi.tests.utils import DISTUTILS_BOUNDARY, distutils_body, \
+                                   basic_auth_header, create_distribution, \
+                                   DeveloperTestMixin
+
+METADATA = u"""Metadata-Version: 2.1
+Name: foo
+Version: 1.0
+Summary: The real summary
+Home-page: http://example.com/foo
+Author: J\xf6rg
+Requires-Python: >=2.6
+Classifier: Framework :: Django
+Classifier: Programming Language :: Python
+
+A description.
+"""
+
+def zip_archive(members):
+    content = StringIO()
+    archive = zipfile.ZipFile(content, 'w')
+    for name, data in members:
+        archive.writestr(name, data)
+    archive.close()
+    return content.getvalue()
+
+def tar_archive(members):
+    content = StringIO()
+    archive = tarfile.open(fileobj=content, mode='w:gz')
+    for name, data in members:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        archive.addfile(info, StringIO(data))
+    archive.close()
+    return content.getvalue()
+
+def wheel(metadata=METADATA, name='foo-1.0'):
+    return zip_archive([('foo/__init__.py', ''),
+                        ('%s.dist-info/WHEEL' % name, 'Wheel-Version: 1.0'),
+                        ('%s.dist-info/METADATA' % name,
+                         metadata.encode('utf-8'))])
+
+def sdist(metadata=METADATA):
+    return tar_archive([('foo-1.0/setup.py', ''),
+                        ('foo-1.0/foo/PKG-INFO', 'Name: nested'),
+                        ('foo-1.0/PKG-INFO', metadata.encode('utf-8'))])
+
+class MetadataTestMixin(DeveloperTestMixin):
+
+    developer_permissions = ('add_package',)
+
+    def tearDown(self):
+        for dist in Distribution.objects.all():
+            dist.delete()
+        Package.objects.all().delete()
+
+    def create(self, filename, content, version='1.0'):
+        package, created = Package.objects.get_or_create(name='foo')
+        release, created = Release.objects.get_or_create(package=package,
+                                                         version=version)
+        return create_distribution(release, filename, self.user, content)
+
+    def upload(self, filename, content, version='1.0'):
+        return self.client.post('/', distutils_body([
+                (':action', 'file_upload'), ('name', 'foo'),
+                ('version', version), ('metadata_version', '1.0'),
+                ('summary', 'Posted summary'), ('author', 'Someone'),
+                ('content', (filename, content))]),
+            content_type='multipart/form-data; boundary=%s' %
+                         DISTUTILS_BOUNDARY,
+            HTTP_AUTHORIZATION=self.auth)
+
+class TestMetadataExtraction(MetadataTestMixin, TestCase):
+
+    def test_read_archives(self):
+        egg = zip_archive([('EGG-INFO/PKG-INFO', METADATA.encode('utf-8'))])
+        for filename, content in (('foo-1.0-py2-none-any.whl', wheel()),
+                                  ('foo-1.0.tar.gz', sdist()),
+                                  ('foo-1.0-py2.7.egg', egg)):
+            dist = self.create(filename, content)
+            self.assertEqual(read_metadata(dist.content.path, filename),
+                             METADATA)
+
+    def test_read_unknown_files(self):
+        for filename, content in (('foo-1.0.tar.gz', 'gibberish'),
+                                  ('foo-1.0.whl', zip_archive([])),
+                                  ('foo-1.0.exe', wheel())):
+            dist = self.create(filename, content)
+            self.assertEqual(read_metadata(dist.content.path, filename), None)
+
+    def test_package_info(self):
+        info = package_info(parse_metadata(METADATA), '1.2')
+        self.assertEqual(info['summary'], ['The real summary'])
+        self.assertEqual(info['classifier'], ['Framework :: Django',
+                                              'Programming Language :: Python'])
+        self.assertEqual(info['author'], [u'J\xf6rg'])
+
+    def test_upload_merges_metadata(self):
+        response = self.upload('foo-1.0-py2-none-any.whl', wheel())
+        self.assertEqual(response.status_code, 200)
+        dist = Distribution.objects.get()
+        self.assertEqual(dist.metadata, METADATA)
+        self.assertEqual(dist.metadata_digest,
+                         sha256(METADATA.encode('utf-8')).hexdigest())
+        release = dist.release
+        self.assertEqual(release.metadata_version, '1.2')
+        self.assertEqual(release.summary, 'The real summary')
+        self.assertEqual(release.package_info['author'], u'J\xf6rg')
+        self.assertEqual(release.package_info.getlist('classifier'),
+                         ['Framework :: Django',
+                          'Programming Language :: Python'])
+
+    def test_metadata_of_other_release_not_merged(self):
+        response = self.upload('foo-2.0.tar.gz', sdist(), version='2.0')
+        self.assertEqual(response.status_code, 200)
+        dist = Distribution.objects.get()
+        self.assertEqual(dist.metadata, METADATA)
+        self.assertEqual(dist.release.summary, 'Posted summary')
+
+class TestExtractMetadataCommand(MetadataTestMixin, TransactionTestCase):
+    """ The command closes the database connection before its workers
+    fork, so the data it reads has to be committed """
+
+    def test_metadata_served(self):
+        dist = self.create('foo-1.0-py2-none-any.whl', wheel())
+        call_command('extract_metadata', processes=1, verbosity=0)
+        dist = Distribution.objects.get()
+        response = self.client.get(dist.metadata_url,
+                                   HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(response.content, METADATA.encode('utf-8'))
+
+        other = self.create('foo-1.0.tar.gz', 'gibberish')
+        request = RequestFactory().get(other.metadata_url)
+        self.assertRaises(Http404, download_metadata, request,
+                          other.content.name)
+        self.assertEqual(Distribution.objects.get(pk=other.pk).metadata, '')
+
+    def test_metadata_advertised(self):
+        self.create('foo-1.0-py2-none-any.whl', wheel())
+        call_command('extract_metadata', processes=1, verbosity=0)
+        dist = Distribution.objects.get()
+        page = u''.join(simple.render_package_page(dist.release.package))
+        self.assertTrue(u'data-core-metadata="sha256=%s"' %
+                        dist.metadata_digest in page)
+        data = json.loads(u''.join(simple.render_package_json(
+            dist.release.package)))
+        self.assertEqual(data['files'][0]['core-metadata'],
+                         {'sha256': dist.metadata_digest})
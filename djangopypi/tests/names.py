@@ -0,0 +1,42 @@
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.test import TestCase
+
+from djangopypi.models import Package, Release
+from djangopypi.utils import normalize_name
+from djangopypi.tests.utils import basic_auth_header, create_developer
+
+class TestNormalizedNames(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_developer()
+        self.package = Package.objects.create(name='Django_Foo.bar')
+        Release.objects.create(package=self.package, version='1.0')
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name('Django_Foo.bar'), 'django-foo-bar')
+        self.assertEqual(normalize_name('django--foo__bar'), 'django-foo-bar')
+        self.assertEqual(self.package.normalized_name, 'django-foo-bar')
+
+    def test_get_by_name(self):
+        for name in ('django-foo-bar', 'DJANGO.FOO.BAR', 'Django_Foo.bar'):
+            self.assertEqual(Package.objects.get_by_name(name), self.package)
+        self.assertRaises(Package.DoesNotExist, Package.objects.get_by_name,
+                          'django-foo')
+
+    def test_spellings_unique(self):
+        self.assertRaises(IntegrityError, Package.objects.create,
+                          name='django-foo-bar')
+
+    def test_simple_page_any_spelling(self):
+        response = self.client.get('/simple/django-foo-bar/',
+            HTTP_AUTHORIZATION=basic_auth_header('dev', 'secret'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('Links for Django_Foo.bar' in response.content)
+
+    def test_details_redirect(self):
+        self.client.login(username='dev', password='secret')
+        response = self.client.get('/pypi/django-foo-bar/1.0/')
+        self.assertEqual(response.status_code, 301)
+        self.assertTrue(response['Location'].endswith('/pypi/Django_Foo.bar/1.0/'))
@@ -0,0 +1,404 @@
+import threading
+import time
+import xmlrpclib
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from datetime import datetime, timedelta
+from hashlib import md5, sha256
+
+from django.contrib.auth.models import User, AnonymousUser
+from django.core.cache import cache
+from django.forms.models import inlineformset_factory
+from django.db import connection
+from django.http import Http404
+from django.test import TestCase, TransactionTestCase
+from django.template.loader import render_to_string
+from django.test.client import Client, RequestFactory
+
+from djangopypi import conf, proxy, simple
+from djangopypi.models import Package, Release, Distribution
+from djangopypi.views import xmlrpc
+from djangopypi.views.packages import simple_details
+from djangopypi.tests.utils import basic_auth_header, create_developer, \
+                                   ThreadedTestMixin
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    """ Answers from the ``pages`` of its server, a dictionary of paths to
+    (status, content) pairs, recording the paths requested. The content of
+    a redirect is where it redirects to. """
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.server.wait_for_others()
+        status, content = self.server.pages.get(self.path, (404, 'Not Found'))
+        self.send_response(status)
+        if status in (301, 302):
+            self.send_header('Location', content)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+class Upstream(ThreadingMixIn, HTTPServer):
+    """ A stand-in for the upstream index, serving in threads of its own """
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), UpstreamHandler)
+        self.pages = {}
+        self.requests = []
+        self.held = 0
+        self.condition = threading.Condition()
+        self.url = 'http://127.0.0.1:%d' % self.server_port
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def hold(self, count):
+        """ Hold the answers until ``count`` requests have arrived, so that
+        their clients go on at once """
+        self.held = count
+
+    def wait_for_others(self):
+        self.condition.acquire()
+        try:
+            self.held -= 1
+            self.condition.notifyAll()
+            deadline = time.time() + 10
+            while self.held > 0 and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+        finally:
+            self.condition.release()
+
+    def publish(self, name, files):
+        """ Publish a simple page for ``name`` linking to ``files``, a list
+        of (filename, content) pairs """
+        links = []
+        for filename, content in files:
+            self.pages['/files/%s' % filename] = (200, content)
+            links.append('<a href="../../files/%s#sha256=%s" '
+                         'data-requires-python="&gt;=2.6">%s</a><br/>' % (
+                         filename, sha256(content).hexdigest(), filename))
+        self.pages['/simple/%s/' % name] = (200,
+            '<html><body>%s</body></html>' % '\n'.join(links))
+
+class TestPullThroughProxy(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.upstream = Upstream()
+        self.settings = (conf.PROXY_CACHE, conf.PROXY_BASE_URL,
+                         conf.PROXY_MAX_FILE_SIZE)
+        conf.PROXY_CACHE = True
+        conf.PROXY_BASE_URL = self.upstream.url + '/simple'
+        create_developer()
+        self.auth = basic_auth_header('dev', 'secret')
+        self.upstream.publish('foo-bar', [
+            ('Foo_Bar-1.0.tar.gz', 'sdist 1.0'),
+            ('Foo_Bar-1.0-py2-none-any.whl', 'wheel 1.0'),
+            ('Foo_Bar-0.9-py2.7.egg', 'egg 0.9'),
+            ('unrelated-1.0.tar.gz', 'unrelated'),
+        ])
+
+    def tearDown(self):
+        (conf.PROXY_CACHE, conf.PROXY_BASE_URL,
+         conf.PROXY_MAX_FILE_SIZE) = self.settings
+        self.upstream.stop()
+        for dist in Distribution.objects.all():
+            dist.delete()
+
+    def simple_page(self, name='foo-bar'):
+        return self.client.get('/simple/%s/' % name,
+                               HTTP_AUTHORIZATION=self.auth)
+
+    def download(self, filename):
+        dist = Distribution.objects.get(content__endswith='/' + filename)
+        response = self.client.get(dist.content.url,
+                                   HTTP_AUTHORIZATION=self.auth)
+        return response, ''.join(response)
+
+    def test_parse_filename(self):
+        self.assertEqual(proxy.parse_filename('Foo_Bar-1.0.tar.gz', 'foo-bar'),
+                         ('1.0', 'sdist', ''))
+        self.assertEqual(proxy.parse_filename('foo-bar-1.0rc1.zip', 'foo-bar'),
+                         ('1.0rc1', 'sdist', ''))
+        self.assertEqual(proxy.parse_filename(
+            'foo_bar-2.0-1-cp27-cp27mu-linux_x86_64.whl', 'foo-bar'),
+            ('2.0', 'bdist_wheel', 'cp27'))
+        self.assertEqual(proxy.parse_filename('Foo_Bar-0.9-py2.7.egg',
+                                              'foo-bar'),
+                         ('0.9', 'bdist_egg', '2.7'))
+        self.assertEqual(proxy.parse_filename('foo-1.0.tar.gz', 'foo-bar'),
+                         None)
+        self.assertEqual(proxy.parse_filename('foo-bar-1.0.exe', 'foo-bar'),
+                         None)
+
+    def test_missing_package_mirrored(self):
+        response = self.simple_page()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.upstream.requests, ['/simple/foo-bar/'])
+
+        package = Package.objects.get(name='foo-bar')
+        self.assertTrue(package.proxied)
+        self.assertEqual(sorted(package.releases.values_list('version',
+                                                              flat=True)),
+                         ['0.9', '1.0'])
+        release = package.releases.get(version='1.0')
+        self.assertEqual(release.package_info['requires_python'], '>=2.6')
+        dist = release.distributions.get(filetype='bdist_wheel')
+        self.assertFalse(dist.fetched)
+        self.assertEqual(dist.sha256_digest, sha256('wheel 1.0').hexdigest())
+        # The page links to the local files
+        self.assertTrue(dist.content.url in response.content)
+        self.assertFalse(self.upstream.url in response.content)
+
+        # Served locally until the page expires
+        self.assertEqual(self.simple_page().status_code, 200)
+        self.assertEqual(len(self.upstream.requests), 1)
+
+    def test_digest_fragments(self):
+        response = self.simple_page()
+        dist = Distribution.objects.get(content__endswith='/Foo_Bar-1.0.tar.gz')
+        self.assertEqual(dist.md5_digest, '')
+        fragment = '#sha256=%s' % sha256('sdist 1.0').hexdigest()
+        self.assertEqual(dist.get_absolute_url(), dist.content.url + fragment)
+        self.assertTrue('href="%s"' % dist.get_absolute_url() in
+                        response.content)
+        self.assertFalse('#md5=' in response.content)
+
+        # Files without any digest are linked to without a fragment
+        Distribution.objects.filter(pk=dist.pk).update(sha256_digest='')
+        simple.invalidate_package('foo-bar')
+        response = self.simple_page()
+        self.assertTrue('href="%s"' % dist.content.url in response.content)
+
+    def test_mirrored_meanwhile(self):
+        # Another request mirrors the package once this one has looked up
+        # what the index has, its releases and files are taken as they are
+        parse_filename = proxy.parse_filename
+        def mirror_first(filename, name):
+            proxy.parse_filename = parse_filename
+            proxy.mirror_package(name)
+            return parse_filename(filename, name)
+        proxy.parse_filename = mirror_first
+        try:
+            package = proxy.mirror_package('foo-bar')
+        finally:
+            proxy.parse_filename = parse_filename
+        self.assertEqual(package.releases.count(), 2)
+        self.assertEqual(Distribution.objects.count(), 3)
+        self.assertEqual(self.simple_page().status_code, 200)
+
+    def test_files_fetched_once(self):
+        self.simple_page()
+        response, content = self.download('Foo_Bar-1.0-py2-none-any.whl')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, 'wheel 1.0')
+        self.assertEqual(self.upstream.requests[-1],
+                         '/files/Foo_Bar-1.0-py2-none-any.whl')
+
+        dist = Distribution.objects.get(
+            content__endswith='/Foo_Bar-1.0-py2-none-any.whl')
+        self.assertTrue(dist.fetched)
+        self.assertEqual(dist.size, len('wheel 1.0'))
+        self.assertEqual(dist.md5_digest, md5('wheel 1.0').hexdigest())
+
+        requests = len(self.upstream.requests)
+        response, content = self.download('Foo_Bar-1.0-py2-none-any.whl')
+        self.assertEqual(content, 'wheel 1.0')
+        self.assertEqual(len(self.upstream.requests), requests)
+
+    def test_pages_before_fetch(self):
+        self.simple_page()
+        self.download('Foo_Bar-1.0-py2-none-any.whl')
+        self.client.login(username='dev', password='secret')
+
+        response = self.client.get('/pypi/foo-bar/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('not fetched yet' in response.content)
+        response = self.client.get('/pypi/foo-bar/1.0/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('not fetched yet' in response.content)
+        self.assertTrue('9 bytes' in response.content)
+
+        release = Release.objects.get(package='foo-bar', version='1.0')
+        formset = inlineformset_factory(Release, Distribution,
+            fields=('comment',), extra=0)(instance=release)
+        content = render_to_string('djangopypi/release_manage_files.html',
+                                   {'release': release, 'formset': formset})
+        self.assertTrue('not fetched yet' in content)
+
+        response = xmlrpc.release_urls(RequestFactory().post('/'),
+                                       'foo-bar', '1.0')
+        urls = xmlrpclib.loads(response.content)[0][0]
+        self.assertEqual(sorted((url['filename'], url['size'])
+                                for url in urls),
+                         [('Foo_Bar-1.0-py2-none-any.whl', 9),
+                          ('Foo_Bar-1.0.tar.gz', 0)])
+
+    def test_digest_mismatch(self):
+        self.simple_page()
+        self.upstream.pages['/files/Foo_Bar-1.0.tar.gz'] = (200, 'tampered')
+        response, content = self.download('Foo_Bar-1.0.tar.gz')
+        self.assertEqual(response.status_code, 502)
+        dist = Distribution.objects.get(content__endswith='/Foo_Bar-1.0.tar.gz')
+        self.assertFalse(dist.fetched)
+        self.assertFalse(dist.content.storage.exists(dist.content.name))
+
+    def test_allowed_url(self):
+        self.assertTrue(proxy.allowed_url(self.upstream.url + '/files/a.zip'))
+        self.assertTrue(proxy.allowed_url(
+            'https://files.pythonhosted.org/packages/a.zip'))
+        self.assertFalse(proxy.allowed_url('file:///etc/passwd'))
+        self.assertFalse(proxy.allowed_url('ftp://127.0.0.1/a.zip'))
+        self.assertFalse(proxy.allowed_url('http://127.0.0.1:1/a.zip'))
+        self.assertFalse(proxy.allowed_url('http://internal.invalid/a.zip'))
+
+    def test_links_elsewhere_ignored(self):
+        self.upstream.pages['/simple/foo-bar/'] = (200, """
+            <a href="file:///etc/passwd#Foo_Bar-2.0.tar.gz">x</a>
+            <a href="file:///etc/Foo_Bar-2.1.tar.gz">x</a>
+            <a href="ftp://127.0.0.1/Foo_Bar-2.2.tar.gz">x</a>
+            <a href="http://internal.invalid/Foo_Bar-2.3.tar.gz">x</a>
+            <a href="../../files/Foo_Bar-1.0.tar.gz">x</a>""")
+        self.assertEqual(self.simple_page().status_code, 200)
+        self.assertEqual([dist.filename for dist in
+                          Distribution.objects.all()], ['Foo_Bar-1.0.tar.gz'])
+
+    def test_redirect_elsewhere_refused(self):
+        self.simple_page()
+        self.upstream.pages['/files/Foo_Bar-1.0.tar.gz'] = (302,
+            'file:///etc/passwd')
+        self.upstream.pages['/files/Foo_Bar-0.9-py2.7.egg'] = (302,
+            'http://internal.invalid/secret')
+        for filename in ('Foo_Bar-1.0.tar.gz', 'Foo_Bar-0.9-py2.7.egg'):
+            response, content = self.download(filename)
+            self.assertEqual(response.status_code, 502)
+        self.assertFalse(Distribution.objects.filter(size__isnull=False))
+
+    def test_file_too_large(self):
+        self.simple_page()
+        conf.PROXY_MAX_FILE_SIZE = 4
+        response, content = self.download('Foo_Bar-1.0.tar.gz')
+        self.assertEqual(response.status_code, 502)
+        dist = Distribution.objects.get(content__endswith='/Foo_Bar-1.0.tar.gz')
+        self.assertFalse(dist.fetched)
+        self.assertFalse(dist.content.storage.exists(dist.content.name))
+
+    def test_refreshed_after_ttl(self):
+        self.simple_page()
+        self.upstream.publish('foo-bar', [
+            ('Foo_Bar-1.0.tar.gz', 'sdist 1.0'),
+            ('Foo_Bar-1.1.tar.gz', 'sdist 1.1'),
+        ])
+        self.assertEqual(self.simple_page().status_code, 200)
+        self.assertFalse(Release.objects.filter(version='1.1').exists())
+
+        Package.objects.filter(name='foo-bar').update(
+            proxied=datetime.now() - timedelta(seconds=conf.PROXY_CACHE_TTL + 1))
+        response = self.simple_page()
+        self.assertTrue('Foo_Bar-1.1.tar.gz' in response.content)
+        self.assertEqual(Distribution.objects.filter(
+            release__package='foo-bar').count(), 4)
+
+    def test_upstream_down(self):
+        self.simple_page()
+        Package.objects.filter(name='foo-bar').update(
+            proxied=datetime.now() - timedelta(seconds=conf.PROXY_CACHE_TTL + 1))
+        self.upstream.pages['/simple/foo-bar/'] = (500, 'Broken')
+        response = self.simple_page()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('Foo_Bar-1.0.tar.gz' in response.content)
+
+        self.upstream.pages['/simple/broken/'] = (500, 'Broken')
+        self.assertEqual(self.simple_page('broken').status_code, 502)
+
+    def test_unknown_upstream(self):
+        request = RequestFactory().get('/simple/missing/',
+                                       HTTP_AUTHORIZATION=self.auth)
+        request.user = AnonymousUser()
+        self.assertRaises(Http404, simple_details, request, 'missing')
+        self.assertFalse(Package.objects.filter(name='missing').exists())
+
+        # Anonymous requests do not reach the upstream index
+        request = RequestFactory().get('/simple/foo-bar/')
+        request.user = AnonymousUser()
+        self.assertEqual(simple_details(request, 'foo-bar').status_code, 401)
+        self.assertEqual(self.upstream.requests, ['/simple/missing/'])
+
+class TestConcurrentMirroring(ThreadedTestMixin, TransactionTestCase):
+    """ The first requests for a package missing from the index, each in a
+    thread of its own, committing the mirror as the view does. SQLite lets
+    them write one after the other, on other databases they race for each
+    release and file, see also test_mirrored_meanwhile. """
+
+    copies = 4
+
+    def setUp(self):
+        super(TestConcurrentMirroring, self).setUp()
+        cache.clear()
+        self.upstream = Upstream()
+        self.settings = (conf.PROXY_CACHE, conf.PROXY_BASE_URL)
+        conf.PROXY_CACHE = True
+        conf.PROXY_BASE_URL = self.upstream.url + '/simple'
+        create_developer()
+        self.upstream.publish('foo-bar', [
+            ('Foo_Bar-1.0.tar.gz', 'sdist 1.0'),
+            ('Foo_Bar-1.0-py2-none-any.whl', 'wheel 1.0'),
+            ('Foo_Bar-0.9-py2.7.egg', 'egg 0.9'),
+        ])
+
+    def tearDown(self):
+        conf.PROXY_CACHE, conf.PROXY_BASE_URL = self.settings
+        self.upstream.stop()
+        # TransactionTestCase only flushes before each test, the plain unit
+        # tests running after this one expect no packages or users
+        Package.objects.all().delete()
+        User.objects.all().delete()
+        super(TestConcurrentMirroring, self).tearDown()
+
+    def simple_page(self, start, results):
+        start.wait()
+        try:
+            try:
+                status = Client().get('/simple/foo-bar/',
+                    HTTP_AUTHORIZATION=basic_auth_header('dev', 'secret')
+                    ).status_code
+            except Exception, e:
+                # The client raises what the view raised
+                status = repr(e)
+            results.append(status)
+        finally:
+            connection.close()
+
+    def test_mirrored_once(self):
+        self.upstream.hold(self.copies)
+        start = threading.Event()
+        results = []
+        threads = [threading.Thread(target=self.simple_page,
+                                    args=(start, results))
+                   for i in range(self.copies)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [200] * self.copies)
+        package = Package.objects.get()
+        self.assertEqual(package.name, 'foo-bar')
+        self.assertEqual(sorted(package.releases.values_list('version',
+                                                              flat=True)),
+                         ['0.9', '1.0'])
+        self.assertEqual(sorted(dist.filename for dist in
+                                Distribution.objects.all()),
+                         ['Foo_Bar-0.9-py2.7.egg',
+                          'Foo_Bar-1.0-py2-none-any.whl',
+                          'Foo_Bar-1.0.tar.gz'])
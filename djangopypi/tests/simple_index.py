@@ -0,0 +1,288 @@
+import gzip
+from cStringIO import StringIO
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.urlresolvers import reverse
+from django.contrib.auth.models import User, Group
+from django.test import TestCase
+from django.utils import simplejson as json
+
+from djangopypi import simple
+from djangopypi.models import Package, Release, PageGeneration
+from djangopypi.tests.utils import basic_auth_header, create_distribution, \
+                                   create_developer, DeveloperTestMixin
+
+class TestSimpleIndexCache(DeveloperTestMixin, TestCase):
+
+    def setUp(self):
+        super(TestSimpleIndexCache, self).setUp()
+        self.other_group = Group.objects.create(name='others')
+
+        self.public = Package.objects.create(name='public')
+        self.private = Package.objects.create(name='private')
+        self.private.download_permissions.add(self.group)
+        self.hidden = Package.objects.create(name='hidden')
+        self.hidden.download_permissions.add(self.other_group)
+
+    def get_index(self):
+        return self.client.get(reverse('djangopypi-package-index-simple'),
+                               HTTP_AUTHORIZATION=self.auth)
+
+    def test_permission_keys(self):
+        self.assertEqual(simple.permission_key(self.user),
+                         'groups:%d' % self.group.pk)
+        admin = User.objects.create_superuser('admin', 'a@example.com', 'x')
+        self.assertEqual(simple.permission_key(admin), 'superuser')
+
+    def test_index_respects_permissions(self):
+        response = self.get_index()
+        self.assertEqual(response.status_code, 200)
+        # Streamed responses can only be read once
+        content = response.content
+        self.assertTrue('>public<' in content)
+        self.assertTrue('>private<' in content)
+        self.assertFalse('>hidden<' in content)
+
+    def test_index_served_from_cache(self):
+        # The page is stored once it has been streamed to the client
+        self.get_index().content
+        key = simple.permission_key(self.user)
+        # Only the generation of the index is looked up
+        self.assertNumQueries(1, simple.index_page, key)
+
+    def test_index_invalidated_by_package_changes(self):
+        self.get_index()
+        Package.objects.create(name='brand-new')
+        self.assertTrue('>brand-new<' in self.get_index().content)
+
+        self.hidden.download_permissions.add(self.group)
+        self.assertTrue('>hidden<' in self.get_index().content)
+
+        self.private.download_permissions.clear()
+        self.private.download_permissions.add(self.other_group)
+        self.assertFalse('>private<' in self.get_index().content)
+
+    def test_index_invalidated_in_every_process(self):
+        # Every process has its own local memory cache
+        caches = [LocMemCache('first', {}), LocMemCache('second', {})]
+        key = simple.permission_key(self.user)
+        page = lambda: u''.join(simple.index_page(key)[0])
+        original = simple.cache
+        try:
+            for simple.cache in caches:
+                self.assertFalse('>brand-new<' in page())
+            etag = simple.index_validators(key)[0]
+            Package.objects.create(name='brand-new')
+            for simple.cache in caches:
+                self.assertTrue('>brand-new<' in page())
+                self.assertNotEqual(simple.index_validators(key)[0], etag)
+        finally:
+            simple.cache = original
+
+    def test_package_page_forbidden(self):
+        response = self.client.get(
+            reverse('djangopypi-package-simple', kwargs={'package': 'hidden'}),
+            HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 403)
+
+class TestConditionalGet(DeveloperTestMixin, TestCase):
+
+    def setUp(self):
+        super(TestConditionalGet, self).setUp()
+        self.package = Package.objects.create(name='foo')
+        self.release = Release.objects.create(package=self.package,
+                                              version='1.0')
+        self.url = reverse('djangopypi-package-simple',
+                           kwargs={'package': 'foo'})
+
+    def test_etag_round_trip(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.auth,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, '')
+
+        Release.objects.create(package=self.package, version='1.1')
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.auth,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.auth)
+        response = self.client.get(
+            self.url, HTTP_AUTHORIZATION=self.auth,
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_last_modified_follows_changes(self):
+        def last_modified():
+            # Keep the changes a minute apart from the previous response
+            past = datetime.now() - timedelta(minutes=1)
+            Release.objects.update(created=past)
+            simple.package_state('foo')
+            PageGeneration.objects.update(modified=past)
+            return self.client.get(self.url, HTTP_AUTHORIZATION=self.auth)[
+                'Last-Modified']
+
+        since = last_modified()
+        self.release.hidden = True
+        self.release.save()
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.auth,
+                                   HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+
+        since = last_modified()
+        self.release.delete()
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.auth,
+                                   HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+
+    def test_index_etag(self):
+        url = reverse('djangopypi-package-index-simple')
+        etag = self.client.get(url, HTTP_AUTHORIZATION=self.auth)['ETag']
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.auth,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.package.download_permissions.add(Group.objects.create(name='x'))
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.auth,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_requires_credentials(self):
+        etag = self.client.get(self.url, HTTP_AUTHORIZATION=self.auth)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 401)
+
+class TestSimplePackagePage(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_developer()
+        self.package = Package.objects.create(name='foo', auto_hide=False)
+        self.releases = []
+        for version in ('1.0', '1.1', '1.2'):
+            release = Release.objects.create(package=self.package,
+                version=version, package_info={
+                    'home_page': ['http://example.com/?a=1&b=2'],
+                    'summary': ['Foo'],
+                })
+            create_distribution(release, 'foo-%s.tar.gz' % version, self.user)
+            create_distribution(release, 'foo-%s.zip' % version, self.user,
+                                filetype='bdist_dumb')
+            self.releases.append(release)
+        Release.objects.create(package=self.package, version='2.0')
+
+    def tearDown(self):
+        self.package.delete()
+
+    def test_single_query(self):
+        self.assertNumQueries(1, lambda: list(
+            simple.render_package_page(self.package)))
+
+    def test_matches_template(self):
+        from django.template.loader import render_to_string
+        expected = render_to_string(simple.PACKAGE_TEMPLATE,
+                                    {'package': self.package})
+        page = u''.join(simple.render_package_page(self.package))
+        strip = lambda s: sorted(l for l in s.splitlines() if l.strip())
+        self.assertEqual(strip(page), strip(expected))
+
+    def test_page_cached_after_streaming(self):
+        page = u''.join(simple.package_page(self.package)[0])
+        self.assertEqual(simple.package_page(self.package), (page, None))
+
+    def test_compressed_variants(self):
+        page = u''.join(simple.package_page(self.package)[0])
+        content, encoding = simple.package_page(self.package,
+                                                encodings=['gzip'])
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(content)).read(),
+                         page.encode('utf-8'))
+
+    def test_compressed_response(self):
+        url = '/simple/foo/'
+        auth = basic_auth_header('dev', 'secret')
+        plain = self.client.get(url, HTTP_AUTHORIZATION=auth)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        plain_content = plain.content
+        response = self.client.get(url, HTTP_AUTHORIZATION=auth,
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue('Accept-Encoding' in response['Vary'])
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(response.content)).read(),
+                         plain_content)
+
+        response = self.client.get(url, HTTP_AUTHORIZATION=auth,
+                                   HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, HTTP_AUTHORIZATION=auth,
+                                   HTTP_ACCEPT_ENCODING='*, gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+class TestSimpleJson(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create(name='developers')
+        self.user = create_developer()
+        self.auth = basic_auth_header('dev', 'secret')
+        self.package = Package.objects.create(name='Foo_Bar')
+        self.hidden = Package.objects.create(name='hidden')
+        self.hidden.download_permissions.add(self.group)
+        release = Release.objects.create(package=self.package, version='1.0',
+            metadata_version='1.2',
+            package_info={'requires_python': ['>=2.6']})
+        self.dist = create_distribution(release, 'Foo_Bar-1.0.tar.gz',
+                                        self.user)
+
+    def tearDown(self):
+        self.dist.delete()
+
+    def get(self, url, accept):
+        return self.client.get(url, HTTP_AUTHORIZATION=self.auth,
+                               HTTP_ACCEPT=accept)
+
+    def test_index_json(self):
+        response = self.get('/simple/', simple.JSON_CONTENT_TYPE)
+        self.assertEqual(response['Content-Type'], simple.JSON_CONTENT_TYPE)
+        self.assertTrue('Accept' in response['Vary'])
+        data = json.loads(response.content)
+        self.assertEqual(data['meta'], {'api-version': '1.0'})
+        self.assertEqual(data['projects'], [{'name': 'Foo_Bar'}])
+
+    def test_package_json(self):
+        response = self.get('/simple/foo-bar/', 'application/vnd.pypi.simple.'
+                            'v1+json, text/html;q=0.1')
+        data = json.loads(response.content)
+        self.assertEqual(data['name'], 'foo-bar')
+        self.assertEqual(data['files'], [{
+            'filename': 'Foo_Bar-1.0.tar.gz',
+            'url': self.dist.content.url,
+            'hashes': {'md5': self.dist.md5_digest,
+                       'sha256': self.dist.sha256_digest},
+            'requires-python': '>=2.6',
+        }])
+
+    def test_html_preferred_by_default(self):
+        for accept in ('', '*/*', 'text/html, %s;q=0.5' % simple.JSON_CONTENT_TYPE):
+            response = self.get('/simple/', accept)
+            self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+    def test_etag_per_representation(self):
+        html = self.get('/simple/foo-bar/', 'text/html')
+        data = self.get('/simple/foo-bar/', simple.JSON_CONTENT_TYPE)
+        self.assertNotEqual(html['ETag'], data['ETag'])
+        response = self.client.get('/simple/foo-bar/',
+            HTTP_AUTHORIZATION=self.auth, HTTP_ACCEPT='text/html',
+            HTTP_IF_NONE_MATCH=data['ETag'])
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,96 @@
+from datetime import date, timedelta
+
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.test import TestCase
+
+from djangopypi import counters, stats
+from djangopypi.models import Package, Release, Distribution, \
+                              PackageDownloadDay, ReleaseDownloadDay
+from djangopypi.tests.utils import create_distribution, create_developer
+
+class TestDownloadStatistics(TestCase):
+
+    def setUp(self):
+        # Downloads counted by earlier tests would be written by the command
+        counters.flush_downloads()
+        self.user = create_developer()
+        self.foo = Package.objects.create(name='foo')
+        self.bar = Package.objects.create(name='bar')
+        self.dists = []
+        for package, version in ((self.foo, '1.0'), (self.foo, '1.1'),
+                                 (self.bar, '1.0')):
+            release = Release.objects.create(package=package, version=version)
+            self.dists.append(create_distribution(release,
+                '%s-%s.tar.gz' % (package.name, version), self.user))
+
+    def tearDown(self):
+        for dist in self.dists:
+            dist.delete()
+
+    def downloaded(self, dist, count):
+        Distribution.objects.filter(pk=dist.pk).update(
+            downloads=Distribution.objects.get(pk=dist.pk).downloads + count)
+
+    def test_incremental_aggregation(self):
+        yesterday = date.today() - timedelta(days=1)
+        self.downloaded(self.dists[0], 3)
+        self.downloaded(self.dists[2], 1)
+        self.assertEqual(stats.aggregate_downloads(yesterday), 2)
+        self.assertEqual(stats.aggregate_downloads(yesterday), 0)
+
+        self.downloaded(self.dists[0], 2)
+        self.downloaded(self.dists[1], 4)
+        call_command('aggregate_downloads', verbosity=0)
+        self.assertEqual(list(PackageDownloadDay.objects.filter(
+            package=self.foo).values_list('day', 'downloads')),
+            [(yesterday, 3), (date.today(), 6)])
+        self.assertEqual(list(ReleaseDownloadDay.objects.filter(
+            day=date.today()).order_by('release__version').values_list(
+            'release__version', 'downloads')), [('1.0', 2), ('1.1', 4)])
+
+    def test_queries(self):
+        self.downloaded(self.dists[0], 3)
+        stats.aggregate_downloads()
+        self.downloaded(self.dists[0], 3)
+        self.downloaded(self.dists[1], 3)
+        # The rows, one update per distribution and per package and
+        # release, and the rows of new days
+        self.assertNumQueries(1 + 2 + 1 + 2 + 1, stats.aggregate_downloads)
+
+    def test_daily_and_top(self):
+        today = date.today()
+        for days_ago, foo, bar in ((0, 5, 1), (3, 2, 9), (10, 100, 0)):
+            self.downloaded(self.dists[0], foo)
+            self.downloaded(self.dists[2], bar)
+            stats.aggregate_downloads(today - timedelta(days=days_ago))
+
+        daily = stats.daily_downloads(self.foo, 7)
+        self.assertEqual(len(daily), 7)
+        self.assertEqual(daily[-1], (today, 5))
+        self.assertEqual(daily[-4], (today - timedelta(days=3), 2))
+        self.assertEqual(sum(downloads for day, downloads in daily), 7)
+        self.assertEqual(stats.release_downloads(self.foo, 7), [('1.0', 7)])
+
+        self.assertEqual(stats.top_packages(7), [('bar', 10), ('foo', 7)])
+        self.assertEqual(stats.top_packages(30), [('foo', 107), ('bar', 10)])
+        self.assertEqual(stats.top_packages(7, limit=1), [('bar', 10)])
+        self.assertEqual(stats.top_packages(7,
+            Package.objects.filter(name='foo')), [('foo', 7)])
+
+    def test_views(self):
+        self.downloaded(self.dists[0], 5)
+        stats.aggregate_downloads()
+        self.client.login(username='dev', password='secret')
+        response = self.client.get('/pypi/foo/stats/?days=7')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total'], 5)
+        self.assertEqual(response.context['releases'], [('1.0', 5)])
+        self.assertEqual(self.client.get('/pypi/foo/stats/?days=x').context[
+            'days'], 30)
+
+        response = self.client.get('/stats/')
+        self.assertEqual(response.context['packages'], [('foo', 5)])
+
+        self.bar.download_permissions.add(Group.objects.create(name='x'))
+        self.assertEqual(self.client.get('/pypi/bar/stats/').status_code, 403)
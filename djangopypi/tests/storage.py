@@ -0,0 +1,173 @@
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase
+
+from djangopypi import conf
+from djangopypi.models import Package, Release, Distribution, \
+                              distribution_upload_to
+from djangopypi.storage import ContentAddressedStorage
+from djangopypi.utils import file_digests
+from djangopypi.tests.utils import basic_auth_header, create_distribution, \
+                                   create_developer
+
+class TestContentAddressedStorage(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(location=self.root,
+                                               base_url='/packages/')
+        self.field = Distribution._meta.get_field('content')
+        self.old_storage = self.field.storage
+        self.field.storage = self.storage
+
+    def tearDown(self):
+        self.field.storage = self.old_storage
+        shutil.rmtree(self.root)
+
+    def blob(self, content):
+        digest = file_digests(ContentFile(content))[1]
+        return self.storage.blob_name(digest)
+
+    def test_identical_files_stored_once(self):
+        first = self.storage.save('f/foo-1.0.tar.gz', ContentFile('same'))
+        second = self.storage.save('b/bar-1.0.tar.gz', ContentFile('same'))
+        self.assertEqual(self.storage.url(first), '/packages/f/foo-1.0.tar.gz')
+        digest = file_digests(ContentFile('same'))[1]
+        blob = self.storage.blob_name(digest)
+        self.assertEqual(blob, os.path.join('.blobs', digest[:2], digest[2:4],
+                                            digest))
+        self.assertTrue(os.path.samefile(self.storage.path(first),
+                                         self.storage.path(blob)))
+        self.assertTrue(os.path.samefile(self.storage.path(second),
+                                         self.storage.path(blob)))
+        self.assertEqual(self.storage.reference_count(first), 2)
+
+    def test_blob_removed_with_last_reference(self):
+        first = self.storage.save('f/foo-1.0.tar.gz', ContentFile('same'))
+        second = self.storage.save('b/bar-1.0.tar.gz', ContentFile('same'))
+        blob = self.blob('same')
+        self.storage.delete(first)
+        self.assertTrue(self.storage.exists(blob))
+        self.assertEqual(self.storage.open(second).read(), 'same')
+        self.storage.delete(second)
+        self.assertFalse(self.storage.exists(blob))
+
+    def test_blob_deleted_while_saving(self):
+        first = self.storage.save('f/foo-1.0.tar.gz', ContentFile('same'))
+        store_blob = self.storage._store_blob
+        def racing_store_blob(digest, content):
+            # The last reference goes right after the blob has been found
+            blob = store_blob(digest, content)
+            if self.storage.exists(first):
+                self.storage.delete(first)
+            return blob
+        self.storage._store_blob = racing_store_blob
+        second = self.storage.save('b/bar-1.0.tar.gz', ContentFile('same'))
+        self.assertEqual(self.storage.open(second).read(), 'same')
+        self.assertTrue(os.path.samefile(self.storage.path(second),
+                                         self.storage.path(self.blob('same'))))
+
+    def test_blob_deleted_while_deleting(self):
+        first = self.storage.save('f/foo-1.0.tar.gz', ContentFile('same'))
+        blob_of = self.storage._blob_of
+        def racing_blob_of(name, stat=None):
+            # Another delete removes the blob once this one has found it
+            blob = blob_of(name, stat)
+            os.remove(self.storage.path(blob))
+            return blob
+        self.storage._blob_of = racing_blob_of
+        self.storage.delete(first)
+        self.assertFalse(self.storage.exists(first))
+
+    def test_distribution_delete(self):
+        user = create_developer()
+        releases = [Release.objects.create(version='1.0',
+            package=Package.objects.create(name=name))
+            for name in ('foo', 'bar')]
+        first = create_distribution(releases[0], 'foo-1.0.tar.gz', user)
+        second = create_distribution(releases[1], 'bar-1.0.tar.gz', user)
+        blob = self.blob('gibberish')
+        self.assertEqual(self.storage.reference_count(first.content.name), 2)
+        first.delete()
+        self.assertTrue(self.storage.exists(second.content.name))
+        second.delete()
+        self.assertFalse(self.storage.exists(blob))
+
+    def test_adopt_existing_files(self):
+        names = ['f/foo-1.0.tar.gz', 'b/bar-1.0.tar.gz']
+        for name in names:
+            os.makedirs(os.path.dirname(self.storage.path(name)))
+            open(self.storage.path(name), 'wb').write('same')
+        self.assertEqual(self.storage.adopt(names[0]), 'linked')
+        self.assertEqual(self.storage.adopt(names[1]), 'deduplicated')
+        self.assertEqual(self.storage.adopt(names[1]), None)
+        self.assertTrue(os.path.samefile(self.storage.path(names[0]),
+                                         self.storage.path(names[1])))
+        self.assertEqual(self.storage.open(names[1]).read(), 'same')
+        self.assertEqual(self.storage.reference_count(names[0]), 2)
+
+class TestDistributionLayout(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.layout = conf.DISTRIBUTION_LAYOUT
+        self.user = create_developer()
+        self.package = Package.objects.create(name='Foo_Bar')
+        self.release = Release.objects.create(package=self.package,
+                                              version='1.0')
+
+    def tearDown(self):
+        conf.DISTRIBUTION_LAYOUT = self.layout
+        for dist in Distribution.objects.all():
+            dist.delete()
+
+    def test_layouts(self):
+        dist = Distribution(release=self.release)
+        conf.DISTRIBUTION_LAYOUT = 'letter'
+        self.assertEqual(distribution_upload_to(dist, 'Foo_Bar-1.0.tar.gz'),
+                         'f/Foo_Bar-1.0.tar.gz')
+        conf.DISTRIBUTION_LAYOUT = 'name'
+        self.assertEqual(distribution_upload_to(dist, 'Foo_Bar-1.0.tar.gz'),
+                         'foo-bar/Foo_Bar-1.0.tar.gz')
+        conf.DISTRIBUTION_LAYOUT = 'hash'
+        path = distribution_upload_to(dist, 'Foo_Bar-1.0.tar.gz')
+        self.assertEqual(len(path.split('/')), 3)
+        self.assertEqual(path, distribution_upload_to(None, 'Foo_Bar-1.0.tar.gz'))
+        conf.DISTRIBUTION_LAYOUT = lambda dist, filename: 'all/' + filename
+        self.assertEqual(distribution_upload_to(dist, 'Foo_Bar-1.0.tar.gz'),
+                         'all/Foo_Bar-1.0.tar.gz')
+
+    def test_relocate(self):
+        dists = [create_distribution(self.release, name, self.user,
+                                     filetype=filetype)
+                 for name, filetype in (('Foo_Bar-1.0.tar.gz', 'sdist'),
+                                        ('Foo_Bar-1.0.zip', 'bdist_dumb'))]
+        storage = dists[0].content.storage
+        old_names = [dist.content.name for dist in dists]
+        auth = basic_auth_header('dev', 'secret')
+        self.assertTrue(old_names[1] in
+            self.client.get('/simple/Foo_Bar/', HTTP_AUTHORIZATION=auth).content)
+
+        conf.DISTRIBUTION_LAYOUT = 'name'
+        call_command('relocate_distributions', batch_size=1)
+        for dist, old in zip(dists, old_names):
+            dist = Distribution.objects.get(pk=dist.pk)
+            self.assertEqual(dist.content.name,
+                             'foo-bar/%s' % os.path.basename(old))
+            self.assertEqual(dist.content.read(), 'gibberish')
+            dist.content.close()
+            self.assertFalse(storage.exists(old))
+        page = self.client.get('/simple/Foo_Bar/',
+                               HTTP_AUTHORIZATION=auth).content
+        self.assertTrue('/packages/foo-bar/Foo_Bar-1.0.zip' in page)
+
+        # Running again finds nothing to do
+        call_command('relocate_distributions')
+        self.assertEqual(Distribution.objects.get(pk=dists[0].pk).content.name,
+                         'foo-bar/Foo_Bar-1.0.tar.gz')
@@ -0,0 +1,123 @@
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import simplejson as json
+
+from djangopypi import conf
+from djangopypi.models import Package, Release, APIToken
+from djangopypi.utils import token_digest
+from djangopypi.views.distutils import register_or_upload
+from djangopypi.tests.utils import basic_auth_header, create_distribution, \
+                                   DeveloperTestMixin
+
+class TestAPITokens(DeveloperTestMixin, TestCase):
+
+    developer_permissions = ('add_package',)
+
+    def setUp(self):
+        super(TestAPITokens, self).setUp()
+        self.package = Package.objects.create(name='foo')
+        self.package.owners.add(self.group)
+        self.package.download_permissions.add(self.group)
+        self.release = Release.objects.create(package=self.package,
+                                              version='1.0')
+        self.dist = create_distribution(self.release, 'foo-1.0.tar.gz',
+                                        self.user)
+
+    def tearDown(self):
+        self.dist.delete()
+
+    def token_auth(self, secret):
+        return basic_auth_header(conf.TOKEN_USERNAME, secret)
+
+    def register(self, secret, name='foo'):
+        request = RequestFactory().post('/', {':action': 'submit',
+            'name': name, 'version': '1.1', 'metadata_version': '1.0'},
+            HTTP_AUTHORIZATION=self.token_auth(secret))
+        request.user = AnonymousUser()
+        return register_or_upload(request)
+
+    def test_only_digest_stored(self):
+        token, secret = APIToken.objects.create_token(self.user, 'ci')
+        self.assertTrue(secret.startswith(conf.TOKEN_PREFIX))
+        self.assertEqual(token.digest, token_digest(secret))
+        self.assertFalse(APIToken.objects.filter(digest=secret).exists())
+        self.assertEqual(APIToken.objects.get_by_secret(secret), token)
+
+    def test_simple_page_with_token(self):
+        token, secret = APIToken.objects.create_token(self.user)
+        response = self.client.get('/simple/foo/',
+                                   HTTP_AUTHORIZATION=self.token_auth(secret))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/simple/foo/',
+            HTTP_AUTHORIZATION=self.token_auth('pypi-bogus'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_revoked_token(self):
+        token, secret = APIToken.objects.create_token(self.user)
+        token.revoked = True
+        token.save()
+        response = self.client.get('/simple/foo/',
+                                   HTTP_AUTHORIZATION=self.token_auth(secret))
+        self.assertEqual(response.status_code, 401)
+
+    def test_package_scope(self):
+        other = Package.objects.create(name='bar')
+        token, secret = APIToken.objects.create_token(self.user,
+                                                      package=other)
+        self.assertFalse(token.allows(self.package))
+        self.assertTrue(token.allows('Bar'))
+        response = self.client.get('/simple/foo/',
+                                   HTTP_AUTHORIZATION=self.token_auth(secret))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(self.dist.content.url,
+                                   HTTP_AUTHORIZATION=self.token_auth(secret))
+        self.assertEqual(response.status_code, 403)
+
+    def test_package_scope_of_index(self):
+        other = Package.objects.create(name='bar')
+        Release.objects.create(package=other, version='1.0')
+        token, secret = APIToken.objects.create_token(self.user,
+                                                      package=other)
+        response = self.client.get('/simple/',
+                                   HTTP_AUTHORIZATION=self.token_auth(secret))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('bar' in response.content)
+        self.assertFalse('foo' in response.content)
+        response = self.client.get('/simple/',
+            HTTP_ACCEPT='application/vnd.pypi.simple.v1+json',
+            HTTP_AUTHORIZATION=self.token_auth(secret))
+        self.assertEqual(json.loads(response.content)['projects'],
+                         [{'name': 'bar'}])
+
+        # The unscoped index of the same user is cached separately
+        token, secret = APIToken.objects.create_token(self.user)
+        response = self.client.get('/simple/',
+                                   HTTP_AUTHORIZATION=self.token_auth(secret))
+        self.assertTrue('foo' in response.content)
+
+    def test_package_scope_of_details(self):
+        other = Package.objects.create(name='bar')
+        token, secret = APIToken.objects.create_token(self.user,
+                                                      package=other)
+        response = self.client.get('/pypi/foo/doap.rdf',
+                                   HTTP_AUTHORIZATION=self.token_auth(secret))
+        self.assertEqual(response.status_code, 403)
+        token, secret = APIToken.objects.create_token(self.user,
+                                                      package=self.package)
+        response = self.client.get('/pypi/foo/doap.rdf',
+                                   HTTP_AUTHORIZATION=self.token_auth(secret))
+        self.assertEqual(response.status_code, 200)
+
+    def test_read_only_token_cannot_upload(self):
+        token, secret = APIToken.objects.create_token(self.user)
+        self.assertEqual(self.register(secret).status_code, 403)
+        self.assertFalse(self.package.releases.filter(version='1.1').exists())
+
+    def test_upload_token(self):
+        token, secret = APIToken.objects.create_token(self.user,
+            scope='upload', package=self.package)
+        response = self.register(secret)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.package.releases.filter(version='1.1').exists())
+        self.assertEqual(self.register(secret, 'other').status_code, 403)
@@ -0,0 +1,556 @@
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from hashlib import md5, sha256
+
+from django.contrib.auth.models import User, Group, AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.client import Client, RequestFactory, encode_multipart, \
+                               BOUNDARY
+from django.http import Http404
+from django.utils import simplejson as json
+
+from djangopypi import conf
+from djangopypi.http import parse_distutils_request
+from djangopypi.models import Package, Release, Distribution, UploadSession
+from djangopypi.views import root
+from djangopypi.views.uploads import upload_session
+from djangopypi.tests.utils import DISTUTILS_BOUNDARY, distutils_body, \
+                                   basic_auth_header, create_distribution, \
+                                   DeveloperTestMixin, ThreadedTestMixin
+
+class TestDistutilsRequestParser(TestCase):
+
+    def setUp(self):
+        self.chunk_size = conf.UPLOAD_CHUNK_SIZE
+        conf.UPLOAD_CHUNK_SIZE = 100
+
+    def tearDown(self):
+        conf.UPLOAD_CHUNK_SIZE = self.chunk_size
+
+    def parse(self, body, content_type='multipart/form-data; boundary=%s' %
+              DISTUTILS_BOUNDARY):
+        request = RequestFactory().post('/', body, content_type=content_type)
+        parse_distutils_request(request)
+        return request
+
+    def test_distutils_request(self):
+        content = ''.join(chr(i % 256) for i in range(5000)) + '\n'
+        request = self.parse(distutils_body([
+            (':action', 'file_upload'),
+            ('name', 'foo'),
+            ('classifiers', 'Framework :: Django'),
+            ('classifiers', 'Programming Language :: Python'),
+            ('empty', ''),
+            ('description', 'ends in a carriage return\r'),
+            ('content', ('foo-1.0.tar.gz', content)),
+        ]))
+        self.assertEqual(request.POST[':action'], 'file_upload')
+        self.assertEqual(request.POST['name'], 'foo')
+        self.assertEqual(request.POST.getlist('classifiers'),
+                         ['Framework :: Django',
+                          'Programming Language :: Python'])
+        self.assertEqual(request.POST['empty'], '')
+        self.assertEqual(request.POST['description'],
+                         'ends in a carriage return\r')
+
+        uploaded = request.FILES['content']
+        self.assertTrue(isinstance(uploaded, TemporaryUploadedFile))
+        self.assertTrue(os.path.exists(uploaded.temporary_file_path()))
+        self.assertEqual(uploaded.name, 'foo-1.0.tar.gz')
+        self.assertEqual(uploaded.size, len(content))
+        self.assertEqual(uploaded.read(), content)
+        self.assertEqual(uploaded.md5_digest, md5(content).hexdigest())
+        self.assertEqual(uploaded.sha256_digest, sha256(content).hexdigest())
+
+    def test_boundary_sniffed_from_body(self):
+        request = self.parse(distutils_body([('name', 'foo')]),
+                             content_type='multipart/form-data')
+        self.assertEqual(request.POST['name'], 'foo')
+
+    def test_delimiter_split_over_chunks(self):
+        for size in range(1, 120, 7):
+            content = 'x' * size + '\r'
+            request = self.parse(distutils_body([
+                ('content', ('foo-1.0.zip', content)), ('name', 'foo')]))
+            self.assertEqual(request.FILES['content'].read(), content)
+            self.assertEqual(request.POST['name'], 'foo')
+
+    def test_standard_multipart(self):
+        content = 'binary\r\n--not a delimiter\r\n' * 50
+        upload = TemporaryUploadedFile('foo-1.0-py2-none-any.whl',
+                                       'application/octet-stream', 0, None)
+        upload.write(content)
+        upload.seek(0)
+        request = self.parse(encode_multipart(BOUNDARY, {
+            ':action': 'file_upload', 'name': 'foo', 'content': upload}),
+            content_type='multipart/form-data; boundary=%s' % BOUNDARY)
+        self.assertEqual(request.POST['name'], 'foo')
+        self.assertEqual(request.FILES['content'].name,
+                         'foo-1.0-py2-none-any.whl')
+        self.assertEqual(request.FILES['content'].read(), content)
+
+    def test_invalid_body(self):
+        self.assertRaises(ValueError, self.parse,
+                          distutils_body([('name', 'foo')])[:-30])
+
+class UploadTestCase(DeveloperTestMixin, TransactionTestCase):
+    """ Uploads through the client by a developer allowed to add packages,
+    committing them as the views do """
+
+    developer_permissions = ('add_package',)
+
+    def tearDown(self):
+        for dist in Distribution.objects.all():
+            dist.delete()
+        # TransactionTestCase only flushes before each test, the plain unit
+        # tests running after this one expect no packages
+        Package.objects.all().delete()
+
+class TestUploads(UploadTestCase):
+
+    def setUp(self):
+        super(TestUploads, self).setUp()
+        self.content = 'gibberish\n' * 1000
+
+    def upload(self, name='foo', **digests):
+        data = [(':action', 'file_upload'), ('name', name),
+                ('version', '1.0'), ('metadata_version', '1.0')]
+        data.extend(digests.items())
+        data.append(('content', ('foo-1.0.tar.gz', self.content)))
+        return self.client.post('/', distutils_body(data),
+            content_type='multipart/form-data; boundary=%s' %
+                         DISTUTILS_BOUNDARY,
+            HTTP_AUTHORIZATION=basic_auth_header('dev', 'secret'))
+
+    def test_digests_stored(self):
+        response = self.upload(md5_digest=md5(self.content).hexdigest())
+        self.assertEqual(response.status_code, 200)
+        dist = Distribution.objects.get()
+        self.assertEqual(dist.md5_digest, md5(self.content).hexdigest())
+        self.assertEqual(dist.sha256_digest, sha256(self.content).hexdigest())
+        self.assertEqual(dist.size, len(self.content))
+        self.assertEqual(dist.content.read(), self.content)
+
+    def test_digest_mismatch(self):
+        response = self.upload(md5_digest=md5('other').hexdigest())
+        self.assertEqual(response.status_code, 400)
+        response = self.upload(sha256_digest=sha256('other').hexdigest())
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Distribution.objects.exists())
+
+    def test_digests_of_other_files(self):
+        package = Package.objects.create(name='bar')
+        release = Release.objects.create(package=package, version='1.0')
+        dist = create_distribution(release, 'bar-1.0.tar.gz', self.user,
+                                   self.content)
+        self.assertEqual(dist.md5_digest, md5(self.content).hexdigest())
+        self.assertEqual(dist.sha256_digest, sha256(self.content).hexdigest())
+        self.assertEqual(dist.size, len(self.content))
+
+    def test_duplicate_upload(self):
+        self.assertEqual(self.upload().status_code, 200)
+        dist = Distribution.objects.get()
+        directory = os.path.dirname(dist.content.path)
+        files = sorted(os.listdir(directory))
+        self.content = 'other content'
+        self.assertEqual(self.upload().status_code, 400)
+        self.assertEqual(sorted(os.listdir(directory)), files)
+        self.assertEqual(Distribution.objects.get(), dist)
+        self.assertEqual(dist.content.read(), 'gibberish\n' * 1000)
+        dist.content.close()
+
+    def test_failed_upload_leaves_no_release(self):
+        response = self.upload(md5_digest=md5('other').hexdigest())
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Release.objects.exists())
+        self.assertFalse(Package.objects.exists())
+
+    def test_other_spelling(self):
+        Package.objects.create(name='Foo').owners.add(self.group)
+        self.assertEqual(self.upload('FOO').status_code, 200)
+        self.assertEqual(list(Package.objects.values_list('name', flat=True)),
+                         ['Foo'])
+        self.assertEqual(Distribution.objects.get().release.package_id, 'Foo')
+
+    def test_other_spelling_of_foreign_package(self):
+        other = Group.objects.create(name='others')
+        Package.objects.create(name='Foo').owners.add(other)
+        self.assertEqual(self.upload('foo').status_code, 403)
+        self.assertEqual(list(Package.objects.values_list('name', flat=True)),
+                         ['Foo'])
+        self.assertFalse(Release.objects.exists())
+
+    def test_leftover_file_replaced(self):
+        storage = Distribution._meta.get_field('content').storage
+        storage.save('f/foo-1.0.tar.gz', ContentFile('left over'))
+        self.assertEqual(self.upload().status_code, 200)
+        dist = Distribution.objects.get()
+        self.assertEqual(dist.content.name, 'f/foo-1.0.tar.gz')
+        self.assertEqual(dist.content.read(), self.content)
+        dist.content.close()
+
+class TestBatchUpload(UploadTestCase):
+
+    def upload(self, files, *fields):
+        data = [(':action', 'file_upload_batch'), ('name', 'foo'),
+                ('version', '1.0'), ('metadata_version', '1.0'),
+                ('summary', 'Foo')]
+        data.extend(fields)
+        data.extend(('content', item) for item in files)
+        return self.client.post('/', distutils_body(data),
+            content_type='multipart/form-data; boundary=%s' %
+                         DISTUTILS_BOUNDARY,
+            HTTP_AUTHORIZATION=basic_auth_header('dev', 'secret'))
+
+    def test_batch_upload(self):
+        response = self.upload([('foo-1.0-py2-none-linux.whl', 'linux'),
+                                ('foo-1.0-py2-none-win32.whl', 'win32'),
+                                ('foo-1.0.tar.gz', 'sdist')],
+                               ('filetype', 'bdist_wheel'),
+                               ('filetype', 'bdist_wheel'),
+                               ('filetype', 'sdist'),
+                               ('pyversion', 'py2'),
+                               ('sha256_digest', sha256('linux').hexdigest()),
+                               ('sha256_digest', ''),
+                               ('sha256_digest', ''))
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertTrue(result['created_package'])
+        self.assertEqual([f['status'] for f in result['files']],
+                         ['uploaded'] * 3)
+
+        release = Release.objects.get(package__name='foo', version='1.0')
+        self.assertEqual(release.package_info['summary'], 'Foo')
+        dists = release.distributions.order_by('content')
+        self.assertEqual([(os.path.basename(d.content.name), d.filetype,
+                           d.pyversion) for d in dists],
+                         [('foo-1.0-py2-none-linux.whl', 'bdist_wheel', 'py2'),
+                          ('foo-1.0-py2-none-win32.whl', 'bdist_wheel', 'py2'),
+                          ('foo-1.0.tar.gz', 'sdist', 'py2')])
+        self.assertEqual(dists[1].content.read(), 'win32')
+        dists[1].content.close()
+
+    def test_per_file_results(self):
+        self.upload([('foo-1.0.tar.gz', 'sdist')])
+        response = self.upload([('foo-1.0.tar.gz', 'again'),
+                                ('foo-1.0.zip', 'zip'),
+                                ('foo-1.0-py2-none-any.whl', 'wheel')],
+                               ('md5_digest', ''),
+                               ('md5_digest', ''),
+                               ('md5_digest', md5('other').hexdigest()))
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertFalse(result['created_package'])
+        self.assertEqual([(f['filename'], f['status'])
+                          for f in result['files']],
+                         [('foo-1.0.tar.gz', 'rejected'),
+                          ('foo-1.0.zip', 'uploaded'),
+                          ('foo-1.0-py2-none-any.whl', 'rejected')])
+        self.assertEqual(
+            sorted(Distribution.objects.values_list('md5_digest', flat=True)),
+            sorted([md5('sdist').hexdigest(), md5('zip').hexdigest()]))
+
+    def test_all_files_rejected(self):
+        response = self.upload([('foo-1.0.tar.gz', 'sdist'),
+                                ('foo-1.0.zip', 'zip')],
+                               ('md5_digest', md5('other').hexdigest()))
+        self.assertEqual(response.status_code, 400)
+        result = json.loads(response.content)
+        self.assertFalse(result['created_package'])
+        self.assertEqual([f['status'] for f in result['files']],
+                         ['rejected'] * 2)
+        # Neither the package nor the release stay behind without files
+        self.assertFalse(Package.objects.exists())
+        self.assertFalse(Release.objects.exists())
+
+    def test_field_count_mismatch(self):
+        response = self.upload([('foo-1.0.tar.gz', 'sdist'),
+                                ('foo-1.0.zip', 'zip'),
+                                ('foo-1.0.egg', 'egg')],
+                               ('filetype', 'sdist'), ('filetype', 'sdist'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Package.objects.exists())
+
+    def test_refused_upload(self):
+        other = Group.objects.create(name='others')
+        Package.objects.create(name='foo').owners.add(other)
+        response = self.upload([('foo-1.0.tar.gz', 'sdist')])
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Release.objects.exists())
+
+class TestConcurrentUploads(ThreadedTestMixin, UploadTestCase):
+    """ Parallel uploads through the client, each in a thread of its own """
+
+    copies = 4
+
+    def upload(self, start, results, filename, content):
+        body = distutils_body([(':action', 'file_upload'), ('name', 'stress'),
+            ('version', '1.0'), ('metadata_version', '1.0'),
+            ('filetype', 'bdist_wheel'), ('pyversion', 'py2'),
+            ('md5_digest', md5(content).hexdigest()),
+            ('content', (filename, content))])
+        start.wait()
+        try:
+            try:
+                status = Client().post('/', body,
+                    content_type='multipart/form-data; boundary=%s' %
+                                 DISTUTILS_BOUNDARY,
+                    HTTP_AUTHORIZATION=basic_auth_header('dev', 'secret')
+                    ).status_code
+            except Exception, e:
+                # The client raises what the view raised
+                status = repr(e)
+            results.append((filename, status))
+        finally:
+            connection.close()
+
+    def upload_in_parallel(self, files):
+        start = threading.Event()
+        results = []
+        threads = [threading.Thread(target=self.upload,
+                                    args=(start, results) + item)
+                   for item in files for i in range(self.copies)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_parallel_uploads(self):
+        files = [('stress-1.0-py2-none-plat%d.whl' % i, os.urandom(4096))
+                 for i in range(3)]
+        results = self.upload_in_parallel(files)
+
+        for filename, content in files:
+            self.assertEqual(sorted(status for name, status in results
+                                    if name == filename),
+                             [200] + [400] * (self.copies - 1))
+        release = Release.objects.get()
+        self.assertEqual(Package.objects.get().name, 'stress')
+        dists = release.distributions.order_by('content')
+        self.assertEqual([(dist.filename, dist.content.read())
+                          for dist in dists], files)
+        for dist in dists:
+            dist.content.close()
+        # The refused copies left nothing behind, renamed or not
+        directory = os.path.dirname(dists[0].content.path)
+        self.assertEqual(sorted(name for name in os.listdir(directory)
+                                if name.startswith('stress')),
+                         [filename for filename, content in files])
+
+class TestResumableUpload(DeveloperTestMixin, TestCase):
+
+    developer_permissions = ('add_package',)
+
+    def setUp(self):
+        super(TestResumableUpload, self).setUp()
+        self.directory = conf.CHUNKED_UPLOAD_DIRECTORY
+        conf.CHUNKED_UPLOAD_DIRECTORY = tempfile.mkdtemp()
+        self.content = ''.join(chr(i % 256) for i in range(3000))
+
+    def tearDown(self):
+        for dist in Distribution.objects.all():
+            dist.delete()
+        shutil.rmtree(conf.CHUNKED_UPLOAD_DIRECTORY)
+        conf.CHUNKED_UPLOAD_DIRECTORY = self.directory
+
+    def auth_headers(self, username='dev'):
+        return {'HTTP_AUTHORIZATION': basic_auth_header(username, 'secret')}
+
+    def create(self, filename='foo-1.0.tar.gz'):
+        response = self.client.post('/uploads/', {'name': 'foo',
+            'version': '1.0', 'filename': filename,
+            'size': len(self.content)}, **self.auth_headers())
+        self.assertEqual(response.status_code, 201)
+        return json.loads(response.content)['url']
+
+    def put(self, url, first, last):
+        return self.client.put(url, self.content[first:last + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes %d-%d/%d' % (first, last,
+                                                   len(self.content)),
+            **self.auth_headers())
+
+    def finalize(self, url, digest=None):
+        return self.client.post(url, {'metadata_version': '1.0',
+            'filetype': 'sdist',
+            'sha256_digest': digest or sha256(self.content).hexdigest()},
+            **self.auth_headers())
+
+    def test_upload_in_chunks(self):
+        url = self.create()
+        session = UploadSession.objects.get()
+        self.assertTrue(os.path.exists(session.path))
+        self.assertEqual(self.put(url, 0, 999).status_code, 200)
+        response = self.put(url, 1000, 2999)
+        self.assertEqual(json.loads(response.content)['offset'], 3000)
+
+        response = self.finalize(url)
+        self.assertEqual(response.status_code, 200)
+        dist = Distribution.objects.get()
+        self.assertEqual(dist.filetype, 'sdist')
+        self.assertEqual(dist.sha256_digest, sha256(self.content).hexdigest())
+        self.assertEqual(dist.md5_digest, md5(self.content).hexdigest())
+        self.assertEqual(dist.content.read(), self.content)
+        dist.content.close()
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.path))
+
+    def test_resume(self):
+        url = self.create()
+        self.put(url, 0, 999)
+        response = self.put(url, 2000, 2999)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content)['offset'], 1000)
+        # Sending data again is harmless
+        self.assertEqual(self.put(url, 500, 1499).status_code, 200)
+        response = self.client.get(url, **self.auth_headers())
+        self.assertEqual(json.loads(response.content)['offset'], 1500)
+        self.assertEqual(self.finalize(url).status_code, 409)
+
+        self.put(url, 1500, 2999)
+        self.assertEqual(self.finalize(url).status_code, 200)
+        self.assertEqual(Distribution.objects.get().size, len(self.content))
+
+    def test_bad_ranges(self):
+        url = self.create()
+        response = self.client.put(url, self.content[:10],
+            content_type='application/octet-stream', **self.auth_headers())
+        self.assertEqual(response.status_code, 400)
+        response = self.client.put(url, self.content[:10],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes 0-9/10', **self.auth_headers())
+        self.assertEqual(response.status_code, 400)
+
+    def test_digest_mismatch_discards_upload(self):
+        url = self.create()
+        self.put(url, 0, 2999)
+        response = self.finalize(url, sha256('other').hexdigest())
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(Distribution.objects.exists())
+        self.assertEqual(os.listdir(conf.CHUNKED_UPLOAD_DIRECTORY), [])
+
+    def test_session_of_other_user(self):
+        url = self.create()
+        request = RequestFactory().get(url)
+        request.user = User.objects.create_user('other', 'other@example.com',
+                                                'secret')
+        self.assertRaises(Http404, upload_session, request,
+                          UploadSession.objects.get().key)
+
+    def test_already_uploaded(self):
+        url = self.create()
+        self.put(url, 0, 2999)
+        self.finalize(url)
+        response = self.client.post('/uploads/', {'name': 'foo',
+            'version': '1.0', 'filename': 'foo-1.0.tar.gz',
+            'size': len(self.content)}, **self.auth_headers())
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_spelling_of_foreign_package(self):
+        other = Group.objects.create(name='others')
+        Package.objects.create(name='FOO').owners.add(other)
+        response = self.client.post('/uploads/', {'name': 'foo',
+            'version': '1.0', 'filename': 'foo-1.0.tar.gz',
+            'size': len(self.content)}, **self.auth_headers())
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_size_limit(self):
+        max_size = conf.CHUNKED_UPLOAD_MAX_SIZE
+        conf.CHUNKED_UPLOAD_MAX_SIZE = len(self.content) - 1
+        try:
+            response = self.client.post('/uploads/', {'name': 'foo',
+                'version': '1.0', 'filename': 'foo-1.0.tar.gz',
+                'size': len(self.content)}, **self.auth_headers())
+        finally:
+            conf.CHUNKED_UPLOAD_MAX_SIZE = max_size
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_session_limit(self):
+        max_sessions = conf.CHUNKED_UPLOAD_MAX_SESSIONS
+        conf.CHUNKED_UPLOAD_MAX_SESSIONS = 2
+        try:
+            self.create()
+            self.create('foo-1.0.zip')
+            response = self.client.post('/uploads/', {'name': 'foo',
+                'version': '1.0', 'filename': 'foo-1.0.egg',
+                'size': len(self.content)}, **self.auth_headers())
+            self.assertEqual(response.status_code, 403)
+            # Expired sessions do not count
+            UploadSession.objects.filter(filename='foo-1.0.zip').update(
+                updated=datetime.now() - timedelta(
+                    seconds=conf.CHUNKED_UPLOAD_EXPIRY + 1))
+            self.create('foo-1.0.egg')
+        finally:
+            conf.CHUNKED_UPLOAD_MAX_SESSIONS = max_sessions
+        self.assertEqual(sorted(UploadSession.objects.values_list(
+            'filename', flat=True)), ['foo-1.0.egg', 'foo-1.0.tar.gz'])
+
+    def test_cleanup(self):
+        self.create()
+        self.create('foo-1.0.zip')
+        expired, active = UploadSession.objects.order_by('pk')
+        UploadSession.objects.filter(pk=expired.pk).update(
+            updated=datetime.now() - timedelta(
+                seconds=conf.CHUNKED_UPLOAD_EXPIRY + 1))
+        orphan = os.path.join(conf.CHUNKED_UPLOAD_DIRECTORY, 'orphan')
+        open(orphan, 'wb').close()
+        os.utime(orphan, (0, 0))
+
+        call_command('cleanup_uploads', verbosity=0)
+        self.assertEqual(list(UploadSession.objects.all()), [active])
+        self.assertEqual(os.listdir(conf.CHUNKED_UPLOAD_DIRECTORY),
+                         [active.key])
+
+class TestUploadQueries(DeveloperTestMixin, TestCase):
+    """ The number of queries of an upload must not grow with the package """
+
+    developer_permissions = ('add_package',)
+
+    def setUp(self):
+        super(TestUploadQueries, self).setUp()
+        package = Package.objects.create(name='foo')
+        package.owners.add(self.group)
+        for i in range(20):
+            Release.objects.create(package=package, version='0.%d' % i)
+        # The password is verified once, later uploads use the cache and
+        # only load the user
+        self.upload('foo-0.0.tar.gz', '0.0')
+
+    def tearDown(self):
+        for dist in Distribution.objects.all():
+            dist.delete()
+
+    def upload(self, filename, version):
+        request = RequestFactory().post('/', distutils_body([
+                (':action', 'file_upload'), ('name', 'foo'),
+                ('version', version), ('metadata_version', '1.1'),
+                ('summary', 'Foo'), ('classifiers', 'Framework :: Django'),
+                ('filetype', 'sdist'), ('content', (filename, filename))]),
+            content_type='multipart/form-data; boundary=%s' %
+                         DISTUTILS_BOUNDARY,
+            HTTP_AUTHORIZATION=basic_auth_header('dev', 'secret'))
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        response = root(request)
+        self.assertEqual(response.status_code, 200)
+
+    # Reading the metadata of the file looks it up once more, and saving the
+    # release and the file moves the generation of the simple page on
+    def test_upload_to_existing_release(self):
+        self.assertNumQueries(13, self.upload, 'foo-0.0.zip', '0.0')
+
+    def test_upload_of_new_release(self):
+        self.assertNumQueries(16, self.upload, 'foo-1.0.tar.gz', '1.0')
@@ -0,0 +1,96 @@
+from cStringIO import StringIO
+
+from django.contrib.auth.models import User, Group, Permission
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.utils import unittest
+
+from djangopypi.models import Distribution
+
+def basic_auth_header(username, password):
+    return 'Basic %s' % ('%s:%s' % (username, password)).encode('base64').strip()
+
+DISTUTILS_BOUNDARY = '--------------GHSKFJDLGDS7543FJKLFHRE75642756743254'
+
+def distutils_body(data):
+    """ Encode ``data`` the way the distutils upload command does, with bare
+    newlines. File parts are given as (filename, content) tuples. """
+    sep_boundary = '\n--' + DISTUTILS_BOUNDARY
+    body = StringIO()
+    for key, value in data:
+        filename = ''
+        if isinstance(value, tuple):
+            filename = ';filename="%s"' % value[0]
+            value = value[1]
+        body.write(sep_boundary)
+        body.write('\nContent-Disposition: form-data; name="%s"' % key)
+        body.write(filename)
+        body.write('\n\n')
+        body.write(value)
+        if value and value[-1] == '\r':
+            body.write('\n')
+    body.write(sep_boundary + '--\n')
+    return body.getvalue()
+
+def create_distribution(release, filename, uploader, content='gibberish',
+                        **kwargs):
+    """ Create a distribution of ``release`` holding ``content`` """
+    kwargs.setdefault('filetype', 'sdist')
+    dist = Distribution(release=release, uploader=uploader, **kwargs)
+    dist.content.save(filename, ContentFile(content), save=False)
+    dist.save()
+    return dist
+
+def create_developer(group=None):
+    """ Create the user "dev" with the password "secret", a member of
+    ``group`` when one is given """
+    user = User.objects.create_user('dev', 'dev@example.com', 'secret')
+    if group is not None:
+        user.groups.add(group)
+    return user
+
+class DeveloperTestMixin(object):
+    """ Sets up the developer ``self.user``, see ``create_developer``, as a
+    member of ``self.group``, the "developers" group holding the permissions
+    named in ``developer_permissions``. ``self.auth`` is the developer's
+    Authorization header. """
+
+    developer_permissions = ()
+
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create(name='developers')
+        for codename in self.developer_permissions:
+            self.group.permissions.add(
+                Permission.objects.get(codename=codename))
+        self.user = create_developer(self.group)
+        self.auth = basic_auth_header('dev', 'secret')
+
+def in_memory_database():
+    """ Whether the tests run on an in-memory SQLite database, which every
+    thread would open afresh, empty """
+    return (connection.vendor == 'sqlite' and
+            connection.settings_dict['NAME'] == ':memory:')
+
+class ThreadedTestMixin(object):
+    """ For tests running requests in threads of their own, each with its
+    own database connection. They need a database the threads can share,
+    see "Running the tests" in the README, and are skipped without one. """
+
+    def setUp(self):
+        if in_memory_database():
+            raise unittest.SkipTest('Threaded tests need a database the '
+                                    'threads can share, set TEST_NAME')
+        super(ThreadedTestMixin, self).setUp()
+        self.options = connection.settings_dict.get('OPTIONS')
+        if connection.vendor == 'sqlite':
+            # SQLite takes one writer at a time, the threads' connections
+            # wait for each other rather than fail as the database is locked
+            options = dict(self.options or {})
+            options.setdefault('timeout', 60)
+            connection.settings_dict['OPTIONS'] = options
+
+    def tearDown(self):
+        connection.settings_dict['OPTIONS'] = self.options
+        super(ThreadedTestMixin, self).tearDown()
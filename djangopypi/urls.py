@@ -9,7 +9,13 @@ urlpatterns = patterns("djangopypi.views",
     url(r'^simple/$','packages.simple_index', name='djangopypi-package-index-simple'),
     url(r'^bootstrap/$', 'releases.bootstrap_index', name='djangopypi-bootstrap-index-simple'),
     url(r'^search/$','packages.search',name='djangopypi-search'),
+    url(r'^stats/$', 'packages.top', name='djangopypi-stats'),
     url(r'^pypi/$', 'root', name='djangopypi-release-index'),
+    url(r'^auth/download/$', 'releases.download_auth',
+        name='djangopypi-download-auth'),
+    url(r'^uploads/$', 'uploads.create_upload', name='djangopypi-uploads'),
+    url(r'^uploads/(?P<key>[0-9a-f]+)/$', 'uploads.upload_session',
+        name='djangopypi-upload-session'),
     #url(r'^rss/$', ReleaseFeed(), name='djangopypi-rss'),
     
     url(r'^simple/(?P<package>[\w\d_\.\-]+)/$','packages.simple_details',
@@ -21,6 +27,8 @@ urlpatterns = patterns("djangopypi.views",
     #    name='djangopypi-package-rss'),
     url(r'^pypi/(?P<package>[\w\d_\.\-]+)/doap.rdf$','packages.doap',
         name='djangopypi-package-doap'),
+    url(r'^pypi/(?P<package>[\w\d_\.\-]+)/stats/$','packages.stats',
+        name='djangopypi-package-stats'),
     url(r'^pypi/(?P<package>[\w\d_\.\-]+)/manage/$','packages.manage',
         name='djangopypi-package-manage'),
     url(r'^pypi/(?P<package>[\w\d_\.\-]+)/manage/versions/$','packages.manage_versions',
@@ -39,6 +47,11 @@ urlpatterns = patterns("djangopypi.views",
     url(r'^pypi/(?P<package>[\w\d_\.\-]+)/(?P<version>[\w\d_\.\-]+)/files/upload/$',
         'releases.upload_file',name='djangopypi-release-upload-file'),
 
+    url(
+        r'^%s/(?P<path>.*)\.metadata$' % (
+            settings.DJANGOPYPI_RELEASE_URL.strip('/')),
+        'releases.download_metadata', name='djangopypi-download-metadata'
+    ),
     url(
         r'^%s/(?P<path>.*)$' % (settings.DJANGOPYPI_RELEASE_URL.strip('/')),
         'releases.download_dist', {
@@ -1,4 +1,7 @@
+import os
+import re
 import sys, traceback
+from hashlib import md5, sha256
 
 
 
@@ -9,4 +12,36 @@ def debug(func):
             return func(*args, **kwargs)
         except:
             traceback.print_exception(*sys.exc_info())
-    return _wrapped
\ No newline at end of file
+    return _wrapped
+
+def normalize_name(name):
+    """ Normalize a package name as described in PEP 503 """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+def generate_token(prefix=''):
+    """ Return a new random API token """
+    return prefix + os.urandom(32).encode('hex')
+
+def token_digest(token):
+    """ API tokens are long random strings rather than passwords, so a single
+    round of SHA-256 is enough to keep them out of the database """
+    return sha256(token).hexdigest()
+
+def digest_fragment(md5_digest, sha256_digest):
+    """ The URL fragment installers check a downloaded file against: its
+    SHA-256 digest, its MD5 digest when that is all there is, or nothing """
+    if sha256_digest:
+        return '#sha256=%s' % sha256_digest
+    if md5_digest:
+        return '#md5=%s' % md5_digest
+    return ''
+
+def file_digests(fh):
+    """ Return the MD5 and SHA-256 hex digests and the size of a django File,
+    reading it in chunks """
+    md5_digest, sha256_digest, size = md5(), sha256(), 0
+    for chunk in fh.chunks():
+        md5_digest.update(chunk)
+        sha256_digest.update(chunk)
+        size += len(chunk)
+    return md5_digest.hexdigest(), sha256_digest.hexdigest(), size
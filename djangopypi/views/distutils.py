@@ -2,18 +2,21 @@ import os
 import textwrap
 
 from django.conf import settings
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.http import HttpResponseForbidden, HttpResponseBadRequest, \
                         HttpResponse
 from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.utils.datastructures import MultiValueDict
+from django.utils import simplejson as json
 from django.contrib.sites.models import Site
 
-from djangopypi import conf
+from djangopypi import conf, jobs
 from djangopypi.decorators import basic_auth
 from djangopypi.forms import PackageForm, ReleaseForm
-from djangopypi.models import Package, Release, Distribution, Classifier
+from djangopypi.models import Package, Release, Distribution, Classifier, \
+                              distribution_upload_to
+from djangopypi.storage import save_atomic
 import logging
 
 from datetime import datetime
@@ -75,73 +78,119 @@ def submit_package_or_release(user, post_data, files):
 
     return HttpResponse()
 
-@basic_auth
-@transaction.autocommit
-def register_or_upload(request):
+def get_or_create_package(name):
+    """ Fetch a package by any spelling of its name or create it, returning
+    whether it was created. Of several uploads creating the same package at
+    once, one creates it and the others pick it up """
+    try:
+        return Package.objects.get_by_name(name), False
+    except Package.DoesNotExist:
+        pass
+    sid = transaction.savepoint()
+    try:
+        package = Package.objects.create(name=name)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        return Package.objects.get_by_name(name), False
+    transaction.savepoint_commit(sid)
+    return package, True
 
+""" Fields describing a single uploaded file, with their defaults """
+FILE_FIELDS = (
+    ('filetype', 'sdist'),
+    ('pyversion', ''),
+    ('comment', ''),
+    ('gpg_signature', ''),
+    ('md5_digest', ''),
+    ('sha256_digest', ''),
+)
+
+def file_fields(post, index=0, count=1):
+    """ The per-file fields of the ``index``-th of ``count`` uploaded files. A
+    batch upload gives each field either once for all of its files or once
+    per file, in the order of the files """
+    fields = {}
+    for field, default in FILE_FIELDS:
+        values = post.getlist(field)
+        if not values:
+            fields[field] = default
+        elif len(values) == count:
+            fields[field] = values[index]
+        else:
+            fields[field] = values[-1]
+    return fields
+
+def upload_group(request, name):
+    """ The group the user uploads ``name`` as, or a response refusing the
+    upload """
     username = request.user.username
-    
-    if request.method != 'POST':
-        logger.info('user:%s. Only post requests are supported.' % (username))
-        return HttpResponseBadRequest('Only post requests are supported.')
 
-    name = request.POST.get('name',None).strip()
-    
-    if not name:
-        logger.info('user:%s. No package name specified.' % (username))
-        return HttpResponseBadRequest('No package name specified.')
+    token = getattr(request.user, 'api_token', None)
+    if token is not None and not token.allows(name, upload=True):
+        logger.info('user:%s. API token does not allow uploading %s.' % (username, name))
+        return None, HttpResponseForbidden('This API token does not allow uploading %s.' % (name))
 
     # get group of user
     try:
         group = request.user.groups.get()
     except:
         logger.info('Not allowing package to be uploaded: %s should only be in one group.' % (username))
-        return HttpResponseForbidden('Not allowing package to be uploaded: %s should only be in one group.' % (username))
+        return None, HttpResponseForbidden('Not allowing package to be uploaded: %s should only be in one group.' % (username))
         
     if not group:
         logger.info('%s is not in a group, not allowing package to be uploaded.' % (username))
-        return HttpResponseForbidden('%s is not in a group, not allowing package to be uploaded.' % (username))
+        return None, HttpResponseForbidden('%s is not in a group, not allowing package to be uploaded.' % (username))
 
     # check group can upload
-    if not 'add_package' in [ perm.codename for perm in group.permissions.all()]:
+    if not group.permissions.filter(codename='add_package').exists():
         logger.info("%s's group - %s does not have permissions to upload new packages." % (username, group.name))
-        return HttpResponseForbidden("%s's group - %s does not have permissions to upload new packages." % (username, group.name))
-    
-    # fetch existing package or create new one
-    try:
-        package = Package.objects.get(name=name)
-        created_package = False
-    except Package.DoesNotExist:
-        package = Package.objects.create(name=name)
-        package.owners.add(request.user.groups.all()[0])
-        package.download_permissions.add(request.user.groups.all()[0])
-        created_package = True
+        return None, HttpResponseForbidden("%s's group - %s does not have permissions to upload new packages." % (username, group.name))
+    return group, None
+
+def upload_package(request, name, group):
+    """ Fetch or create the package ``name`` for an upload by ``group``.
+    Returns the package, whether it was created and a response refusing the
+    upload when ``group`` does not own the package """
+    package, created_package = get_or_create_package(name)
+    if created_package:
+        package.owners.add(group)
+        package.download_permissions.add(group)
+        return package, created_package, None
         
-    if not request.user.is_superuser:
-        if not group in package.owners.all():
-            logger.info(
-                "'%s' is in the group '%s', only members of '%s' can upload new " \
-                "versions of this package." % (
-                    username,
-                    group.name,
-                    ",".join([p.name for p in package.owners.all()]),
-                )
+    if (not request.user.is_superuser and
+        not package.owners.filter(pk=group.pk).exists()):
+        owners = ",".join([p.name for p in package.owners.all()])
+        logger.info(
+            "'%s' is in the group '%s', only members of '%s' can upload new " \
+            "versions of this package." % (
+                request.user.username,
+                group.name,
+                owners,
             )
-            return HttpResponseForbidden(
-                "'%s' is in the group '%s', only members of '%s' can upload " \
-                "new versions of this package." % (
-                    username,
-                    ",".join([p.name for p in package.owners.all()]),
-                    group.name
-                )
+        )
+        return package, created_package, HttpResponseForbidden(
+            "'%s' is in the group '%s', only members of '%s' can upload " \
+            "new versions of this package." % (
+                request.user.username,
+                owners,
+                group.name
             )
-    
+        )
+    return package, created_package, None
+
+def update_release(request, package):
+    """ Fetch or create the release of ``package`` named in the request and
+    update its metadata. Returns the release, or a response rejecting the
+    metadata """
+    username = request.user.username
     version = request.POST.get('version', None)
     if version:
         version = version.strip()
     
     release, created = Release.objects.get_or_create(package=package,
                                                      version=version)
+    # Spares the signal handlers fetching the package again
+    release.package = package
 
     metadata_version = request.POST.get('metadata_version', None)
     if not metadata_version:
@@ -151,15 +200,13 @@ def register_or_upload(request):
         metadata_version = metadata_version.strip()
     
     if not version or not metadata_version:
-        transaction.rollback()
         logger.info('user:%s. Release version and metadata version must be specified' % (username))
-        return HttpResponseBadRequest('Release version and metadata version must be specified')
+        return None, HttpResponseBadRequest('Release version and metadata version must be specified')
     
     if not metadata_version in conf.METADATA_FIELDS:
-        transaction.rollback()
-        logger.info('user:%s. Metadata version must be one of: %s' 
+        logger.info('user:%s. Metadata version must be one of: %s' %
                                       (username, ', '.join(conf.METADATA_FIELDS.keys()),))
-        return HttpResponseBadRequest('Metadata version must be one of: %s' 
+        return None, HttpResponseBadRequest('Metadata version must be one of: %s' %
                                       (', '.join(conf.METADATA_FIELDS.keys()),))
     
     
@@ -183,38 +230,115 @@ def register_or_upload(request):
         release.package_info.setlist(key,
                                      filter(lambda v: v != 'UNKNOWN', value))
     
-    release.save()
+    # The release exists by now, there is no need to check for it
+    release.save(force_update=True)
+    return release, None
+
+def add_distribution(request, release, uploaded, existing, fields):
+    """ Add an uploaded file to a release. ``existing`` holds the file names
+    the release already has and ``fields`` the per-file fields of the upload.
+    Returns the new distribution, or None and the reason the file was
+    refused. The file is added under a savepoint, so refusing it leaves the
+    rest of the transaction intact. """
+    username = request.user.username
+    package = release.package
+
+    if uploaded.name in existing:
+        """ Need to add handling optionally deleting old and putting up new """
+        logger.info('user:%s package:%s. That file has already been uploaded.' % (username, package.name))
+        return None, 'package:%s version%s. That file has already been uploaded.' % (package.name, release.version)
+
+    # The digests were computed while the upload was spooled to disk, the
+    # client's digests are only checked against them
+    for field in ('md5_digest', 'sha256_digest'):
+        digest = fields[field].strip().lower()
+        if digest and digest != getattr(uploaded, field):
+            logger.info('user:%s package:%s. The %s of the upload does not match.' % (username, package.name, field))
+            return None, 'The %s of the uploaded file does not match, the upload may be corrupt.' % (field)
+    
+    new_file = Distribution(release=release,
+                            filetype=fields['filetype'],
+                            pyversion=fields['pyversion'],
+                            uploader=request.user,
+                            comment=fields['comment'],
+                            signature=fields['gpg_signature'],
+                            md5_digest=uploaded.md5_digest,
+                            sha256_digest=uploaded.sha256_digest,
+                            size=uploaded.size)
+    new_file.content.name = distribution_upload_to(new_file, uploaded.name)
+    
+    # The unique file name decides between concurrent uploads of the same
+    # file, the file itself is only written by the upload whose row went in,
+    # under a temporary name renamed into place
+    sid = transaction.savepoint()
+    try:
+        new_file.save()
+        save_atomic(new_file.content.storage, new_file.content.name, uploaded)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        logger.info('user:%s package:%s. That file has already been uploaded.' % (username, package.name))
+        return None, 'package:%s version%s. That file has already been uploaded.' % (package.name, release.version)
+    except Exception, e:
+        transaction.savepoint_rollback(sid)
+        raise
+    transaction.savepoint_commit(sid)
+    existing.add(uploaded.name)
+    # The fields posted are replaced by those in the file itself. Without
+    # JOB_QUEUE the archive is read right here, inside the upload request.
+    jobs.enqueue('extract_metadata', pk=new_file.pk)
+    return new_file, None
+
+def existing_files(release):
+    return set(os.path.basename(name) for name in
+               release.distributions.values_list('content', flat=True))
+
+@basic_auth
+@transaction.commit_on_success
+def register_or_upload(request):
+
+    username = request.user.username
+    
+    if request.method != 'POST':
+        logger.info('user:%s. Only post requests are supported.' % (username))
+        return HttpResponseBadRequest('Only post requests are supported.')
+
+    name = request.POST.get('name', '').strip()
+    
+    if not name:
+        logger.info('user:%s. No package name specified.' % (username))
+        return HttpResponseBadRequest('No package name specified.')
+
+    group, response = upload_group(request, name)
+    if response is not None:
+        return response
+    
+    # fetch existing package or create new one
+    package, created_package, response = upload_package(request, name,
+                                                         group)
+    if response is not None:
+        transaction.rollback()
+        return response
+
+    release, response = update_release(request, package)
+    if response is not None:
+        transaction.rollback()
+        return response
+
     if not 'content' in request.FILES:
         transaction.commit()
         logger.info('release registered')
         return HttpResponse('release registered')
     
     uploaded = request.FILES.get('content')
-    
-    for dist in release.distributions.all():
-        if os.path.basename(dist.content.name) == uploaded.name:
-            """ Need to add handling optionally deleting old and putting up new """
-            transaction.rollback()
-            logger.info('user:%s package:%s. That file has already been uploaded.' % (username, package.name))
-            return HttpResponseBadRequest('package:%s version%s. That file has already been uploaded.' % (package.name, version))
-
-    md5_digest = request.POST.get('md5_digest','')
-    
-    try:
-        new_file = Distribution.objects.create(release=release,
-                                               content=uploaded,
-                                               filetype=request.POST.get('filetype','sdist'),
-                                               pyversion=request.POST.get('pyversion',''),
-                                               uploader=request.user,
-                                               comment=request.POST.get('comment',''),
-                                               signature=request.POST.get('gpg_signature',''),
-                                               md5_digest=md5_digest)
-    except Exception, e:
+    new_file, error = add_distribution(request, release, uploaded,
+                                        existing_files(release),
+                                        file_fields(request.POST))
+    if new_file is None:
         transaction.rollback()
-        raise
+        return HttpResponseBadRequest(error)
     
     transaction.commit()
-    logger.info('user:%s package:%s version:%s uploaded:%s' % (username, package.name, version, datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S')))
+    logger.info('user:%s package:%s version:%s uploaded:%s' % (username, package.name, release.version, datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S')))
     if created_package:
         return HttpResponse(textwrap.dedent('''
             Upload accepted. Added new package %(package_name)s.
@@ -236,6 +360,95 @@ def register_or_upload(request):
         ))
     else:
         return HttpResponse('\nUpload accepted.\n')
+
+@basic_auth
+@transaction.commit_on_success
+def batch_upload(request):
+    """ Upload many files of one release in a single request. The request
+    carries the release metadata once and any number of ``content`` files,
+    per-file fields such as ``filetype`` are given once for all files or once
+    per file. The user is authorized and the release updated once, every
+    file is then added in the same transaction and the response lists the
+    outcome of each file as JSON. A file that is refused does not keep the
+    others from being added. When every file is refused nothing is kept, not
+    even a package or release the request created, and the response is a
+    400 with the same JSON. """
+    username = request.user.username
+
+    if request.method != 'POST':
+        logger.info('user:%s. Only post requests are supported.' % (username))
+        return HttpResponseBadRequest('Only post requests are supported.')
+
+    name = request.POST.get('name', '').strip()
+    if not name:
+        logger.info('user:%s. No package name specified.' % (username))
+        return HttpResponseBadRequest('No package name specified.')
+
+    files = request.FILES.getlist('content')
+    if not files:
+        logger.info('user:%s. No files uploaded.' % (username))
+        return HttpResponseBadRequest('No files uploaded.')
+
+    for field, default in FILE_FIELDS:
+        if len(request.POST.getlist(field)) not in (0, 1, len(files)):
+            return HttpResponseBadRequest('%s must be given once or once per '
+                                          'file.' % (field))
+
+    group, response = upload_group(request, name)
+    if response is not None:
+        return response
+
+    package, created_package, response = upload_package(request, name,
+                                                         group)
+    if response is not None:
+        transaction.rollback()
+        return response
+
+    release, response = update_release(request, package)
+    if response is not None:
+        transaction.rollback()
+        return response
+
+    existing = existing_files(release)
+    results, added = [], []
+    try:
+        for index, uploaded in enumerate(files):
+            new_file, error = add_distribution(request, release, uploaded,
+                existing, file_fields(request.POST, index, len(files)))
+            if new_file is None:
+                results.append({'filename': uploaded.name,
+                                'status': 'rejected', 'error': error})
+            else:
+                added.append(new_file)
+                results.append({'filename': uploaded.name,
+                                'status': 'uploaded',
+                                'url': new_file.get_absolute_url(),
+                                'sha256_digest': new_file.sha256_digest})
+    except Exception, e:
+        transaction.rollback()
+        # The rows of the files written so far are gone with the transaction
+        for new_file in added:
+            new_file.content.storage.delete(new_file.content.name)
+        raise
+
+    if not added:
+        transaction.rollback()
+        logger.info('user:%s package:%s version:%s all %d files rejected' % (username, package.name, release.version, len(files)))
+        return HttpResponseBadRequest(json.dumps({
+            'package': package.name,
+            'version': release.version,
+            'created_package': False,
+            'files': results,
+        }), mimetype='application/json')
+
+    transaction.commit()
+    logger.info('user:%s package:%s version:%s uploaded %d of %d files' % (username, package.name, release.version, len(added), len(files)))
+    return HttpResponse(json.dumps({
+        'package': package.name,
+        'version': release.version,
+        'created_package': created_package,
+        'files': results,
+    }), mimetype='application/json')
     
 
 def list_classifiers(request, mimetype='text/plain'):
@@ -1,17 +1,32 @@
 from django.conf import settings
 from django.db.models.query import Q
-from django.http import Http404, HttpResponseRedirect, HttpResponseForbidden
+from django.core.urlresolvers import resolve, reverse
+from django.http import Http404, HttpResponse, HttpResponseRedirect, \
+                        HttpResponsePermanentRedirect, HttpResponseForbidden
 from django.forms.models import inlineformset_factory
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
+from django.utils.cache import patch_vary_headers
 from django.views.generic import list_detail, create_update
 from django.contrib.auth.views import redirect_to_login
 
-from djangopypi import conf
-from djangopypi.http import login_basic_auth, HttpResponseUnauthorized
+from djangopypi import conf, proxy
+from djangopypi.http import login_basic_auth, negotiate, not_modified, \
+                            accepted_encodings, set_validators, \
+                            HttpResponseUnauthorized
 from djangopypi.decorators import user_owns_package, user_maintains_package
 from djangopypi.models import Package, Release
 from djangopypi.forms import SimplePackageSearchForm, PackageForm
+from djangopypi.stats import daily_downloads, release_downloads, \
+                             top_packages
+from djangopypi.simple import INDEX_TEMPLATE, PACKAGE_TEMPLATE, \
+                              HTML_CONTENT_TYPE, JSON_CONTENT_TYPE, \
+                              permission_key, index_page, package_page, \
+                              index_json, package_json, \
+                              available_encodings, \
+                              index_validators, package_validators
+
+SIMPLE_CONTENT_TYPES = ('text/html', HTML_CONTENT_TYPE, JSON_CONTENT_TYPE)
 
 def user_packages(user):
     ''' Return a list of packages that the user has permission to download '''
@@ -24,6 +39,61 @@ def user_packages(user):
             Q(download_permissions__in=user.groups.all())
         ).distinct()
 
+def user_may_download(user, package):
+    ''' Whether the user has permission to download a package, checked with
+    a single EXISTS query instead of going through user_packages '''
+    if user.is_superuser or package.allow_authenticated:
+        return True
+    return Package.objects.filter(
+        Q(download_permissions=None) |
+        Q(download_permissions__user=user),
+        pk=package.pk
+    ).exists()
+
+def get_package_or_404(name):
+    """ Fetch a package by any spelling of its name, see PEP 503 """
+    try:
+        return Package.objects.get_by_name(name)
+    except Package.DoesNotExist:
+        raise Http404('Package %s does not exist' % (name,))
+
+def canonical_redirect(request, package):
+    """ Redirect a request for a non-canonical spelling of a package name to
+    the same view under the real name of the package """
+    match = resolve(request.path_info)
+    kwargs = dict(match.kwargs, package=package.name)
+    url = reverse(match.url_name, kwargs=kwargs)
+    if request.META.get('QUERY_STRING'):
+        url = '%s?%s' % (url, request.META['QUERY_STRING'])
+    return HttpResponsePermanentRedirect(url)
+
+def simple_response(request, etag, last_modified, render_html, render_json,
+                    mimetype=None):
+    """ Answer a simple index request in the HTML or PEP 691 JSON format the
+    client asked for, pre-compressed when possible, or with a 304 when its
+    copy is still current. The render functions take the acceptable content
+    encodings and return a (content, content encoding) pair. """
+    content_type = negotiate(request, SIMPLE_CONTENT_TYPES)
+    if content_type != 'text/html':
+        etag = '%s-%s' % (etag, content_type.rsplit('+', 1)[1])
+        mimetype = content_type
+
+    encodings = accepted_encodings(request, available_encodings())
+    response = not_modified(request, etag, last_modified,
+        ['%s-%s' % (etag, encoding) for encoding in encodings])
+    if response is None:
+        if content_type == JSON_CONTENT_TYPE:
+            content, encoding = render_json(encodings)
+        else:
+            content, encoding = render_html(encodings)
+        response = HttpResponse(content, mimetype=mimetype)
+        if encoding:
+            response['Content-Encoding'] = encoding
+            etag = '%s-%s' % (etag, encoding)
+        set_validators(response, etag, last_modified)
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
+
 def index(request, **kwargs):
     kwargs.setdefault('template_object_name', 'package')
     kwargs.setdefault('queryset', Package.objects.all())
@@ -38,12 +108,19 @@ def simple_index(request, **kwargs):
     if user is None:
         return HttpResponseUnauthorized('pypi')
 
-    kwargs.setdefault('template_name', 'djangopypi/package_list_simple.html')
-    kwargs['queryset'] = user_packages(user)
-    return index(request, **kwargs)
+    kwargs.setdefault('template_name', INDEX_TEMPLATE)
+    key = permission_key(user)
+    etag, last_modified = index_validators(key)
+    return simple_response(request, etag, last_modified,
+                           lambda encodings: index_page(
+                               key, kwargs['template_name'], encodings),
+                           lambda encodings: index_json(key, encodings),
+                           mimetype=kwargs.get('mimetype'))
 
 def details(request, package, simple=False, **kwargs):
-    package = get_object_or_404(Package, name=package)
+    name, package = package, get_package_or_404(package)
+    if package.name != name:
+        return canonical_redirect(request, package)
     kwargs.setdefault('template_object_name', 'package')
 
     if not simple:
@@ -58,22 +135,68 @@ def details(request, package, simple=False, **kwargs):
 
     kwargs.setdefault('queryset', user_packages(user))
 
-    try:
-        return list_detail.object_detail(request, object_id=package, **kwargs)
-    except Http404:
+    token = getattr(user, 'api_token', None)
+    if ((token is not None and not token.allows(package)) or
+        not kwargs['queryset'].filter(pk=package.pk).exists()):
         return HttpResponseForbidden('You do not have sufficient \
                                       permissions to view this package')
 
+    etag, last_modified = package_validators(package, permission_key(user))
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        response = list_detail.object_detail(request, object_id=package.pk,
+                                             **kwargs)
+        set_validators(response, etag, last_modified)
+    return response
+
 def simple_details(request, package, **kwargs):
-    kwargs.setdefault('template_name', 'djangopypi/package_detail_simple.html')
+    kwargs.setdefault('template_name', PACKAGE_TEMPLATE)
     try:
-        return details(request, package, simple=True, **kwargs)
+        # Installers ask for the normalized name, answer under any spelling
+        # rather than costing them a redirect
+        package = get_package_or_404(package)
     except Http404, e:
-        if conf.PROXY_MISSING:
+        if conf.PROXY_CACHE:
+            # Only users of the index get to have packages mirrored
+            user = login_basic_auth(request)
+            if not user:
+                return HttpResponseUnauthorized('pypi')
+            token = getattr(user, 'api_token', None)
+            if token is not None and not token.allows(package):
+                return HttpResponseForbidden('You do not have sufficient \
+                                              permissions to view this package')
+            try:
+                package = proxy.mirror_package(package)
+            except proxy.UpstreamError, error:
+                return HttpResponse('The upstream index cannot be reached: '
+                                    '%s' % error, status=502)
+            if package is None:
+                raise e
+        elif conf.PROXY_MISSING:
             return HttpResponseRedirect('%s/%s/' % 
                                         (conf.PROXY_BASE_URL.rstrip('/'),
                                          package))
-        raise e
+        else:
+            raise e
+
+    user = login_basic_auth(request)
+    if not user:
+        return HttpResponseUnauthorized('pypi')
+    if conf.PROXY_CACHE and proxy.refresh_due(package):
+        proxy.refresh_package(package)
+
+    token = getattr(user, 'api_token', None)
+    if ((token is not None and not token.allows(package)) or
+        not user_may_download(user, package)):
+        return HttpResponseForbidden('You do not have sufficient \
+                                      permissions to view this package')
+
+    etag, last_modified = package_validators(package, permission_key(user))
+    return simple_response(request, etag, last_modified,
+                           lambda encodings: package_page(
+                               package, kwargs['template_name'], encodings),
+                           lambda encodings: package_json(package, encodings),
+                           mimetype=kwargs.get('mimetype'))
 
 def doap(request, package, **kwargs):
     kwargs.setdefault('template_name', 'djangopypi/package_doap.xml')
@@ -93,6 +216,56 @@ def search(request, **kwargs):
 
     return index(request, **kwargs)
 
+def _stats_days(request):
+    """ The number of days of statistics asked for """
+    try:
+        days = int(request.GET.get('days', conf.DOWNLOAD_STATS_DAYS))
+    except ValueError:
+        days = conf.DOWNLOAD_STATS_DAYS
+    return min(max(days, 1), 366)
+
+def stats(request, package, **kwargs):
+    """ The download statistics of a package: its downloads on each day and
+    those of each of its releases over the last ``days`` days """
+    name, package = package, get_package_or_404(package)
+    if package.name != name:
+        return canonical_redirect(request, package)
+    if not request.user.is_authenticated():
+        return redirect_to_login(request.get_full_path())
+    if not user_may_download(request.user, package):
+        return HttpResponseForbidden('You do not have sufficient \
+                                      permissions to view this package')
+
+    days = _stats_days(request)
+    daily = daily_downloads(package, days)
+    peak = max([downloads for day, downloads in daily] + [1])
+    context = {
+        'package': package,
+        'days': days,
+        'daily': [(day, downloads, downloads * 100 / peak)
+                  for day, downloads in daily],
+        'releases': release_downloads(package, days),
+        'total': sum(downloads for day, downloads in daily),
+    }
+    return render_to_response(
+        kwargs.get('template_name', 'djangopypi/package_stats.html'),
+        context, context_instance=RequestContext(request))
+
+def top(request, **kwargs):
+    """ The packages downloaded most over the last ``days`` days, of those
+    the user may download """
+    if not request.user.is_authenticated():
+        return redirect_to_login(request.get_full_path())
+    days = _stats_days(request)
+    context = {
+        'days': days,
+        'packages': top_packages(days, user_packages(request.user),
+                                 conf.DOWNLOAD_STATS_TOP),
+    }
+    return render_to_response(
+        kwargs.get('template_name', 'djangopypi/package_top.html'),
+        context, context_instance=RequestContext(request))
+
 @user_owns_package()
 def manage(request, package, **kwargs):
     kwargs['object_id'] = package
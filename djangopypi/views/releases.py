@@ -1,5 +1,7 @@
 import logging
+import mimetypes
 import os
+import urllib
 
 from django.db.models.query import Q
 from django.conf import settings
@@ -9,14 +11,18 @@ from django.http import Http404, HttpResponseForbidden, HttpResponse
 from django.views.generic import list_detail, create_update
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
+from django.utils.http import quote_etag, urlquote
 from django.contrib.auth.views import redirect_to_login
 
-from djangopypi import conf
+from djangopypi import conf, proxy
+from djangopypi.counters import count_download
 from djangopypi.decorators import user_maintains_package
 from djangopypi.models import Package, Release, Distribution
-from djangopypi.http import login_basic_auth, HttpResponseUnauthorized
+from djangopypi.http import login_basic_auth, file_response, \
+                            HttpResponseUnauthorized
 from djangopypi.forms import ReleaseForm, DistributionUploadForm
-from djangopypi.views.packages import user_packages
+from djangopypi.views.packages import user_may_download, get_package_or_404, \
+                                     canonical_redirect
 
 from sendfile import sendfile
 
@@ -50,7 +56,10 @@ def index(request, **kwargs):
 
 def details(request, package, version, simple=False, **kwargs):
     kwargs.setdefault('template_object_name', 'release')
-    release = get_object_or_404(Package, name=package).get_release(version)
+    name, package = package, get_package_or_404(package)
+    if package.name != name:
+        return canonical_redirect(request, package)
+    release = package.get_release(version)
 
     if not release:
         raise Http404('Version %s does not exist for %s' % (version,
@@ -233,38 +242,183 @@ def bootstrap_index(request):
         template_name='djangopypi/bootstrap.html',
     )
 
-def download_dist(request, path, document_root=None, show_indexes=False):
+def download_access(request, package):
+    """ Check whether the user of a request may download the files of a
+    package. Returns the name of the user and None when they may, or None
+    and the response refusing them. """
     log = logging.getLogger(__name__)
 
-    def serve(username, dist):
-        log.info('user: %s package: %s downloaded' % (username, package.name))
-        return sendfile(request, dist.content.path, attachment=True)
+    if not package.allow_authenticated and not package.download_permissions.exists():
+        # If no download permissions, anon users can access the package
+        return 'Anonymous', None
 
-    def forbidden(username, dist):
-        error = 'user: %s package: %s download permission denied' % (
-            username,
-            package.name
-        )
-        log.info(error)
-        return HttpResponseForbidden(error)
+    # Check authentication, falling-back to basic auth if necessary
+    if request.user.is_authenticated():
+        user = request.user
+    else:
+        user = login_basic_auth(request)
 
-    dist = get_object_or_404(Distribution, content=path)
-    package = dist.release.package
+    if user is None: # Specify 401 and await creds on next request
+        return None, HttpResponseUnauthorized('pypi')
+    token = getattr(user, 'api_token', None)
+    if ((token is None or token.allows(package)) and
+        user_may_download(user, package)):
+        return user.username, None
+    error = 'user: %s package: %s download permission denied' % (
+        user.username,
+        package.name
+    )
+    log.info(error)
+    return None, HttpResponseForbidden(error)
 
-    if package.download_permissions.count() == 0 and not package.allow_authenticated:
-        # If no download permissions, anon users can access the package
-        return serve('Anonymous', dist)
+def download_permitted(request, path):
+    """ Check whether the user of a request may download the distribution
+    stored at ``path`` without instantiating any model: a single indexed
+    query finds the package of the file and its download groups, and only
+    for restricted packages are the user, from cached credentials, and their
+    membership in those groups looked up. Returns the key and size of the
+    distribution, the names of its package and of the user, and None when the
+    download is allowed, or the response refusing it last. Raises Http404 for
+    unknown paths. """
+    log = logging.getLogger(__name__)
+
+    rows = list(Distribution.objects.filter(content=path).values_list(
+        'pk', 'size', 'release__package',
+        'release__package__allow_authenticated',
+        'release__package__download_permissions'))
+    if not rows:
+        raise Http404(u'No distribution at %s' % path)
+    pk, size, name, allow_authenticated = rows[0][:4]
+    groups = [row[4] for row in rows if row[4] is not None]
+    if not groups and not allow_authenticated:
+        return pk, size, name, 'Anonymous', None
+
+    if request.user.is_authenticated():
+        user = request.user
     else:
-        # Check authentication, falling-back to basic auth if necessary
-        if request.user.is_authenticated():
-            user = request.user
-        else:
-            user = login_basic_auth(request)
+        user = login_basic_auth(request)
+    if user is None:
+        return pk, size, name, None, HttpResponseUnauthorized('pypi')
 
-        if user is None: # Specify 401 and await creds on next request
-            return HttpResponseUnauthorized('pypi')
-        else:
-            if package in user_packages(user):
-                return serve(user.username, dist)
-            else:
-                return forbidden(user.username, dist)
+    token = getattr(user, 'api_token', None)
+    if ((token is None or token.allows(name)) and
+        (user.is_superuser or allow_authenticated or
+         user.groups.filter(pk__in=groups).exists())):
+        return pk, size, name, user.username, None
+    error = 'user: %s package: %s download permission denied' % (
+        user.username, name)
+    log.info(error)
+    return pk, size, name, user.username, HttpResponseForbidden(error)
+
+def range_size(request, path, size):
+    """ The size of the distribution file at ``path``, needed to tell whether
+    a range of it is the whole file. Uploaded files do not record their size,
+    it is read from the storage only when a range is requested. """
+    if size is None and request.META.get('HTTP_RANGE'):
+        return Distribution._meta.get_field('content').storage.size(path)
+    return size
+
+def download_auth(request):
+    """ Authorization endpoint for the auth_request module of nginx, which
+    serves the distribution files itself: answers 200 when the user may
+    download the file the original request asked for, otherwise 401 or 403,
+    which nginx passes on. Unknown files are refused as well, nginx treats
+    any other status as an error. """
+    uri = request.META.get(conf.DOWNLOAD_AUTH_URI_HEADER, '')
+    uri = urllib.unquote(uri.split('?', 1)[0])
+    prefix = settings.DJANGOPYPI_RELEASE_URL
+    if not uri.startswith(prefix):
+        return HttpResponseForbidden('Not a distribution file')
+    path = uri[len(prefix):]
+    try:
+        pk, size, name, username, response = download_permitted(request, path)
+    except Http404:
+        return HttpResponseForbidden('No such distribution file')
+    if response is not None:
+        return response
+    count_download(request, pk, range_size(request, path, size))
+    response = HttpResponse()
+    response['X-Package'] = name
+    return response
+
+def fetch_missing(dist):
+    """ Fetch the file of a distribution mirrored from the upstream index
+    when it is not stored yet. Returns the response to send instead of the
+    file when that fails, otherwise None. """
+    if dist.fetched:
+        return None
+    try:
+        proxy.fetch_distribution(dist)
+    except proxy.UpstreamError, e:
+        logging.getLogger(__name__).warning(
+            'Could not fetch %s from upstream: %s' % (dist.filename, e))
+        return HttpResponse('The file cannot be fetched from the upstream '
+                            'index.', status=502)
+    return None
+
+def download_dist(request, path, document_root=None, show_indexes=False):
+    log = logging.getLogger(__name__)
+
+    if conf.DOWNLOAD_ACCEL_REDIRECT:
+        # nginx sends the file, nothing but the permissions are needed
+        pk, size, name, username, response = download_permitted(request,
+                                                                path)
+        if response is not None:
+            return response
+        if conf.PROXY_CACHE and size is None:
+            dist = Distribution.objects.select_related('release').get(pk=pk)
+            response = fetch_missing(dist)
+            if response is not None:
+                return response
+            size = dist.size
+        count_download(request, pk, range_size(request, path, size))
+        filename = os.path.basename(path)
+        response = HttpResponse(mimetype=mimetypes.guess_type(filename)[0] or
+                                         'application/octet-stream')
+        response['X-Accel-Redirect'] = '%s/%s' % (
+            conf.DOWNLOAD_ACCEL_REDIRECT.rstrip('/'), urlquote(path))
+        response['Content-Disposition'] = 'attachment; filename="%s"' % (
+            filename)
+        log.info('user: %s package: %s downloaded' % (username, name))
+        return response
+
+    dist = get_object_or_404(
+        Distribution.objects.select_related('release__package'), content=path)
+    package = dist.release.package
+
+    username, response = download_access(request, package)
+    if response is not None:
+        return response
+    response = fetch_missing(dist)
+    if response is not None:
+        return response
+    log.info('user: %s package: %s downloaded' % (username, package.name))
+    etag = dist.sha256_digest or dist.md5_digest
+    if settings.SENDFILE_BACKEND == 'sendfile.backends.simple':
+        # No web server serves the file, ranges are handled here so that
+        # interrupted downloads can be resumed
+        response = file_response(request, dist.content.path, etag,
+                                 mimetypes.guess_type(dist.filename)[0],
+                                 dist.filename)
+        count_download(request, dist.pk, response=response)
+        return response
+    count_download(request, dist.pk, dist.file_size)
+    response = sendfile(request, dist.content.path, attachment=True)
+    if etag:
+        response['ETag'] = quote_etag(etag)
+    return response
+
+def download_metadata(request, path):
+    """ Serve the metadata file of a distribution read from it on upload
+    (PEP 658), to the users that may download the distribution """
+    dist = get_object_or_404(
+        Distribution.objects.select_related('release__package'), content=path)
+    if not dist.metadata:
+        raise Http404(u'No metadata for %s' % dist.filename)
+    username, response = download_access(request, dist.release.package)
+    if response is not None:
+        return response
+    response = HttpResponse(dist.metadata.encode('utf-8'),
+                            mimetype='text/plain; charset=utf-8')
+    response['ETag'] = '"%s"' % dist.metadata_digest
+    return response
@@ -0,0 +1,259 @@
+""" Resumable uploads of distribution files.
+
+A client opens an upload session with a POST to /uploads/ giving the name and
+version of the release and the name and size of the file. It then sends the
+file in any number of PUT requests to the session, each carrying its byte
+range in a Content-Range header, and asks for the number of bytes received
+so far with a GET after an interruption, resuming from there. A POST to the
+session with the SHA-256 digest of the file and the release metadata, as in a
+distutils upload, finally turns it into a distribution.
+
+The chunks are kept in a partial file on local disk until then, sessions
+that stop receiving data expire and are removed by the cleanup_uploads
+command. The size of a session and the number of sessions a user has open
+are limited, see CHUNKED_UPLOAD_MAX_SIZE and CHUNKED_UPLOAD_MAX_SESSIONS. """
+import logging
+import os
+from datetime import datetime
+
+from django.core.files.base import File
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, \
+                        HttpResponseForbidden, HttpResponseNotAllowed
+from django.utils import simplejson as json
+
+from djangopypi import conf
+from djangopypi.decorators import basic_auth, csrf_exempt
+from djangopypi.http import HttpResponseRequestEntityTooLarge, \
+                            parse_content_range, read_chunks
+from djangopypi.models import Package, Distribution, UploadSession, \
+                              upload_session_directory
+from djangopypi.utils import file_digests, generate_token
+from djangopypi.views.distutils import upload_group, upload_package, \
+                                       update_release, add_distribution, \
+                                       existing_files, file_fields
+
+logger = logging.getLogger(__name__)
+
+class PartialUploadFile(File):
+    """ The partial file of a complete upload session. Storage moves it into
+    place like a temporary upload instead of copying it. """
+
+    def __init__(self, session, md5_digest, sha256_digest):
+        super(PartialUploadFile, self).__init__(open(session.path, 'rb'),
+                                                session.filename)
+        self.md5_digest = md5_digest
+        self.sha256_digest = sha256_digest
+        self.size = session.size
+
+    def temporary_file_path(self):
+        return self.file.name
+
+def session_state(session, status=200):
+    response = HttpResponse(json.dumps({
+        'url': reverse('djangopypi-upload-session', args=(session.key,)),
+        'filename': session.filename,
+        'size': session.size,
+        'offset': session.received,
+    }), mimetype='application/json', status=status)
+    return response
+
+@csrf_exempt
+@basic_auth
+def create_upload(request):
+    """ Open an upload session """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    username = request.user.username
+    name = request.POST.get('name', '').strip()
+    version = request.POST.get('version', '').strip()
+    filename = os.path.basename(request.POST.get('filename', '').strip())
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        size = 0
+    if not (name and version and filename) or size <= 0:
+        logger.info('user:%s. Incomplete upload session request.' % (username))
+        return HttpResponseBadRequest('The name, version, filename and size '
+                                      'of the upload must be specified.')
+    if size > conf.CHUNKED_UPLOAD_MAX_SIZE:
+        logger.info('user:%s. Upload of %d bytes refused.' % (username, size))
+        return HttpResponseRequestEntityTooLarge(
+            'Uploads are limited to %d bytes.' % conf.CHUNKED_UPLOAD_MAX_SIZE)
+
+    # Refuse early what finalizing the upload would refuse anyway, before
+    # the file is sent
+    group, response = upload_group(request, name)
+    if response is not None:
+        return response
+    try:
+        package = Package.objects.get_by_name(name)
+    except Package.DoesNotExist:
+        package = None
+    if (package is not None and not request.user.is_superuser and
+        not package.owners.filter(pk=group.pk).exists()):
+        logger.info("user:%s package:%s. Not an owner of the package." % (username, name))
+        return HttpResponseForbidden('Only the owners of %s can upload new '
+                                     'versions of it.' % (package.name))
+    for existing in Distribution.objects.filter(release__package=package,
+            release__version=version).values_list('content', flat=True):
+        if os.path.basename(existing) == filename:
+            logger.info('user:%s package:%s. That file has already been uploaded.' % (username, name))
+            return HttpResponseBadRequest('package:%s version%s. That file has already been uploaded.' % (name, version))
+
+    # Expired sessions of the user are gone before the open ones are counted
+    for expired in UploadSession.objects.expired().filter(user=request.user):
+        expired.delete()
+    if (UploadSession.objects.filter(user=request.user).count() >=
+        conf.CHUNKED_UPLOAD_MAX_SESSIONS):
+        logger.info('user:%s. Too many open upload sessions.' % (username))
+        return HttpResponseForbidden('Too many uploads in progress, finish '
+                                     'or abandon one of them first.')
+
+    directory = upload_session_directory()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    session = UploadSession.objects.create(key=generate_token(),
+                                           user=request.user, package=name,
+                                           version=version, filename=filename,
+                                           size=size)
+    open(session.path, 'wb').close()
+    logger.info('user:%s package:%s version:%s. Upload session for %s opened.' % (username, name, version, filename))
+    response = session_state(session, status=201)
+    response['Location'] = request.build_absolute_uri(
+        reverse('djangopypi-upload-session', args=(session.key,)))
+    return response
+
+@csrf_exempt
+@basic_auth
+def upload_session(request, key):
+    """ Report the progress of an upload session on GET, receive a chunk on
+    PUT, finalize the upload on POST and abandon it on DELETE """
+    try:
+        session = UploadSession.objects.get(key=key, user=request.user)
+    except UploadSession.DoesNotExist:
+        raise Http404(u'No such upload session')
+    if not os.path.exists(session.path):
+        session.delete()
+        raise Http404(u'The upload session has expired')
+
+    if request.method == 'GET':
+        return session_state(session)
+    if request.method == 'PUT':
+        return receive_chunk(request, session)
+    if request.method == 'POST':
+        return finalize_upload(request, session)
+    if request.method == 'DELETE':
+        session.delete()
+        return HttpResponse(status=204)
+    return HttpResponseNotAllowed(['GET', 'PUT', 'POST', 'DELETE'])
+
+def receive_chunk(request, session):
+    """ Write a byte range of the file. A range may start anywhere up to the
+    end of the data received so far, so a chunk can be sent again after an
+    interruption; a range beyond it is refused with the current offset. """
+    content_range = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+    if content_range is None or content_range[2] != session.size:
+        return HttpResponseBadRequest('A Content-Range header with the size '
+                                      'of the upload is required.')
+    first, last, total = content_range
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length != last - first + 1:
+        return HttpResponseBadRequest('The length of the chunk does not '
+                                      'match its Content-Range.')
+    if first > session.received:
+        return session_state(session, status=409)
+
+    written = 0
+    fh = open(session.path, 'r+b')
+    try:
+        fh.seek(first)
+        for chunk in read_chunks(request, conf.UPLOAD_CHUNK_SIZE):
+            fh.write(chunk)
+            written += len(chunk)
+    finally:
+        fh.close()
+
+    # Whatever arrived of a chunk cut short is kept as well
+    now = datetime.now()
+    received = first + written
+    if not UploadSession.objects.filter(pk=session.pk,
+            received__lt=received).update(received=received, updated=now):
+        UploadSession.objects.filter(pk=session.pk).update(updated=now)
+    session.received = max(session.received, received)
+    if written != length:
+        return HttpResponseBadRequest('The chunk was cut short, resume the '
+                                      'upload at byte %d.' % session.received)
+    return session_state(session)
+
+@transaction.commit_on_success
+def finalize_upload(request, session):
+    """ Check the digest of the complete file and add it to its release the
+    way a distutils upload is added """
+    username = request.user.username
+    if not session.complete:
+        return session_state(session, status=409)
+
+    sha256_digest = request.POST.get('sha256_digest', '').strip().lower()
+    if not sha256_digest:
+        return HttpResponseBadRequest('The sha256_digest of the file must be '
+                                      'specified.')
+    fh = File(open(session.path, 'rb'))
+    try:
+        md5_digest, digest, size = file_digests(fh)
+    finally:
+        fh.close()
+    if digest != sha256_digest or size != session.size:
+        # Some chunk was corrupted on the way, there is no telling which
+        logger.info('user:%s package:%s. The sha256_digest of the upload does not match.' % (username, session.package))
+        session.delete()
+        return HttpResponseBadRequest('The sha256_digest of the uploaded file '
+                                      'does not match, the upload has been '
+                                      'discarded.')
+
+    post = request.POST.copy()
+    post['name'] = session.package
+    post['version'] = session.version
+    request.POST = post
+
+    group, response = upload_group(request, session.package)
+    if response is not None:
+        return response
+    package, created_package, response = upload_package(request,
+        session.package, group)
+    if response is not None:
+        transaction.rollback()
+        return response
+    release, response = update_release(request, package)
+    if response is not None:
+        transaction.rollback()
+        return response
+
+    uploaded = PartialUploadFile(session, md5_digest, digest)
+    try:
+        new_file, error = add_distribution(request, release, uploaded,
+                                           existing_files(release),
+                                           file_fields(post))
+    finally:
+        uploaded.close()
+    if new_file is None:
+        # The session stays, the upload can be finalized again with
+        # corrected metadata
+        transaction.rollback()
+        return HttpResponseBadRequest(error)
+
+    session.delete()
+    transaction.commit()
+    logger.info('user:%s package:%s version:%s uploaded:%s' % (username, package.name, release.version, session.filename))
+    return HttpResponse(json.dumps({
+        'package': package.name,
+        'version': release.version,
+        'filename': session.filename,
+        'url': new_file.get_absolute_url(),
+        'sha256_digest': new_file.sha256_digest,
+    }), mimetype='application/json')
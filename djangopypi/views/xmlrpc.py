@@ -35,7 +35,7 @@ def list_packages(request):
 
 def package_releases(request, package_name, show_hidden=False):
     try:
-        return XMLRPCResponse(params=(list(Package.objects.get(name=package_name).releases.filter(hidden=show_hidden).values_list('version', flat=True)),))
+        return XMLRPCResponse(params=(list(Package.objects.get_by_name(package_name).releases.filter(hidden=show_hidden).values_list('version', flat=True)),))
     except Package.DoesNotExist:
         return XMLRPCResponse(params=([],))
 
@@ -44,14 +44,16 @@ def release_urls(request, package_name, version):
                               request.get_host())
     dists = []
     try:
-        for dist in Package.objects.get(name=package_name).releases.get(version=version).distributions.all():
+        for dist in Package.objects.get_by_name(package_name).releases.get(version=version).distributions.all():
             dists.append({
                 'url': '%s%s' % (base_url, dist.get_absolute_url()),
                 'packagetype': dist.filetype,
                 'filename': dist.filename,
-                'size': dist.content.size,
+                'size': dist.file_size or 0,
                 'md5_digest': dist.md5_digest,
-                'downloads': 0,
+                'digests': {'md5': dist.md5_digest,
+                            'sha256': dist.sha256_digest},
+                'downloads': dist.downloads,
                 'has_sig': len(dist.signature)>0,
                 'python_version': dist.pyversion,
                 'comment_text': dist.comment
@@ -89,9 +91,11 @@ def release_data(request, package_name, version):
         'project_url': '',
     }
     try:
-        release = Package.objects.get(name=package_name).releases.get(version=version)
-        output.update({'name': package_name, 'version': version,})
+        package = Package.objects.get_by_name(package_name)
+        release = package.releases.get(version=version)
+        output.update({'name': package.name, 'version': version,})
         output.update(release.package_info)
+        output['downloads'] = release.downloads
     except (Package.DoesNotExist, Release.DoesNotExist):
         pass
     